@@ -2,9 +2,11 @@
 Flask web app for route planning and map generation.
 Provides endpoints to render the home page and generate routes.
 """
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import os
+import json
 import map_construction
+from vehicle_profiles import VEHICLE_PROFILES
 
 # Initialize Flask app
 app = Flask(__name__, static_folder="static")
@@ -24,10 +26,18 @@ def generate_route():
         initial_soc = float(request.form["initial_soc"])
         threshold_soc = float(request.form["threshold_soc"])
         consumption_rate = float(request.form["consumption_rate"])
+        # optional wall-clock budget of the route search in seconds, and vehicle energy profile
+        time_budget = float(request.form["time_budget"]) if request.form.get("time_budget") else None
+        vehicle_profile = request.form.get("vehicle_profile") or None
+        if vehicle_profile is not None and vehicle_profile not in VEHICLE_PROFILES:
+            return jsonify({"success": False, "error": f"Unknown vehicle profile: {vehicle_profile}"})
+        # optional number of candidate charging stations evaluated for a two-segment route
+        two_segment_candidates = int(request.form["two_segment_candidates"]) if request.form.get("two_segment_candidates") else None
         
         # execute the route planning function
         road_network, charging_stations, paths, costs, map_filename_or_status, legend_html = map_construction.test_route_planning(
-            start, destination, initial_soc, threshold_soc, consumption_rate
+            start, destination, initial_soc, threshold_soc, consumption_rate, time_budget=time_budget,
+            vehicle_profile=vehicle_profile, two_segment_candidates=two_segment_candidates
         )
 
         if map_filename_or_status == "invalid_address":
@@ -48,12 +58,73 @@ def generate_route():
         else:
             return jsonify({"success": False, "error": f"Map file {expected_map_filename} was not generated."})
 
-        return jsonify({"success": True, "map_url": "/" + static_map_path, "legend_html": legend_html})
+        # complete is False when the search budget expired before the Pareto front was proven complete
+        complete = all(cost.get("complete", True) for cost in costs)
+        return jsonify({"success": True, "map_url": "/" + static_map_path, "legend_html": legend_html,
+                        "complete": complete})
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@app.route("/stream-route")
+def stream_route():
+    # Server-Sent Events endpoint: streams the Pareto-optimal routes as the search finds them
+    try:
+        start = request.args["start"]
+        destination = request.args["destination"]
+        initial_soc = float(request.args["initial_soc"])
+        threshold_soc = float(request.args["threshold_soc"])
+        consumption_rate = float(request.args["consumption_rate"])
+        time_budget = float(request.args["time_budget"]) if request.args.get("time_budget") else None
+        vehicle_profile = request.args.get("vehicle_profile") or None
+        if vehicle_profile is not None and vehicle_profile not in VEHICLE_PROFILES:
+            raise ValueError(f"unknown vehicle profile {vehicle_profile}")
+    except (KeyError, ValueError) as e:
+        return jsonify({"success": False, "error": f"Invalid route parameters: {e}"})
+    
+    def events():
+        for event in map_construction.stream_route_planning(start, destination, initial_soc, threshold_soc,
+                                                            consumption_rate, time_budget=time_budget,
+                                                            vehicle_profile=vehicle_profile):
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/soc-sweep", methods=["POST"])
+def soc_sweep():
+    # What-if endpoint: the routes of several battery scenarios from a single search, without maps
+    try:
+        start = request.form["start"]
+        destination = request.form["destination"]
+        consumption_rate = float(request.form["consumption_rate"])
+        # comma-separated initial SOC values, with one threshold for all of them or one per value
+        initial_socs = [float(value) for value in request.form["initial_soc"].split(",")]
+        threshold_socs = [float(value) for value in request.form["threshold_soc"].split(",")]
+        if len(threshold_socs) == 1:
+            threshold_socs = threshold_socs * len(initial_socs)
+        if len(threshold_socs) != len(initial_socs):
+            raise ValueError("expected one threshold_soc or one per initial_soc")
+        time_budget = float(request.form["time_budget"]) if request.form.get("time_budget") else None
+        vehicle_profile = request.form.get("vehicle_profile") or None
+        if vehicle_profile is not None and vehicle_profile not in VEHICLE_PROFILES:
+            raise ValueError(f"unknown vehicle profile {vehicle_profile}")
+    except (KeyError, ValueError) as e:
+        return jsonify({"success": False, "error": f"Invalid route parameters: {e}"})
+    
+    try:
+        result = map_construction.sweep_route_planning(start, destination, list(zip(initial_socs, threshold_socs)),
+                                                       consumption_rate, time_budget=time_budget,
+                                                       vehicle_profile=vehicle_profile)
+        return jsonify(dict(result, success=True))
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
 if __name__ == "__main__":
+    # Start the section pool of the two-segment routes before the server threads. In debug mode the
+    # reloader serves the app from a child process, so only that process starts one.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        map_construction.start_section_pool()
     # Run the Flask development server with debug mode on
     app.run(debug=True)
 
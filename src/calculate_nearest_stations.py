@@ -2,8 +2,27 @@ import json
 import networkx as nx
 import math
 from math import radians, sin, cos, sqrt, atan2
+import heapq
 import time
 import os
+import argparse
+import hashlib
+import multiprocessing
+import numpy as np
+from intersections_store import (IntersectionsWriter, read_ndjson_intersections, load_intersections, save_station_table,
+                                 compact_intersections, write_intersections, newest_file)
+
+MAX_STATION_DISTANCE = 100000 # Nodes farther than this (in meters) from every station get no nearest station
+
+SHARD_DIR = os.path.join("results", "shards")
+DEFAULT_SHARD_SIZE = 20000 # Target number of nodes per shard
+SHARD_TILE_DEGREES = 0.25 # Spatial tile size for pairwise shards and station groups
+SHARD_FORMAT = 2 # Version of the shard files, results of an older version are not resumed
+PAIRWISE_PROGRESS_FILE = "intersections_pairwise.ndjson"
+TOP_K_FILE = "intersections_bc_regions_topk.npz"
+
+# Graph and station data shared with the pool workers, inherited through fork instead of pickled per task
+_shard_context = None
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -149,49 +168,395 @@ def find_nearest_charging_station(node_id, G, charging_stations):
                 min_road_distance = road_dist
                 nearest_station = station
     
-    if min_road_distance == float('inf'):
+    fallback = min_road_distance == float('inf')
+    if fallback:
         nearest_station = closest_station
         min_road_distance = min_direct_dist
         print(f"      Warning: No road path found for node {node_id}, using direct distance")
     
-    if nearest_station is None or min_road_distance > 100000:
+    if nearest_station is None or min_road_distance > MAX_STATION_DISTANCE:
         return {"nearest_charging_station": None}
     
-    return {
-        "nearest_charging_station": {
-            "distance": min_road_distance,
-            "name": nearest_station.get('name', 'Unknown Station'),
+    entry = {
+        "distance": min_road_distance,
+        "name": nearest_station.get('name', 'Unknown Station'),
+        "location": {
+            "latitude": nearest_station.get('location', {}).get('latitude'),
+            "longitude": nearest_station.get('location', {}).get('longitude')
+        }
+    }
+    if fallback:
+        entry["fallback"] = True
+    return {"nearest_charging_station": entry}
+
+def build_road_adjacency(roads_data, direction="undirected"):
+    """
+    Build an adjacency list straight from the roads JSON data
+
+    Parameters:
+    roads_data: parsed roads_bc_regions.json
+    direction: "undirected" ignores one-way information,
+               "forward" follows the edges as stored (driving away from a node),
+               "reverse" follows them backwards (driving towards a node)
+
+    Returns:
+    Dictionary {node_id: [(neighbor_id, length), ...]}. Parallel edges are
+    collapsed to the shortest one.
+    """
+    shortest = {}
+
+    for edge in roads_data['edges']:
+        source = int(edge['source'])
+        target = int(edge['target'])
+        if source == target:
+            continue
+
+        length = float(edge.get('length', 0) or 0)
+        if direction == "undirected":
+            pair = (source, target) if source < target else (target, source)
+        elif direction == "reverse":
+            pair = (target, source)
+        else:
+            pair = (source, target)
+
+        if length < shortest.get(pair, float('inf')):
+            shortest[pair] = length
+
+    adjacency = {int(node_id): [] for node_id in roads_data['nodes']}
+    for (u, v), length in shortest.items():
+        adjacency.setdefault(u, []).append((v, length))
+        if direction == "undirected":
+            adjacency.setdefault(v, []).append((u, length))
+
+    return adjacency
+
+def snap_stations_to_road_nodes(roads_data, charging_stations):
+    """
+    Find the closest road node (straight-line) for every charging station
+
+    Returns:
+    List of (closest_node_id, snap_distance) tuples, in the order of charging_stations
+    """
+    node_ids = []
+    lats = []
+    lons = []
+    for node_id, data in roads_data['nodes'].items():
+        if data.get('is_charging_station', False):
+            continue
+        if data.get('y') is None or data.get('x') is None:
+            continue
+        node_ids.append(int(node_id))
+        lats.append(data['y'])
+        lons.append(data['x'])
+
+    if not node_ids:
+        return [(None, float('inf')) for _ in charging_stations]
+
+    lat_rad = np.radians(np.array(lats))
+    lon_rad = np.radians(np.array(lons))
+
+    snapped = []
+    for station in charging_stations:
+        station_lat = radians(station['location']['latitude'])
+        station_lon = radians(station['location']['longitude'])
+
+        a = (np.sin((lat_rad - station_lat) / 2) ** 2 +
+             np.cos(station_lat) * np.cos(lat_rad) * np.sin((lon_rad - station_lon) / 2) ** 2)
+        distances = 6371000 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        idx = int(np.argmin(distances))
+        snapped.append((node_ids[idx], float(distances[idx])))
+
+    return snapped
+
+def find_station_sources(roads_data, adjacency, charging_stations):
+    """
+    Collect the Dijkstra sources for the nearest-station search
+
+    The charging station nodes inserted by
+    get_road_networks.connect_charging_stations_to_road_network are used directly.
+    If the road data has no station nodes, every station is snapped to its closest
+    road node instead and seeded with the snap distance.
+
+    Returns:
+    Tuple of (sources, station_info) where sources is {node_id: initial_distance}
+    and station_info is {node_id: {"name": ..., "location": {...}}}
+    """
+    sources = {}
+    station_info = {}
+
+    for node_id, data in roads_data['nodes'].items():
+        if data.get('is_charging_station', False):
+            node_id = int(node_id)
+            sources[node_id] = 0
+            station_info[node_id] = {
+                "name": data.get('station_name') or 'Unnamed',
+                "location": {
+                    "latitude": data.get('y'),
+                    "longitude": data.get('x')
+                }
+            }
+
+    if sources:
+        return sources, station_info
+
+    print("    No charging station nodes in road data, snapping stations to the closest road nodes...")
+    next_id = max(adjacency) + 1 if adjacency else 1000000
+
+    for i, (station, (closest_node, snap_dist)) in enumerate(
+            zip(charging_stations, snap_stations_to_road_nodes(roads_data, charging_stations))):
+        if closest_node is None:
+            continue
+
+        # Virtual station node hanging off its closest road node, like the real connector edges
+        station_node = next_id + i
+        adjacency[station_node] = [(closest_node, snap_dist)]
+        adjacency[closest_node].append((station_node, snap_dist))
+
+        sources[station_node] = 0
+        station_info[station_node] = {
+            "name": station.get('name', 'Unnamed'),
             "location": {
-                "latitude": nearest_station.get('location', {}).get('latitude'),
-                "longitude": nearest_station.get('location', {}).get('longitude')
+                "latitude": station['location']['latitude'],
+                "longitude": station['location']['longitude']
             }
         }
-    }
 
-def calculate_nearest_stations():
+    return sources, station_info
+
+def multi_source_dijkstra(adjacency, sources, max_distance=None):
     """
-    Calculate the actual road distance from each road node to the nearest charging station
+    Label every reachable node with its nearest source in one Dijkstra pass
+
+    Parameters:
+    adjacency: {node_id: [(neighbor_id, weight), ...]}
+    sources: {source_node: initial_distance}
+    max_distance: optional search radius, nodes beyond it stay unlabeled
+
+    Returns:
+    Tuple of (distances, nearest_source) dictionaries keyed by node ID.
+    Ties are broken by the smaller source ID so results are deterministic.
+    """
+    distances = {}
+    nearest_source = {}
+    best = {}
+
+    heap = []
+    for source, initial_distance in sources.items():
+        best[source] = (initial_distance, source)
+        heap.append((initial_distance, source, source))
+    heapq.heapify(heap)
+
+    while heap:
+        dist, source, node = heapq.heappop(heap)
+        if node in distances:
+            continue
+
+        distances[node] = dist
+        nearest_source[node] = source
+
+        for neighbor, weight in adjacency.get(node, ()):
+            if neighbor in distances:
+                continue
+
+            label = (dist + weight, source)
+            if max_distance is not None and label[0] > max_distance:
+                continue
+            if neighbor in best and best[neighbor] <= label:
+                continue
+
+            best[neighbor] = label
+            heapq.heappush(heap, (label[0], source, neighbor))
+
+    return distances, nearest_source
+
+def k_nearest_dijkstra(adjacency, sources, k, max_distance=None):
+    """
+    Label every reachable node with its k nearest sources in one Dijkstra pass
+
+    Every node keeps at most one label per source and at most k labels. Beyond
+    max_distance only the first label of a node is kept, so unreachable nodes can
+    still be told apart from nodes whose stations are all out of range.
+
+    Returns:
+    Dictionary {node_id: [(distance, source), ...]} with the labels nearest first
+    """
+    labels = {}
+
+    heap = [(initial_distance, source, source) for source, initial_distance in sources.items()]
+    heapq.heapify(heap)
+
+    while heap:
+        dist, source, node = heapq.heappop(heap)
+        node_labels = labels.setdefault(node, [])
+        if len(node_labels) >= k or any(label_source == source for _, label_source in node_labels):
+            continue
+        if max_distance is not None and dist > max_distance and node_labels:
+            continue
+
+        node_labels.append((dist, source))
+
+        for neighbor, weight in adjacency.get(node, ()):
+            new_dist = dist + weight
+            neighbor_labels = labels.get(neighbor)
+            if neighbor_labels:
+                if len(neighbor_labels) >= k or (max_distance is not None and new_dist > max_distance):
+                    continue
+                if any(label_source == source for _, label_source in neighbor_labels):
+                    continue
+            heapq.heappush(heap, (new_dist, source, neighbor))
+
+    return labels
+
+def nearest_station_entries(roads_data, adjacency, sources, station_info, node_ids=None):
+    """
+    Run one multi-source Dijkstra over the given adjacency and build the
+    "nearest_charging_station" entry of every road node
+
+    Parameters:
+    sources, station_info: as returned by find_station_sources
+    node_ids: optional list of node IDs to label. The search is then seeded only
+              from the stations among them, so it should be a union of
+              connected components.
+
+    Returns:
+    Dictionary {node_id_str: entry}, nodes without a station within range are left out
+    """
+    if node_ids is not None:
+        node_set = set(node_ids)
+        sources = {node: dist for node, dist in sources.items() if node in node_set}
+
+    distances, nearest_source = multi_source_dijkstra(adjacency, sources)
+
+    return station_entries(roads_data, distances, nearest_source, station_info, node_ids)
+
+def station_entries(roads_data, distances, nearest_source, station_info, node_ids=None, reachable=None):
+    """
+    Build the "nearest_charging_station" entries from the labels of a multi-source search
+
+    Parameters:
+    distances, nearest_source: labels as returned by multi_source_dijkstra
+    node_ids: optional list of the node IDs to build entries for, instead of all road nodes
+    reachable: nodes with a road path to a station, for labels searched only up to
+               MAX_STATION_DISTANCE. Unlabeled nodes among them are out of range, the
+               other unlabeled nodes get the straight-line fallback.
+
+    Returns:
+    Dictionary {node_id_str: entry}, nodes without a station within range are left out
+    """
+    if node_ids is None:
+        nodes = ((int(node_id), node_data) for node_id, node_data in roads_data['nodes'].items())
+    else:
+        # Virtual station nodes of snapped stations are not road nodes and get no entry
+        nodes = ((node, roads_data['nodes'][str(node)]) for node in node_ids if str(node) in roads_data['nodes'])
+
+    station_nodes = list(station_info)
+    entries = {}
+    unreached = 0
+
+    for node, node_data in nodes:
+        fallback = node not in distances
+        if fallback and reachable is not None and node in reachable:
+            continue
+        if not fallback:
+            distance = distances[node]
+            station = station_info[nearest_source[node]]
+
+            if distance > MAX_STATION_DISTANCE:
+                continue
+        else:
+            # Same fallback as the pairwise search: straight-line distance when no road path exists
+            if node_data.get('y') is None or node_data.get('x') is None:
+                continue
+
+            unreached += 1
+            distance = float('inf')
+            station = None
+            for station_node in station_nodes:
+                location = station_info[station_node]['location']
+                direct_dist = haversine_distance(node_data['y'], node_data['x'],
+                                                 location['latitude'], location['longitude'])
+                if direct_dist < distance:
+                    distance = direct_dist
+                    station = station_info[station_node]
+
+            if station is None or distance > MAX_STATION_DISTANCE:
+                continue
+
+        entries[str(node)] = {
+            "distance": distance,
+            "name": station["name"],
+            "location": {
+                "latitude": station["location"]["latitude"],
+                "longitude": station["location"]["longitude"]
+            }
+        }
+        if fallback:
+            # Marks straight-line labels for patch_nearest_stations, which recomputes them
+            entries[str(node)]["fallback"] = True
+
+    if unreached and node_ids is None:
+        print(f"    {unreached} nodes have no road path to a station within range, checked direct distance instead")
+
+    return entries
+
+def label_nearest_stations(roads_data, charging_stations, directed=False, include_from=False):
+    """
+    Calculate the nearest charging station of every road node with a single
+    multi-source Dijkstra seeded from all charging station nodes
+
+    Parameters:
+    directed: respect one-way roads. The search runs over the reversed edges so
+              "distance" is the distance a driver has to drive to reach the station
+    include_from: with directed, also run one pass over the forward edges and store
+                  the distance driven from the nearest station to the node under
+                  "nearest_charging_station_from"
+
+    Returns:
+    intersections dictionary in the intersections_bc_regions.json format
+    """
+    if not directed:
+        entries = station_label_pass(roads_data, build_road_adjacency(roads_data), charging_stations)
+        return {node_id: {"nearest_charging_station": entry} for node_id, entry in entries.items()}
+
+    print("    Drive-to-station pass (reversed edges)...")
+    to_entries = station_label_pass(roads_data, build_road_adjacency(roads_data, "reverse"), charging_stations)
+
+    from_entries = {}
+    if include_from:
+        print("    Drive-from-station pass (forward edges)...")
+        from_entries = station_label_pass(roads_data, build_road_adjacency(roads_data, "forward"), charging_stations)
+
+    return merge_station_entries(to_entries, from_entries)
+
+def station_label_pass(roads_data, adjacency, charging_stations):
+    """
+    Seed the sources for one adjacency and label all nodes in a single pass
+    """
+    sources, station_info = find_station_sources(roads_data, adjacency, charging_stations)
+    print(f"    Seeding search from {len(sources)} charging station nodes")
+
+    entries = nearest_station_entries(roads_data, adjacency, sources, station_info)
+    print(f"    ✓ Labeled {len(entries)} nodes with a charging station in range")
+
+    return entries
+
+def merge_station_entries(to_entries, from_entries):
+    """
+    Combine drive-to and drive-from entries into intersections records
+    """
+    intersections = {}
+    for node_id, entry in to_entries.items():
+        intersections[node_id] = {"nearest_charging_station": entry}
+        if node_id in from_entries:
+            intersections[node_id]["nearest_charging_station_from"] = from_entries[node_id]
+
+    return intersections
+
+def build_undirected_road_graph(roads_data):
+    """
+    Create the undirected networkx graph used by the pairwise search
     """
-    start_time_total = time.time()
-    
-    print("Loading road network data...")
-    try:
-        with open("roads_bc_regions.json", "r") as f:
-            roads_data = json.load(f)
-        print(f"    ✓ Loaded road network with {len(roads_data['nodes'])} nodes and {len(roads_data['edges'])} edges")
-    except Exception as e:
-        print(f"    Error loading road network data: {str(e)}")
-        return
-    
-    print("\nLoading charging station data...")
-    try:
-        with open("charging_stations_bc_regions.json", "r") as f:
-            all_charging_stations = json.load(f)
-        print(f"    ✓ Loaded {len(all_charging_stations)} charging stations")
-    except Exception as e:
-        print(f"    Error loading charging station data: {str(e)}")
-        return
-    
     print("\nCreating road network graph (undirected)...")
     road_network = nx.Graph()
     
@@ -211,6 +576,47 @@ def calculate_nearest_stations():
         road_network.add_edge(source, target, **edge_attrs)
     
     print(f"    ✓ Created graph with {road_network.number_of_nodes()} nodes and {road_network.number_of_edges()} edges")
+
+    return road_network
+
+def pairwise_intersection(node_id, road_network, all_charging_stations):
+    """
+    Run the pairwise search for one node
+
+    Returns:
+    intersections record for the node, or None if no station is in range
+    """
+    nearest_info = find_nearest_charging_station(node_id, road_network, all_charging_stations)
+    
+    if not nearest_info["nearest_charging_station"]:
+        return None
+
+    station_info = nearest_info["nearest_charging_station"]
+    nearest_info["nearest_charging_station"] = {
+        "distance": station_info.get("distance"),
+        "name": station_info.get("name", "Unnamed"),
+        "location": {
+            "latitude": station_info.get("location", {}).get("latitude"),
+            "longitude": station_info.get("location", {}).get("longitude")
+        }
+    }
+    if station_info.get("fallback"):
+        nearest_info["nearest_charging_station"]["fallback"] = True
+
+    return nearest_info
+
+def calculate_nearest_stations_pairwise(roads_data, all_charging_stations):
+    """
+    Original per-node search: one shortest path query per node and candidate station
+
+    Results are appended to results/intersections_pairwise.ndjson as they are
+    computed. Nodes already in that file are skipped, so delete it when the road
+    or station data changes.
+
+    Returns:
+    Tuple of (intersections, processed_count)
+    """
+    road_network = build_undirected_road_graph(roads_data)
     
     print("\nAnalyzing graph connectivity...")
     connected_components = list(nx.connected_components(road_network))
@@ -222,7 +628,6 @@ def calculate_nearest_stations():
     
     processed_count = 0
     total_nodes = len(road_network.nodes())
-    intersections = {}
     start_time = time.time()
     
     all_nodes = list(road_network.nodes())
@@ -231,69 +636,520 @@ def calculate_nearest_stations():
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    print(f"Processing {total_nodes} nodes sequentially...")
+    # Every node is appended once to the progress file, so an interrupted run picks up where it stopped
+    progress_file = os.path.join(output_dir, PAIRWISE_PROGRESS_FILE)
+    already_done = set()
+    if os.path.exists(progress_file):
+        already_done = set(read_ndjson_intersections(progress_file, include_empty=True))
+        print(f"Resuming from {progress_file}: {len(already_done)} nodes already processed")
+    
+    print(f"Processing {total_nodes - len(already_done)} nodes sequentially...")
     print(f"Progress updates every 100 nodes, checkpoints every 1000 nodes")
     print(f"Started at: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     print("-" * 80)
     
     checkpoint_interval = 1000
+    remaining_nodes = total_nodes - len(already_done)
     
-    for node_id in all_nodes:
-        try:
-            nearest_info = find_nearest_charging_station(node_id, road_network, all_charging_stations)
-            
-            if nearest_info["nearest_charging_station"]:
-                station_info = nearest_info["nearest_charging_station"]
-                nearest_info["nearest_charging_station"] = {
-                    "distance": station_info.get("distance"),
-                    "name": station_info.get("name", "Unnamed"),
-                    "location": {
-                        "latitude": station_info.get("location", {}).get("latitude"),
-                        "longitude": station_info.get("location", {}).get("longitude")
-                    }
-                }
-                
-                intersections[str(node_id)] = nearest_info
-            
-            processed_count += 1
-            
-            if processed_count % 100 == 0:
-                elapsed = time.time() - start_time
-                nodes_per_second = processed_count / elapsed if elapsed > 0 else 0
-                estimated_total = total_nodes / nodes_per_second if nodes_per_second > 0 else 0
-                remaining = estimated_total - elapsed
-                
-                hours_remaining = int(remaining // 3600)
-                minutes_remaining = int((remaining % 3600) // 60)
-                seconds_remaining = int(remaining % 60)
-                
-                current_time = time.strftime('%Y-%m-%d %H:%M:%S')
+    with IntersectionsWriter(progress_file, flush_interval=checkpoint_interval) as writer:
+        for node_id in all_nodes:
+            if str(node_id) in already_done:
+                continue
+
+            try:
+                nearest_info = pairwise_intersection(node_id, road_network, all_charging_stations)
+                writer.write(node_id, nearest_info)
                 
-                print(f"[{current_time}] Processed: {processed_count}/{total_nodes} nodes ({processed_count/total_nodes*100:.2f}%)")
-                print(f"    Speed: {nodes_per_second:.2f} nodes/second")
-                print(f"    Est. remaining: {hours_remaining}h {minutes_remaining}m {seconds_remaining}s")
-                print(f"    Est. completion: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + remaining))}")
-                print("-" * 40)
-            
-            if processed_count % checkpoint_interval == 0:
-                checkpoint_file = os.path.join(output_dir, f"intersections_checkpoint_{processed_count}.json")
-                with open(checkpoint_file, "w") as f:
-                    json.dump(intersections, f, indent=2)
-                print(f"    ✓ Saved checkpoint at {processed_count} nodes to {checkpoint_file}")
+                processed_count += 1
                 
-                sample_node = next(iter(intersections))
-                print(f"    Sample data structure for node {sample_node}:")
-                print(f"    {json.dumps(intersections[sample_node], indent=4)}")
-                print("-" * 40)
+                if processed_count % 100 == 0:
+                    elapsed = time.time() - start_time
+                    nodes_per_second = processed_count / elapsed if elapsed > 0 else 0
+                    estimated_total = remaining_nodes / nodes_per_second if nodes_per_second > 0 else 0
+                    remaining = estimated_total - elapsed
+                    
+                    hours_remaining = int(remaining // 3600)
+                    minutes_remaining = int((remaining % 3600) // 60)
+                    seconds_remaining = int(remaining % 60)
+                    
+                    current_time = time.strftime('%Y-%m-%d %H:%M:%S')
+                    
+                    print(f"[{current_time}] Processed: {processed_count}/{remaining_nodes} nodes ({processed_count/remaining_nodes*100:.2f}%)")
+                    print(f"    Speed: {nodes_per_second:.2f} nodes/second")
+                    print(f"    Est. remaining: {hours_remaining}h {minutes_remaining}m {seconds_remaining}s")
+                    print(f"    Est. completion: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + remaining))}")
+                    print("-" * 40)
                 
-        except Exception as e:
-            print(f"    Error processing node {node_id}: {str(e)}")
+                if processed_count % checkpoint_interval == 0:
+                    print(f"    ✓ Flushed {writer.count} new nodes to {progress_file}")
+                    print("-" * 40)
+                    
+            except Exception as e:
+                print(f"    Error processing node {node_id}: {str(e)}")
+
+    records = read_ndjson_intersections(progress_file)
+    intersections = {str(node_id): records[str(node_id)] for node_id in all_nodes if str(node_id) in records}
+
+    return intersections, processed_count
+
+def reachable_nodes(adjacency, sources):
+    """
+    Nodes reachable from any of the sources over the adjacency, without their distances
+    """
+    seen = set(sources)
+    stack = list(seen)
+    while stack:
+        node = stack.pop()
+        for neighbor, _ in adjacency.get(node, ()):
+            if neighbor not in seen:
+                seen.add(neighbor)
+                stack.append(neighbor)
+
+    return seen
+
+def connected_components(adjacency):
+    """
+    Split an undirected adjacency list into connected components
+
+    Returns:
+    List of node lists, in order of first appearance in the adjacency
+    """
+    seen = set()
+    components = []
+
+    for start in adjacency:
+        if start in seen:
+            continue
+
+        seen.add(start)
+        component = [start]
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for neighbor, _ in adjacency.get(node, ()):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    component.append(neighbor)
+                    stack.append(neighbor)
+
+        components.append(component)
+
+    return components
+
+def plan_shards(roads_data, undirected_adjacency, mode, shard_size, sources=None, station_info=None):
+    """
+    Partition the road nodes into shards that can be labeled independently
+
+    The multi-source modes label whole connected components, so small components
+    are packed together. A component larger than shard_size would be a single shard,
+    so its station sources are split into spatial groups instead: every group shard
+    searches the nodes within MAX_STATION_DISTANCE of its stations and the merge
+    keeps the nearest label of every node. The pairwise search treats every node
+    on its own, so nodes are grouped by spatial tile and large tiles are split.
+
+    Returns:
+    List of shards {"nodes": [...]} with the node IDs to label, group shards also
+    have the "component" index and the "sources" of their stations
+    """
+    source_shards = []
+    if mode == "pairwise":
+        tiles = {}
+        for node_id, data in roads_data['nodes'].items():
+            if data.get('y') is not None and data.get('x') is not None:
+                key = (math.floor(data['y'] / SHARD_TILE_DEGREES), math.floor(data['x'] / SHARD_TILE_DEGREES))
+            else:
+                key = None
+            tiles.setdefault(key, []).append(int(node_id))
+
+        groups = []
+        for tile_nodes in tiles.values():
+            for i in range(0, len(tile_nodes), shard_size):
+                groups.append(tile_nodes[i:i + shard_size])
+    else:
+        groups = []
+        for component_index, component in enumerate(connected_components(undirected_adjacency)):
+            component_sources = [node for node in component if node in sources]
+            group_count = min(len(component_sources), math.ceil(len(component) / shard_size))
+            if group_count <= 1:
+                groups.append(component)
+                continue
+
+            def source_tile(node):
+                location = station_info[node]['location']
+                return (math.floor(location['latitude'] / SHARD_TILE_DEGREES), location['longitude'], node)
+
+            component_sources.sort(key=source_tile)
+            group_size = math.ceil(len(component_sources) / group_count)
+            for i in range(0, len(component_sources), group_size):
+                source_shards.append({"nodes": component, "component": component_index,
+                                      "sources": component_sources[i:i + group_size]})
+
+    shards = []
+    current = []
+    for group in groups:
+        if current and len(current) + len(group) > shard_size:
+            shards.append({"nodes": current})
+            current = []
+        current.extend(group)
+    if current:
+        shards.append({"nodes": current})
+
+    return shards + source_shards
+
+def shard_fingerprint(mode, include_from, shard_size):
+    """
+    Fingerprint of the inputs and options, used to tell whether existing shard
+    results can be resumed
+    """
+    digest = hashlib.sha1(json.dumps([SHARD_FORMAT, mode, include_from, shard_size]).encode())
+    for filename in ["roads_bc_regions.json", "charging_stations_bc_regions.json"]:
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+def label_shard(shard_id):
+    """
+    Pool worker: label the nodes of one shard and record its completion
+
+    The graph and station data come from _shard_context, which the worker
+    inherits copy-on-write when the pool is forked.
+    Returns:
+    Tuple of (shard_id, number of nodes labeled)
+    """
+    context = _shard_context
+    shard = context['shards'][shard_id]
+    shard_nodes = shard['nodes']
+    count = len(shard_nodes)
+
+    if 'sources' in shard:
+        # One station group of a large component: the labels within range of its stations,
+        # per pass, which the merge combines with the other groups of the component
+        group = set(shard['sources'])
+        records = []
+        for adjacency, sources, station_info in context['passes']:
+            group_sources = {node: dist for node, dist in sources.items() if node in group}
+            distances, nearest_source = multi_source_dijkstra(adjacency, group_sources, MAX_STATION_DISTANCE)
+            records.append({str(node): [distance, nearest_source[node]] for node, distance in distances.items()})
+        count = len(records[0])
+    elif context['mode'] == "pairwise":
+        records = {}
+        for node_id in shard_nodes:
+            try:
+                nearest_info = pairwise_intersection(node_id, context['road_network'], context['charging_stations'])
+                if nearest_info:
+                    records[str(node_id)] = nearest_info
+            except Exception as e:
+                print(f"    Error processing node {node_id}: {str(e)}")
+    else:
+        passes = [
+            nearest_station_entries(context['roads_data'], adjacency, sources, station_info, shard_nodes)
+            for adjacency, sources, station_info in context['passes']
+        ]
+        records = merge_station_entries(passes[0], passes[1] if len(passes) > 1 else {})
+
+    # Write to a temporary file first so a shard file on disk is always complete
+    shard_file = os.path.join(SHARD_DIR, f"shard_{shard_id}.json")
+    with open(shard_file + ".tmp", "w") as f:
+        json.dump(records, f)
+    os.replace(shard_file + ".tmp", shard_file)
+
+    return shard_id, count
+
+def merge_group_shards(roads_data, passes, component, group_records):
+    """
+    Combine the labels of the station groups of one large component into its entries
+
+    Every node keeps the nearest of its group labels, ties going to the smaller
+    station node like in a single multi-source pass over the whole component.
+
+    Returns:
+    Dictionary {node_id_str: intersections record}
+    """
+    component_set = set(component)
+    entries = []
+    for pass_index, (adjacency, sources, station_info) in enumerate(passes):
+        distances = {}
+        nearest_source = {}
+        for records in group_records:
+            for node_id, (distance, source) in records[pass_index].items():
+                node = int(node_id)
+                if node not in distances or (distance, source) < (distances[node], nearest_source[node]):
+                    distances[node] = distance
+                    nearest_source[node] = source
+
+        # The groups only search within MAX_STATION_DISTANCE, so unlabeled nodes are told apart
+        # from nodes without a road path to a station, which get the straight-line fallback
+        reachable = set()
+        if any(node not in distances for node in component):
+            reachable = reachable_nodes(adjacency, [node for node in sources if node in component_set])
+        entries.append(station_entries(roads_data, distances, nearest_source, station_info, component, reachable))
+
+    return merge_station_entries(entries[0], entries[1] if len(entries) > 1 else {})
+
+def calculate_nearest_stations_sharded(roads_data, all_charging_stations, mode, include_from=False,
+                                       workers=None, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Label the road nodes shard by shard on a multiprocessing pool
+
+    Finished shards are kept in results/shards and skipped on the next run with the
+    same inputs and options, so a crashed run only redoes the unfinished shards.
+    The merge follows the node order of roads_bc_regions.json, which makes the
+    final file identical to the one written by a serial run.
+
+    Returns:
+    Tuple of (intersections, processed_count)
+    """
+    global _shard_context
+
+    undirected_adjacency = build_road_adjacency(roads_data)
+    context = {'mode': mode, 'roads_data': roads_data, 'charging_stations': all_charging_stations}
+
+    if mode == "pairwise":
+        context['road_network'] = build_undirected_road_graph(roads_data)
+    else:
+        # Also registers virtual station nodes (if any) so they land in their component's shard
+        sources, station_info = find_station_sources(roads_data, undirected_adjacency, all_charging_stations)
+        if mode == "directed":
+            directions = ["reverse", "forward"] if include_from else ["reverse"]
+            context['passes'] = []
+            for direction in directions:
+                adjacency = build_road_adjacency(roads_data, direction)
+                context['passes'].append((adjacency,) + find_station_sources(roads_data, adjacency, all_charging_stations))
+        else:
+            context['passes'] = [(undirected_adjacency, sources, station_info)]
+
+    if mode == "pairwise":
+        shards = plan_shards(roads_data, undirected_adjacency, mode, shard_size)
+    else:
+        shards = plan_shards(roads_data, undirected_adjacency, mode, shard_size, sources, station_info)
+    context['shards'] = shards
+    group_shards = sum(1 for shard in shards if 'sources' in shard)
+    print(f"\nPartitioned {len(roads_data['nodes'])} nodes into {len(shards)} shards "
+          f"({group_shards} station groups of large components)")
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    manifest_file = os.path.join(SHARD_DIR, "manifest.json")
+    fingerprint = shard_fingerprint(mode, include_from, shard_size)
+
+    manifest = None
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+
+    if manifest is None or manifest.get('fingerprint') != fingerprint or manifest.get('shard_count') != len(shards):
+        if manifest is not None:
+            print("    Inputs or options changed since the last run, discarding old shard results")
+        for filename in os.listdir(SHARD_DIR):
+            if filename.startswith("shard_"):
+                os.remove(os.path.join(SHARD_DIR, filename))
+        with open(manifest_file, "w") as f:
+            json.dump({'fingerprint': fingerprint, 'mode': mode, 'shard_count': len(shards)}, f, indent=2)
+
+    pending = [i for i in range(len(shards))
+               if not os.path.exists(os.path.join(SHARD_DIR, f"shard_{i}.json"))]
+    print(f"    {len(shards) - len(pending)} shards already complete, {len(pending)} to process")
+
+    workers = workers or multiprocessing.cpu_count()
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("    Process pools need the fork start method to share the graph, running shards in this process")
+        workers = 1
+
+    _shard_context = context
+    start_time = time.time()
+    done_nodes = 0
+    try:
+        if workers > 1 and len(pending) > 1:
+            with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+                for shard_id, count in pool.imap_unordered(label_shard, pending):
+                    done_nodes += count
+                    print(f"    ✓ Shard {shard_id} done ({count} nodes, {done_nodes} this run, {time.time() - start_time:.1f}s)")
+        else:
+            for shard_id in pending:
+                _, count = label_shard(shard_id)
+                done_nodes += count
+                print(f"    ✓ Shard {shard_id} done ({count} nodes, {done_nodes} this run, {time.time() - start_time:.1f}s)")
+    finally:
+        _shard_context = None
+
+    print("\nMerging shard results...")
+    records = {}
+    components = {}
+    for shard_id, shard in enumerate(shards):
+        with open(os.path.join(SHARD_DIR, f"shard_{shard_id}.json"), "r") as f:
+            shard_records = json.load(f)
+        if 'sources' in shard:
+            components.setdefault(shard['component'], (shard['nodes'], []))[1].append(shard_records)
+        else:
+            records.update(shard_records)
+    for component, group_records in components.values():
+        records.update(merge_group_shards(roads_data, context['passes'], component, group_records))
+
+    intersections = {}
+    for node_id in roads_data['nodes']:
+        if node_id in records:
+            intersections[node_id] = records[node_id]
+
+    node_count = sum(len(shard['nodes']) for shard in shards if 'sources' not in shard)
+    node_count += sum(len(component) for component, _ in components.values())
+    return intersections, node_count
+
+def label_top_k_stations(roads_data, charging_stations, k, directed=False):
+    """
+    Calculate the k nearest charging stations of every road node with a k-label
+    multi-source Dijkstra
+
+    Parameters:
+    k: number of stations to keep per node
+    directed: respect one-way roads (drive-to-station distances, like label_nearest_stations)
+
+    Returns:
+    Tuple of (node_ids, station_idx, distance, stations) as stored by
+    intersections_store.save_station_table
+    """
+    adjacency = build_road_adjacency(roads_data, "reverse" if directed else "undirected")
+    sources, station_info = find_station_sources(roads_data, adjacency, charging_stations)
+    print(f"    Seeding search from {len(sources)} charging station nodes, keeping {k} stations per node")
+
+    labels = k_nearest_dijkstra(adjacency, sources, k, MAX_STATION_DISTANCE)
+
+    station_nodes = sorted(station_info)
+    station_index = {node: i for i, node in enumerate(station_nodes)}
+    stations = [station_info[node] for node in station_nodes]
+    station_lat = np.radians(np.array([station["location"]["latitude"] for station in stations], dtype=np.float64))
+    station_lon = np.radians(np.array([station["location"]["longitude"] for station in stations], dtype=np.float64))
+
+    node_ids = np.array([int(node_id) for node_id in roads_data['nodes']], dtype=np.int64)
+    station_idx = np.full((len(node_ids), k), -1, dtype=np.int32)
+    distance = np.full((len(node_ids), k), np.inf, dtype=np.float32)
+    unreached = 0
+
+    for row, (node_id, node_data) in enumerate(roads_data['nodes'].items()):
+        node_labels = labels.get(int(node_id))
+
+        if node_labels:
+            in_range = [(dist, source) for dist, source in node_labels if dist <= MAX_STATION_DISTANCE]
+            for column, (dist, source) in enumerate(in_range):
+                station_idx[row, column] = station_index[source]
+                distance[row, column] = dist
+            continue
+
+        # Same straight-line fallback as the single nearest station search
+        if node_data.get('y') is None or node_data.get('x') is None or not stations:
+            continue
+
+        unreached += 1
+        lat = radians(node_data['y'])
+        lon = radians(node_data['x'])
+        a = (np.sin((station_lat - lat) / 2) ** 2 +
+             np.cos(lat) * np.cos(station_lat) * np.sin((station_lon - lon) / 2) ** 2)
+        direct = 6371000 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        nearest = [i for i in np.argsort(direct, kind="stable")[:k] if direct[i] <= MAX_STATION_DISTANCE]
+        station_idx[row, :len(nearest)] = nearest
+        distance[row, :len(nearest)] = direct[nearest]
+
+    if unreached:
+        print(f"    {unreached} nodes have no road path to a charging station, using straight-line distance")
+    print(f"    ✓ Labeled {int(np.count_nonzero(station_idx[:, 0] >= 0))} nodes with a charging station in range")
 
-    print("\nSaving final results to JSON file...")
-    final_file = "intersections_bc_regions.json"
-    with open(final_file, "w") as f:
-        json.dump(intersections, f, indent=2)
+    return node_ids, station_idx, distance, stations
+
+def calculate_nearest_stations_topk(k, mode="multi_source", output_file=TOP_K_FILE):
+    """
+    Calculate the k nearest charging stations of every road node and save them
+    as a columnar .npz file (see intersections_store.NearestStationTable)
+
+    Parameters:
+    k: number of stations to keep per node
+    mode: "multi_source" or "directed" (drive-to-station distances)
+    output_file: .npz file to write
+    """
+    start_time = time.time()
+
+    with open("roads_bc_regions.json", "r") as f:
+        roads_data = json.load(f)
+    print(f"    ✓ Loaded road network with {len(roads_data['nodes'])} nodes and {len(roads_data['edges'])} edges")
+
+    with open("charging_stations_bc_regions.json", "r") as f:
+        all_charging_stations = json.load(f)
+    print(f"    ✓ Loaded {len(all_charging_stations)} charging stations")
+
+    print(f"\nCalculating the {k} nearest charging stations of every node (k-label multi-source Dijkstra)...")
+    node_ids, station_idx, distance, stations = label_top_k_stations(
+        roads_data, all_charging_stations, k, directed=(mode == "directed"))
+
+    save_station_table(output_file, node_ids, station_idx, distance, stations)
+    size_mb = os.path.getsize(output_file) / (1024 * 1024)
+    print(f"    ✓ Saved {len(node_ids)} nodes and {len(stations)} stations to {output_file} ({size_mb:.1f} MB)")
+    print(f"    Total time: {time.time() - start_time:.1f}s")
+
+def calculate_nearest_stations(mode="multi_source", include_from=False, workers=None, shard_size=DEFAULT_SHARD_SIZE,
+                               output_format="json"):
+    """
+    Calculate the actual road distance from each road node to the nearest charging station
+
+    Parameters:
+    mode: "multi_source" labels all nodes with one multi-source Dijkstra (minutes),
+          "directed" does the same on the one-way aware road network,
+          "pairwise" runs the original per-node shortest path search (hours)
+    include_from: in "directed" mode, also store the drive-from-nearest-station distance
+    workers: if set, run resumable shards on a process pool with this many workers
+    shard_size: target number of nodes per shard
+    output_format: "json" writes intersections_bc_regions.json, "ndjson" streams one node
+                   per line to intersections_bc_regions.ndjson (read directly by map_construction)
+    """
+    start_time_total = time.time()
+    
+    print("Loading road network data...")
+    try:
+        with open("roads_bc_regions.json", "r") as f:
+            roads_data = json.load(f)
+        print(f"    ✓ Loaded road network with {len(roads_data['nodes'])} nodes and {len(roads_data['edges'])} edges")
+    except Exception as e:
+        print(f"    Error loading road network data: {str(e)}")
+        return
+    
+    print("\nLoading charging station data...")
+    try:
+        with open("charging_stations_bc_regions.json", "r") as f:
+            all_charging_stations = json.load(f)
+        print(f"    ✓ Loaded {len(all_charging_stations)} charging stations")
+    except Exception as e:
+        print(f"    Error loading charging station data: {str(e)}")
+        return
+    
+    if workers:
+        intersections, processed_count = calculate_nearest_stations_sharded(
+            roads_data, all_charging_stations, mode, include_from=include_from,
+            workers=workers, shard_size=shard_size)
+    elif mode == "pairwise":
+        intersections, processed_count = calculate_nearest_stations_pairwise(roads_data, all_charging_stations)
+    else:
+        print("\nCalculating distances to nearest charging stations (multi-source Dijkstra)...")
+        intersections = label_nearest_stations(roads_data, all_charging_stations,
+                                               directed=(mode == "directed"), include_from=include_from)
+        processed_count = len(roads_data['nodes'])
+
+    if output_format == "ndjson":
+        print("\nSaving final results to NDJSON file...")
+        final_file = "intersections_bc_regions.ndjson"
+        write_intersections(intersections, final_file)
+    elif mode == "pairwise" and not workers:
+        print("\nCompacting the progress file into the final JSON file...")
+        final_file = "intersections_bc_regions.json"
+        compact_intersections(os.path.join("results", PAIRWISE_PROGRESS_FILE), final_file,
+                              node_order=roads_data['nodes'])
+    else:
+        print("\nSaving final results to JSON file...")
+        final_file = "intersections_bc_regions.json"
+        write_intersections(intersections, final_file)
     print(f"    ✓ Saved final results to {final_file}")
+
+    if mode == "pairwise" and not workers:
+        # Compacted into the final file, the next run should start fresh
+        os.remove(os.path.join("results", PAIRWISE_PROGRESS_FILE))
     
     total_elapsed = time.time() - start_time_total
     hours = int(total_elapsed // 3600)
@@ -307,12 +1163,265 @@ def calculate_nearest_stations():
     print(f"Results saved to {final_file}")
     print("="*80)
 
+def station_location_key(latitude, longitude):
+    """
+    Identify a charging station by its rounded location
+    """
+    return (round(float(latitude), 7), round(float(longitude), 7))
+
+def diff_charging_stations(old_stations, new_stations):
+    """
+    Compare two charging station lists by location
+
+    Returns:
+    Tuple of (added, removed) station lists
+    """
+    old_by_key = {station_location_key(s['location']['latitude'], s['location']['longitude']): s for s in old_stations}
+    new_by_key = {station_location_key(s['location']['latitude'], s['location']['longitude']): s for s in new_stations}
+
+    added = [station for key, station in new_by_key.items() if key not in old_by_key]
+    removed = [station for key, station in old_by_key.items() if key not in new_by_key]
+
+    return added, removed
+
+def patch_nearest_stations(roads_data, intersections, added, removed, direction="undirected",
+                           field="nearest_charging_station"):
+    """
+    Update the nearest charging station data in place after stations were added or removed
+
+    Removed stations: only the nodes whose nearest station was removed are
+    recomputed, seeded from the stored distances of their unaffected neighbors.
+    Added stations: a Dijkstra from the new stations that only relaxes nodes whose
+    stored distance improves, bounded by MAX_STATION_DISTANCE.
+    Nodes with a straight-line fallback label (no road path to any station, marked
+    with "fallback" in the entry) are recomputed as well.
+
+    Parameters:
+    roads_data: parsed roads_bc_regions.json (may still contain the removed station nodes)
+    intersections: intersections dictionary to patch
+    added, removed: station lists as returned by diff_charging_stations
+    direction: adjacency direction the data was computed with ("undirected", "reverse" or "forward")
+    field: record field to patch ("nearest_charging_station" or "nearest_charging_station_from")
+
+    Returns:
+    Number of nodes recalculated
+    """
+    adjacency = build_road_adjacency(roads_data, direction)
+    if direction == "undirected":
+        incoming = adjacency
+    else:
+        incoming = build_road_adjacency(roads_data, "forward" if direction == "reverse" else "reverse")
+
+    removed_keys = {station_location_key(s['location']['latitude'], s['location']['longitude']) for s in removed}
+
+    distances = {}
+    station_keys = {}
+    stations_by_key = {}
+    fallback = set()
+    for node_id, record in intersections.items():
+        entry = record.get(field)
+        if not entry:
+            continue
+        node = int(node_id)
+        location = entry['location']
+        key = station_location_key(location['latitude'], location['longitude'])
+        distances[node] = entry['distance']
+        station_keys[node] = key
+        if key not in removed_keys:
+            stations_by_key[key] = {"name": entry['name'], "location": dict(location)}
+        if entry.get('fallback'):
+            fallback.add(node)
+
+    # Station nodes of removed stations stay in the road data until the next full rebuild, keep them out of the search
+    blocked = set()
+    for node_id, data in roads_data['nodes'].items():
+        if data.get('is_charging_station', False) and \
+                station_location_key(data.get('y'), data.get('x')) in removed_keys:
+            blocked.add(int(node_id))
+
+    affected = {node for node, key in station_keys.items() if key in removed_keys} | fallback | blocked
+    for node in affected:
+        distances.pop(node, None)
+        station_keys.pop(node, None)
+    changed = set(affected)
+
+    # Removed stations: re-seed the affected region from its unaffected border
+    heap = []
+    ambiguous = set()
+    for node in affected - blocked:
+        for neighbor, weight in incoming.get(node, ()):
+            if neighbor in distances:
+                heapq.heappush(heap, (distances[neighbor] + weight, station_keys[neighbor], node))
+            elif neighbor not in affected:
+                # Reachable from a node without a station in range, so not a fallback candidate
+                ambiguous.add(node)
+
+    reached = set()
+    while heap:
+        dist, key, node = heapq.heappop(heap)
+        if node in reached:
+            continue
+
+        reached.add(node)
+        if dist <= MAX_STATION_DISTANCE:
+            distances[node] = dist
+            station_keys[node] = key
+        for neighbor, weight in adjacency.get(node, ()):
+            if neighbor in affected and neighbor not in blocked and neighbor not in reached:
+                heapq.heappush(heap, (dist + weight, key, neighbor))
+
+    # Added stations: bounded search that only continues where the stored distance improves
+    for station, (closest_node, snap_dist) in zip(added, snap_stations_to_road_nodes(roads_data, added)):
+        if closest_node is None:
+            continue
+        key = station_location_key(station['location']['latitude'], station['location']['longitude'])
+        stations_by_key[key] = {
+            "name": station.get('name', 'Unnamed'),
+            "location": {
+                "latitude": station['location']['latitude'],
+                "longitude": station['location']['longitude']
+            }
+        }
+        # Same rounding as the connector edge lengths in roads_bc_regions.json
+        snap_dist = round(snap_dist, 3)
+        if snap_dist < distances.get(closest_node, float('inf')):
+            heapq.heappush(heap, (snap_dist, key, closest_node))
+
+    improved = set()
+    while heap:
+        dist, key, node = heapq.heappop(heap)
+        if dist > MAX_STATION_DISTANCE or node in improved or dist >= distances.get(node, float('inf')):
+            continue
+
+        improved.add(node)
+        reached.add(node)
+        distances[node] = dist
+        station_keys[node] = key
+        changed.add(node)
+        for neighbor, weight in adjacency.get(node, ()):
+            if neighbor not in blocked and dist + weight < distances.get(neighbor, float('inf')):
+                heapq.heappush(heap, (dist + weight, key, neighbor))
+
+    # Nodes no station can reach by road get the straight-line fallback of a full run
+    straight_line = set()
+    for node in affected - blocked - reached - ambiguous:
+        node_data = roads_data['nodes'].get(str(node), {})
+        if node_data.get('y') is None or node_data.get('x') is None:
+            continue
+        for key, station in stations_by_key.items():
+            location = station['location']
+            direct_dist = haversine_distance(node_data['y'], node_data['x'],
+                                             location['latitude'], location['longitude'])
+            if direct_dist <= MAX_STATION_DISTANCE and direct_dist < distances.get(node, float('inf')):
+                distances[node] = direct_dist
+                station_keys[node] = key
+                straight_line.add(node)
+
+    for node in changed:
+        node_id = str(node)
+        if node in distances and node not in blocked:
+            station = stations_by_key[station_keys[node]]
+            entry = {
+                "distance": distances[node],
+                "name": station["name"],
+                "location": {
+                    "latitude": station["location"]["latitude"],
+                    "longitude": station["location"]["longitude"]
+                }
+            }
+            if node in straight_line:
+                entry["fallback"] = True
+            intersections.setdefault(node_id, {})[field] = entry
+        elif node_id in intersections:
+            if field == "nearest_charging_station":
+                del intersections[node_id]
+            else:
+                intersections[node_id].pop(field, None)
+
+    return len(changed)
+
+def update_nearest_stations(old_stations_file, mode="multi_source", intersections_file="intersections_bc_regions.json"):
+    """
+    Patch the nearest charging station data after a charging station refresh
+    instead of recalculating every node
+
+    Parameters:
+    old_stations_file: charging station file the intersections data was calculated with
+    mode: mode the intersections data was calculated with ("directed" data is
+          patched over the one-way aware network)
+    intersections_file: intersections data to patch in place
+    """
+    start_time = time.time()
+
+    with open("roads_bc_regions.json", "r") as f:
+        roads_data = json.load(f)
+    with open(old_stations_file, "r") as f:
+        old_stations = json.load(f)
+    with open("charging_stations_bc_regions.json", "r") as f:
+        new_stations = json.load(f)
+    intersections = load_intersections(intersections_file)
+
+    added, removed = diff_charging_stations(old_stations, new_stations)
+    print(f"Charging stations: {len(added)} added, {len(removed)} removed")
+    if not added and not removed:
+        print("    ✓ Nothing to update")
+        return
+
+    if mode == "directed":
+        changed = patch_nearest_stations(roads_data, intersections, added, removed, "reverse")
+        if any("nearest_charging_station_from" in record for record in intersections.values()):
+            changed += patch_nearest_stations(roads_data, intersections, added, removed, "forward",
+                                              field="nearest_charging_station_from")
+    else:
+        changed = patch_nearest_stations(roads_data, intersections, added, removed)
+    print(f"    ✓ Updated {changed} nodes")
+
+    # Keep the node order of a full run, which also leaves out nodes without a drive-to station
+    intersections = {node_id: intersections[node_id] for node_id in roads_data['nodes']
+                     if "nearest_charging_station" in intersections.get(node_id, {})}
+
+    write_intersections(intersections, intersections_file)
+
+    print(f"    ✓ Saved {intersections_file} in {time.time() - start_time:.1f}s")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate the nearest charging station for every road node")
+    parser.add_argument("--mode", choices=["multi_source", "directed", "pairwise"], default="multi_source",
+                        help="multi_source: one Dijkstra from all stations, directed: same but one-way aware, "
+                             "pairwise: original per-node search")
+    parser.add_argument("--include-from", action="store_true",
+                        help="directed mode only: also store the drive-from-nearest-station distance")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="run resumable shards on a process pool with this many workers")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE,
+                        help="target number of nodes per shard")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="write intersections_bc_regions.json or the streamed intersections_bc_regions.ndjson")
+    parser.add_argument("--update-from", metavar="OLD_STATIONS_FILE", default=None,
+                        help="patch the existing intersections data for the stations added or removed "
+                             "since OLD_STATIONS_FILE instead of recalculating every node")
+    parser.add_argument("--top-k", type=int, default=None, metavar="K",
+                        help="store the K nearest stations of every node in the columnar "
+                             "intersections_bc_regions_topk.npz instead of the single nearest station")
+    args = parser.parse_args()
+    if args.top_k is not None and (args.top_k < 1 or args.mode == "pairwise" or args.workers):
+        parser.error("--top-k needs K >= 1 and runs serially in multi_source or directed mode")
+
     print("Starting calculation of nearest charging stations...")
     start_time = time.time()
     
     try:
-        calculate_nearest_stations()
+        if args.top_k:
+            calculate_nearest_stations_topk(args.top_k, mode=args.mode)
+        elif args.update_from:
+            # Patch whichever of the JSON and NDJSON files a full run wrote last
+            intersections_file = newest_file(["intersections_bc_regions.json", "intersections_bc_regions.ndjson"])
+            intersections_file = intersections_file or "intersections_bc_regions.json"
+            print(f"Updating {intersections_file}")
+            update_nearest_stations(args.update_from, mode=args.mode, intersections_file=intersections_file)
+        else:
+            calculate_nearest_stations(mode=args.mode, include_from=args.include_from,
+                                       workers=args.workers, shard_size=args.shard_size, output_format=args.format)
         
         total_elapsed = time.time() - start_time
         hours = int(total_elapsed // 3600)
@@ -0,0 +1,330 @@
+"""
+Array-backed road network graph.
+Wraps the memory-mapped arrays of a graph snapshot (see graph_snapshot.py) and
+implements the small part of the networkx MultiDiGraph interface that the route
+planner and the map renderer use, so a request can be served without building
+a networkx graph.
+"""
+from collections import deque
+from math import radians
+
+import numpy as np
+
+import graph_snapshot
+
+
+class NodeView:
+    """G.nodes: node IDs, G.nodes[node] attribute dictionaries and G.nodes(data=True)"""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        index = self._graph.index_of(node)
+        if index is None:
+            raise KeyError(node)
+        return self._graph.node_data(index)
+
+    def __call__(self, data=False):
+        if not data:
+            return iter(self)
+        return ((node, self._graph.node_data(index)) for index, node in enumerate(self._graph.node_ids.tolist()))
+
+    def __iter__(self):
+        return iter(self._graph.node_ids.tolist())
+
+    def __len__(self):
+        return len(self._graph.node_ids)
+
+    def __contains__(self, node):
+        return self._graph.index_of(node) is not None
+
+
+class EdgeView:
+    """G.edges: (u, v, 0) keys and G.edges[u, v, 0] attribute dictionaries"""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, edge):
+        u, v, key = edge
+        position = self._graph.edge_position(u, v) if key == 0 else None
+        if position is None:
+            raise KeyError(edge)
+        return self._graph.edge_data(position)
+
+    def __iter__(self):
+        node_ids = self._graph.node_ids
+        for index in range(len(node_ids)):
+            start, end = self._graph.offsets[index], self._graph.offsets[index + 1]
+            u = int(node_ids[index])
+            for v in node_ids[self._graph.targets[start:end]].tolist():
+                yield u, v, 0
+
+    def __len__(self):
+        return len(self._graph.targets)
+
+
+class AdjacencyView:
+    """G.adj[node]: {neighbor: {0: edge attributes}}, like networkx.MultiDiGraph.adj"""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        index = self._graph.index_of(node)
+        if index is None:
+            raise KeyError(node)
+        return self._graph.adjacency(index)
+
+    def __contains__(self, node):
+        return self._graph.index_of(node) is not None
+
+
+class PredecessorView:
+    """G.pred[node]: {predecessor: {0: edge attributes}}, like networkx.MultiDiGraph.pred"""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        index = self._graph.index_of(node)
+        if index is None:
+            raise KeyError(node)
+        return self._graph.predecessors(index)
+
+    def __contains__(self, node):
+        return self._graph.index_of(node) is not None
+
+
+class CompactGraph:
+    def __init__(self, snapshot):
+        """
+        Read-only directed road network backed by CSR arrays
+
+        Nodes keep their original IDs on the outside and are mapped to dense
+        indices with a binary search over the sorted IDs. Neighbor order and edge
+        attributes match the networkx graph built by load_bc_province_data, so
+        searches return the same routes on both.
+
+        Args:
+            snapshot (dict): snapshot returned by graph_snapshot.load_graph_snapshot
+        """
+        self.node_ids = snapshot["node_ids"]
+        self.node_y = snapshot["node_y"]
+        self.node_x = snapshot["node_x"]
+        self.street_count = snapshot["street_count"]
+        self.offsets = snapshot["offsets"]
+        self.targets = snapshot["targets"]
+        self.length = snapshot["length"]
+        self.travel_time = snapshot["travel_time"]
+        self.highway = snapshot["highway"]
+        self.edge_flags = snapshot["edge_flags"]
+        self.highway_classes = snapshot["highway_classes"]
+        self.station_names = dict(zip(snapshot["station_nodes"].tolist(), snapshot["station_names"].tolist()))
+
+        self._sorted_ids = snapshot["sorted_node_ids"]
+        self._sort_order = snapshot["sorted_node_index"]
+
+        self.graph = {}
+        self.nodes = NodeView(self)
+        self.edges = EdgeView(self)
+        self.adj = AdjacencyView(self)
+        self.pred = PredecessorView(self)
+        self._reverse = None
+
+    @classmethod
+    def load(cls, snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        """Memory-map a snapshot directory"""
+        return cls(graph_snapshot.load_graph_snapshot(snapshot_dir))
+
+    def index_of(self, node):
+        """Dense index of a node ID, None if the node is not in the graph"""
+        return graph_snapshot.lookup_node_index(self._sorted_ids, self._sort_order, node)
+
+    def index_array(self, node_ids):
+        """Dense indices of an array of node IDs, -1 for IDs that are not in the graph"""
+        node_ids = np.asarray(node_ids, dtype=self._sorted_ids.dtype)
+        positions = np.minimum(np.searchsorted(self._sorted_ids, node_ids), len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[positions] == node_ids, self._sort_order[positions], -1)
+
+    def node_data(self, index):
+        y = float(self.node_y[index])
+        x = float(self.node_x[index])
+        data = {"y": None if y != y else y, "x": None if x != x else x, "street_count": int(self.street_count[index])}
+        if index in self.station_names:
+            data["is_charging_station"] = True
+            data["station_name"] = self.station_names[index]
+        return data
+
+    def edge_position(self, u, v):
+        """Position of edge u->v in the edge arrays, None if there is no such edge"""
+        u_index = self.index_of(u)
+        v_index = self.index_of(v)
+        if u_index is None or v_index is None:
+            return None
+
+        start = int(self.offsets[u_index])
+        for position, target in enumerate(self.targets[start:int(self.offsets[u_index + 1])].tolist(), start):
+            if target == v_index:
+                return position
+        return None
+
+    def edge_data(self, position):
+        data = {
+            "highway": self.highway_classes[self.highway[position]],
+            "travel_time": float(self.travel_time[position])
+        }
+        length = float(self.length[position])
+        if length == length:
+            data["length"] = length
+        flags = int(self.edge_flags[position])
+        if flags & graph_snapshot.EDGE_HAS_ONEWAY:
+            data["oneway"] = bool(flags & graph_snapshot.EDGE_ONEWAY)
+        if flags & graph_snapshot.EDGE_HAS_REVERSED:
+            data["reversed"] = bool(flags & graph_snapshot.EDGE_REVERSED)
+        if flags & graph_snapshot.EDGE_CHARGING_CONNECTION:
+            data["is_charging_connection"] = True
+        return data
+
+    def _edge_dicts(self, positions):
+        """Attribute dictionaries of the edges at the given positions of the edge arrays"""
+        edges = []
+        for travel_time, length, highway, flags in zip(
+                self.travel_time[positions].tolist(), self.length[positions].tolist(),
+                self.highway[positions].tolist(), self.edge_flags[positions].tolist()):
+            data = {"highway": self.highway_classes[highway], "travel_time": travel_time}
+            if length == length:
+                data["length"] = length
+            if flags:
+                if flags & graph_snapshot.EDGE_HAS_ONEWAY:
+                    data["oneway"] = bool(flags & graph_snapshot.EDGE_ONEWAY)
+                if flags & graph_snapshot.EDGE_HAS_REVERSED:
+                    data["reversed"] = bool(flags & graph_snapshot.EDGE_REVERSED)
+                if flags & graph_snapshot.EDGE_CHARGING_CONNECTION:
+                    data["is_charging_connection"] = True
+            edges.append(data)
+        return edges
+
+    def adjacency(self, index):
+        """Outgoing edges of a dense node index, read with one slice per edge array"""
+        start = int(self.offsets[index])
+        end = int(self.offsets[index + 1])
+
+        targets = self.node_ids[self.targets[start:end]].tolist()
+        return {target: {0: data} for target, data in zip(targets, self._edge_dicts(slice(start, end)))}
+
+    def reverse_csr(self):
+        """
+        Incoming edges in CSR form: (reverse_offsets, sources, positions), where positions
+        are the positions of the edges in the edge arrays. Built on first use, which is only
+        needed by the backward searches.
+        """
+        if self._reverse is None:
+            order = np.argsort(self.targets, kind="stable")
+            sources = np.repeat(np.arange(len(self.node_ids)), np.diff(self.offsets))[order]
+            reverse_offsets = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=len(self.node_ids)), out=reverse_offsets[1:])
+            self._reverse = (reverse_offsets, sources, order)
+        return self._reverse
+
+    def predecessors(self, index):
+        """Incoming edges of a dense node index, like adjacency"""
+        reverse_offsets, sources, order = self.reverse_csr()
+        start = int(reverse_offsets[index])
+        end = int(reverse_offsets[index + 1])
+
+        predecessors = self.node_ids[sources[start:end]].tolist()
+        return {source: {0: data} for source, data in zip(predecessors, self._edge_dicts(order[start:end]))}
+
+    def neighbors(self, node):
+        index = self.index_of(node)
+        if index is None:
+            raise KeyError(node)
+        return iter(self.node_ids[self.targets[self.offsets[index]:self.offsets[index + 1]]].tolist())
+
+    def has_node(self, node):
+        return self.index_of(node) is not None
+
+    def __contains__(self, node):
+        return self.has_node(node)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.targets)
+
+    def has_path(self, source, target):
+        """Directed reachability check (breadth-first search over the CSR arrays)"""
+        source_index = self.index_of(source)
+        target_index = self.index_of(target)
+        if source_index is None or target_index is None:
+            raise KeyError(source if source_index is None else target)
+        if source_index == target_index:
+            return True
+
+        visited = np.zeros(len(self.node_ids), dtype=bool)
+        visited[source_index] = True
+        queue = deque([source_index])
+
+        while queue:
+            index = queue.popleft()
+            for neighbor in self.targets[self.offsets[index]:self.offsets[index + 1]].tolist():
+                if neighbor == target_index:
+                    return True
+                if not visited[neighbor]:
+                    visited[neighbor] = True
+                    queue.append(neighbor)
+
+        return False
+
+    def component_labels(self):
+        """
+        Weakly connected component label of every dense node index
+
+        Label propagation with pointer jumping over the edge arrays, so no
+        per-node Python objects are created.
+        """
+        sources = np.repeat(np.arange(len(self.node_ids)), np.diff(self.offsets))
+        targets = np.asarray(self.targets, dtype=np.int64)
+        labels = np.arange(len(self.node_ids))
+
+        while True:
+            previous = labels.copy()
+            edge_labels = np.minimum(labels[sources], labels[targets])
+            np.minimum.at(labels, sources, edge_labels)
+            np.minimum.at(labels, targets, edge_labels)
+            labels = labels[labels]
+            if np.array_equal(labels, previous):
+                return labels
+
+    def weakly_connected_components(self):
+        """Weakly connected components as sets of node IDs, like networkx.weakly_connected_components"""
+        labels = self.component_labels()
+        order = np.argsort(labels, kind="stable")
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+        return [set(self.node_ids[group].tolist()) for group in np.split(order, boundaries)]
+
+    def nearest_node(self, lat, lon):
+        """
+        Nearest node to the given coordinates (straight-line distance)
+
+        Returns:
+            tuple: (node_id, distance in meters), (None, inf) if no node has coordinates
+        """
+        node_lat = np.radians(self.node_y)
+        node_lon = np.radians(self.node_x)
+        lat = radians(lat)
+        lon = radians(lon)
+
+        a = np.sin((node_lat - lat) / 2) ** 2 + np.cos(lat) * np.cos(node_lat) * np.sin((node_lon - lon) / 2) ** 2
+        distances = 6371000 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        if np.all(np.isnan(distances)):
+            return None, float("inf")
+        index = int(np.nanargmin(distances))
+        return int(self.node_ids[index]), float(distances[index])
@@ -0,0 +1,367 @@
+"""
+Contraction hierarchy of the road network on the travel_time metric.
+Built once per graph snapshot (nodes are contracted in edge-difference order and
+shortcuts are added where no witness path exists) and stored as upward and
+downward CSR arrays in the snapshot directory. Queries are bidirectional upward
+Dijkstra searches that settle a few hundred nodes instead of a whole region.
+"""
+import json
+import os
+import time
+import heapq
+import argparse
+
+import numpy as np
+
+import graph_snapshot
+from compact_graph import CompactGraph
+
+
+HIERARCHY_MANIFEST = "contraction_hierarchy.json"
+HIERARCHY_ARRAYS = [
+    "ch_rank",
+    "ch_up_offsets", "ch_up_targets", "ch_up_weights", "ch_up_middle",
+    "ch_down_offsets", "ch_down_sources", "ch_down_weights", "ch_down_middle",
+]
+# Witness searches stop after settling this many nodes (more shortcuts, faster preprocessing)
+WITNESS_SETTLE_LIMIT = 200
+
+def contract_graph(graph, witness_limit=WITNESS_SETTLE_LIMIT):
+    """
+    Contract every node of a CompactGraph
+
+    Nodes are contracted in order of edge difference (shortcuts added minus edges
+    removed), number of contracted neighbors and hierarchy depth, with lazy priority
+    updates.
+    When a node is contracted its remaining edges all lead to higher ranked nodes
+    and are recorded as its upward (outgoing) and downward (incoming) edges.
+
+    Returns:
+    Tuple of (rank, upward edges, downward edges, shortcut count). The edges are
+    (source, target, weight, middle) tuples, middle is -1 for road edges and the
+    contracted node for shortcuts.
+    """
+    num_nodes = len(graph.node_ids)
+    offsets = graph.offsets.tolist()
+    targets = graph.targets.tolist()
+    weights = graph.travel_time.tolist()
+
+    # Remaining graph: out_edges[u][v] = in_edges[v][u] = (weight, middle)
+    out_edges = [{} for _ in range(num_nodes)]
+    in_edges = [{} for _ in range(num_nodes)]
+    for u in range(num_nodes):
+        for position in range(offsets[u], offsets[u + 1]):
+            v = targets[position]
+            if v != u and weights[position] < out_edges[u].get(v, (float('inf'),))[0]:
+                out_edges[u][v] = (weights[position], -1)
+                in_edges[v][u] = (weights[position], -1)
+
+    def witness_distances(source, excluded, max_weight, targets):
+        """Distances from source avoiding the excluded node, exact for the targets settled in the limits"""
+        distances = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        remaining = len(targets)
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if distance > distances[node]:
+                continue
+            settled += 1
+            if distance > max_weight or settled > witness_limit:
+                break
+            if node in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for neighbor, (weight, _) in out_edges[node].items():
+                new_distance = distance + weight
+                if neighbor != excluded and new_distance < distances.get(neighbor, float('inf')):
+                    distances[neighbor] = new_distance
+                    heapq.heappush(heap, (new_distance, neighbor))
+        return distances
+
+    def needed_shortcuts(node):
+        shortcuts = []
+        outgoing = out_edges[node]
+        if not outgoing:
+            return shortcuts
+        max_out = max(weight for weight, _ in outgoing.values())
+        for u, (in_weight, _) in in_edges[node].items():
+            distances = witness_distances(u, node, in_weight + max_out, outgoing)
+            for w, (out_weight, _) in outgoing.items():
+                if w != u and distances.get(w, float('inf')) > in_weight + out_weight:
+                    shortcuts.append((u, w, in_weight + out_weight))
+        return shortcuts
+
+    contracted_neighbors = [0] * num_nodes
+    # Depth of the hierarchy below each node, keeps the contraction spread over the graph
+    level = [0] * num_nodes
+
+    def priority(node):
+        shortcuts = needed_shortcuts(node)
+        edge_difference = len(shortcuts) - len(out_edges[node]) - len(in_edges[node])
+        return 2 * edge_difference + contracted_neighbors[node] + level[node], shortcuts
+
+    heap = [(priority(node)[0], node) for node in range(num_nodes)]
+    heapq.heapify(heap)
+
+    rank = np.zeros(num_nodes, dtype=np.int32)
+    up_edges = []
+    down_edges = []
+    num_shortcuts = 0
+    next_rank = 0
+    report_every = max(num_nodes // 10, 1)
+
+    while heap:
+        _, node = heapq.heappop(heap)
+        node_priority, shortcuts = priority(node)
+        if heap and node_priority > heap[0][0]:
+            heapq.heappush(heap, (node_priority, node))
+            continue
+
+        for w, (weight, middle) in out_edges[node].items():
+            up_edges.append((node, w, weight, middle))
+            del in_edges[w][node]
+            contracted_neighbors[w] += 1
+            level[w] = max(level[w], level[node] + 1)
+        for u, (weight, middle) in in_edges[node].items():
+            down_edges.append((u, node, weight, middle))
+            del out_edges[u][node]
+            contracted_neighbors[u] += 1
+            level[u] = max(level[u], level[node] + 1)
+        out_edges[node] = {}
+        in_edges[node] = {}
+
+        for u, w, weight in shortcuts:
+            if weight < out_edges[u].get(w, (float('inf'),))[0]:
+                out_edges[u][w] = (weight, node)
+                in_edges[w][u] = (weight, node)
+                num_shortcuts += 1
+
+        rank[node] = next_rank
+        next_rank += 1
+        if next_rank % report_every == 0:
+            print(f"    Contracted {next_rank}/{num_nodes} nodes, {num_shortcuts} shortcuts")
+
+    return rank, up_edges, down_edges, num_shortcuts
+
+def _edge_csr(edges, num_nodes, key):
+    """CSR arrays (offsets, other endpoint, weights, middles) of edges grouped by edge[key]"""
+    edges.sort(key=lambda edge: edge[key])
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.array([edge[key] for edge in edges], dtype=np.int64), minlength=num_nodes),
+              out=offsets[1:])
+    return (offsets,
+            np.array([edge[1 - key] for edge in edges], dtype=np.int32),
+            np.array([edge[2] for edge in edges], dtype=np.float64),
+            np.array([edge[3] for edge in edges], dtype=np.int32))
+
+def write_contraction_hierarchy(snapshot_dir=graph_snapshot.SNAPSHOT_DIR, witness_limit=WITNESS_SETTLE_LIMIT):
+    """
+    Build the contraction hierarchy of a graph snapshot and store it next to it.
+    Rewriting the snapshot replaces its directory, which drops a stale hierarchy.
+    """
+    start_time = time.time()
+    graph = CompactGraph.load(snapshot_dir)
+    num_nodes = len(graph.node_ids)
+
+    print(f"Contracting {num_nodes} nodes of {snapshot_dir}...")
+    rank, up_edges, down_edges, num_shortcuts = contract_graph(graph, witness_limit)
+
+    up_offsets, up_targets, up_weights, up_middle = _edge_csr(up_edges, num_nodes, 0)
+    down_offsets, down_sources, down_weights, down_middle = _edge_csr(down_edges, num_nodes, 1)
+    arrays = {
+        "ch_rank": rank,
+        "ch_up_offsets": up_offsets, "ch_up_targets": up_targets,
+        "ch_up_weights": up_weights, "ch_up_middle": up_middle,
+        "ch_down_offsets": down_offsets, "ch_down_sources": down_sources,
+        "ch_down_weights": down_weights, "ch_down_middle": down_middle,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(snapshot_dir, name + ".npy"), array)
+
+    manifest = {
+        "num_nodes": num_nodes,
+        "num_shortcuts": num_shortcuts,
+        "witness_limit": witness_limit,
+        "created_date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(snapshot_dir, HIERARCHY_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"    ✓ Saved contraction hierarchy with {num_shortcuts} shortcuts to {snapshot_dir}")
+    print(f"    Total time: {time.time() - start_time:.1f}s")
+
+
+class ContractionHierarchy:
+    def __init__(self, snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        """
+        Travel time distance and path queries on a contraction hierarchy
+
+        The hierarchy arrays are memory-mapped. Node IDs are mapped to dense indices
+        with the sorted IDs of the snapshot.
+
+        Args:
+            snapshot_dir (str): snapshot directory the hierarchy was written to
+        """
+        with open(os.path.join(snapshot_dir, HIERARCHY_MANIFEST), "r") as f:
+            manifest = json.load(f)
+
+        snapshot = graph_snapshot.load_graph_snapshot(snapshot_dir)
+        if manifest["num_nodes"] != snapshot["num_nodes"]:
+            raise ValueError(f"contraction hierarchy in {snapshot_dir} does not match the graph snapshot, "
+                             f"run contraction_hierarchy.py again")
+
+        arrays = {name: np.load(os.path.join(snapshot_dir, name + ".npy"), mmap_mode='r').view(np.ndarray)
+                  for name in HIERARCHY_ARRAYS}
+        self.rank = arrays["ch_rank"]
+        self.up_offsets = arrays["ch_up_offsets"]
+        self.up_targets = arrays["ch_up_targets"]
+        self.up_weights = arrays["ch_up_weights"]
+        self.up_middle = arrays["ch_up_middle"]
+        self.down_offsets = arrays["ch_down_offsets"]
+        self.down_sources = arrays["ch_down_sources"]
+        self.down_weights = arrays["ch_down_weights"]
+        self.down_middle = arrays["ch_down_middle"]
+        self.num_shortcuts = manifest["num_shortcuts"]
+
+        self.node_ids = snapshot["node_ids"]
+        self._sorted_ids = snapshot["sorted_node_ids"]
+        self._sort_order = snapshot["sorted_node_index"]
+
+    @staticmethod
+    def exists(snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        return os.path.exists(os.path.join(snapshot_dir, HIERARCHY_MANIFEST))
+
+    def index_of(self, node):
+        return graph_snapshot.lookup_node_index(self._sorted_ids, self._sort_order, node)
+
+    def _upward(self, index, forward):
+        """(neighbor, weight, middle) lists of the edges a search direction follows from a node"""
+        if forward:
+            start, end = int(self.up_offsets[index]), int(self.up_offsets[index + 1])
+            return zip(self.up_targets[start:end].tolist(), self.up_weights[start:end].tolist(),
+                       self.up_middle[start:end].tolist())
+        start, end = int(self.down_offsets[index]), int(self.down_offsets[index + 1])
+        return zip(self.down_sources[start:end].tolist(), self.down_weights[start:end].tolist(),
+                   self.down_middle[start:end].tolist())
+
+    def _search(self, source, target):
+        """
+        Bidirectional upward search between dense indices
+
+        Returns:
+        Tuple of (distance, meeting node, forward parents, backward parents), parents
+        map a node to (previous node, middle) of the edge it was reached over
+        """
+        distances = ({source: 0.0}, {target: 0.0})
+        parents = ({source: None}, {target: None})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = float('inf')
+        meeting = None
+
+        while heaps[0] or heaps[1]:
+            tops = [heap[0][0] if heap else float('inf') for heap in heaps]
+            if min(tops) >= best:
+                break
+            side = 0 if tops[0] <= tops[1] else 1
+            distance, node = heapq.heappop(heaps[side])
+            if distance > distances[side][node]:
+                continue
+
+            other_distance = distances[1 - side].get(node)
+            if other_distance is not None and distance + other_distance < best:
+                best = distance + other_distance
+                meeting = node
+
+            for neighbor, weight, middle in self._upward(node, side == 0):
+                new_distance = distance + weight
+                if new_distance < distances[side].get(neighbor, float('inf')):
+                    distances[side][neighbor] = new_distance
+                    parents[side][neighbor] = (node, middle)
+                    heapq.heappush(heaps[side], (new_distance, neighbor))
+
+        return best, meeting, parents[0], parents[1]
+
+    def _edge_middle(self, u, v):
+        """Middle node of the hierarchy edge u->v, stored at its lower ranked end"""
+        if self.rank[u] < self.rank[v]:
+            for target, _, middle in self._upward(u, True):
+                if target == v:
+                    return middle
+        else:
+            for source, _, middle in self._upward(v, False):
+                if source == u:
+                    return middle
+        raise KeyError((u, v))
+
+    def _unpack(self, u, v, middle):
+        """Road nodes of the hierarchy edge u->v, without u"""
+        nodes = []
+        stack = [(u, v, middle)]
+        while stack:
+            a, b, m = stack.pop()
+            if m == -1:
+                nodes.append(b)
+            else:
+                # a->m is followed by m->b, so push the second half first
+                stack.append((m, b, self._edge_middle(m, b)))
+                stack.append((a, m, self._edge_middle(a, m)))
+        return nodes
+
+    def distance(self, source, target):
+        """Shortest travel time in seconds between two node IDs, inf if there is no path"""
+        source_index = self.index_of(source)
+        target_index = self.index_of(target)
+        if source_index is None or target_index is None:
+            return float('inf')
+        return self._search(source_index, target_index)[0]
+
+    def reachable(self, source, target):
+        """Check if target can be reached from source, None if a node is not in the hierarchy"""
+        if self.index_of(source) is None or self.index_of(target) is None:
+            return None
+        return self.distance(source, target) < float('inf')
+
+    def path(self, source, target):
+        """
+        Fastest path between two node IDs
+
+        Returns:
+        Tuple of (list of node IDs, travel time), (None, inf) if there is no path
+        """
+        source_index = self.index_of(source)
+        target_index = self.index_of(target)
+        if source_index is None or target_index is None:
+            return None, float('inf')
+
+        distance, meeting, forward_parents, backward_parents = self._search(source_index, target_index)
+        if meeting is None:
+            return None, float('inf')
+
+        up_path = []
+        node = meeting
+        while forward_parents[node] is not None:
+            previous, middle = forward_parents[node]
+            up_path.append((previous, node, middle))
+            node = previous
+
+        path = [source_index]
+        for u, v, middle in reversed(up_path):
+            path.extend(self._unpack(u, v, middle))
+        node = meeting
+        while backward_parents[node] is not None:
+            following, middle = backward_parents[node]
+            path.extend(self._unpack(node, following, middle))
+            node = following
+
+        return self.node_ids[path].tolist(), distance
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the contraction hierarchy of the graph snapshot")
+    parser.add_argument("--snapshot", default=graph_snapshot.SNAPSHOT_DIR, help="graph snapshot directory")
+    parser.add_argument("--witness-limit", type=int, default=WITNESS_SETTLE_LIMIT,
+                        help="nodes settled by each witness search")
+    args = parser.parse_args()
+
+    write_contraction_hierarchy(args.snapshot, args.witness_limit)
@@ -98,6 +98,10 @@ def generate_charging_stations_data():
     print(f"\nTotal charging stations found: {total_stations}")
     
     print("\nSaving charging station data to JSON file...")
+    if os.path.exists("charging_stations_bc_regions.json"):
+        # Keep the previous list so calculate_nearest_stations.py --update-from can patch only the changes
+        os.replace("charging_stations_bc_regions.json", "charging_stations_bc_regions.previous.json")
+        print("    ✓ Kept the previous list as charging_stations_bc_regions.previous.json")
     with open("charging_stations_bc_regions.json", "w") as f:
         json.dump(all_charging_stations, f, indent=2)
     print(f"    ✓ Saved {total_stations} charging stations to charging_stations_bc_regions.json")
@@ -7,6 +7,7 @@ import os
 import time
 import xml.etree.ElementTree as ET
 from shapely.geometry import LineString
+import graph_snapshot
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -406,6 +407,10 @@ def generate_roads_data():
         json.dump(roads_json, f, indent=2)
     print(f"    ✓ Saved road network data to roads_bc_regions.json")
     
+    print("\nSaving binary graph snapshot...")
+    num_nodes, num_edges = graph_snapshot.write_graph_snapshot(roads_json)
+    print(f"    ✓ Saved graph snapshot with {num_nodes} nodes and {num_edges} edges to {graph_snapshot.SNAPSHOT_DIR}")
+    
     total_elapsed = time.time() - start_time
     hours = int(total_elapsed // 3600)
     minutes = int((total_elapsed % 3600) // 60)
@@ -423,6 +428,7 @@ def generate_roads_data():
     print(f"Total time: {hours}h {minutes}m {seconds}s")
     print("Generated files:")
     print("- roads_bc_regions.json")
+    print(f"- {graph_snapshot.SNAPSHOT_DIR}/")
     print("="*80)
     
     return combined_G
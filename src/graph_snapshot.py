@@ -0,0 +1,283 @@
+"""
+Binary snapshot of the road network.
+roads_bc_regions.json is converted once into a directory of .npy arrays (dense
+node index, CSR adjacency, per-edge length/travel_time) that is loaded with
+numpy memory mapping, instead of rebuilding the graph from JSON at every startup.
+"""
+import json
+import os
+import time
+import argparse
+
+import numpy as np
+import networkx as nx
+
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_DIR = "roads_bc_regions.snapshot"
+
+# Bits of the per-edge flags array
+EDGE_HAS_ONEWAY = 1
+EDGE_ONEWAY = 2
+EDGE_HAS_REVERSED = 4
+EDGE_REVERSED = 8
+EDGE_CHARGING_CONNECTION = 16
+
+SNAPSHOT_ARRAYS = [
+    "node_ids", "sorted_node_ids", "sorted_node_index", "node_y", "node_x", "street_count",
+    "station_nodes", "station_names",
+    "offsets", "targets", "length", "travel_time", "highway", "edge_flags",
+]
+
+def _node_key(node_id):
+    return int(node_id) if node_id.isdigit() else node_id
+
+def write_graph_snapshot(roads_data, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Write the road network as a binary snapshot directory
+
+    The graph matches what load_bc_province_data builds from the JSON file: every
+    edge has key 0, so of several u->v edges the last one wins, while the neighbor
+    order follows the first occurrence. Only the edge attributes used for routing
+    are kept (length, travel_time, highway, oneway, reversed, is_charging_connection).
+
+    Parameters:
+    roads_data: parsed roads_bc_regions.json
+    snapshot_dir: output directory
+
+    Returns:
+    Tuple of (node count, edge count)
+    """
+    node_keys = [_node_key(node_id) for node_id in roads_data['nodes']]
+    node_index = {node: i for i, node in enumerate(node_keys)}
+    node_attrs = list(roads_data['nodes'].values())
+
+    # Collapse parallel edges like add_edge(u, v, key=0) does
+    edges_by_source = {}
+    for edge in roads_data['edges']:
+        source = _node_key(edge['source'])
+        target = _node_key(edge['target'])
+        for node in (source, target):
+            if node not in node_index:
+                node_index[node] = len(node_keys)
+                node_keys.append(node)
+                node_attrs.append({})
+        edges_by_source.setdefault(node_index[source], {})[node_index[target]] = edge
+
+    if any(not isinstance(node, int) for node in node_keys):
+        raise ValueError("graph snapshots need integer node IDs")
+
+    num_nodes = len(node_keys)
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    for source, targets in edges_by_source.items():
+        offsets[source + 1] = len(targets)
+    offsets = np.cumsum(offsets)
+    num_edges = int(offsets[-1])
+
+    targets = np.empty(num_edges, dtype=np.int32)
+    length = np.empty(num_edges, dtype=np.float64)
+    travel_time = np.empty(num_edges, dtype=np.float64)
+    highway = np.empty(num_edges, dtype=np.int16)
+    edge_flags = np.zeros(num_edges, dtype=np.uint8)
+    highway_classes = []
+    highway_index = {}
+
+    for source, source_edges in edges_by_source.items():
+        position = int(offsets[source])
+        for target, edge in source_edges.items():
+            targets[position] = target
+
+            edge_length = edge.get('length')
+            length[position] = np.nan if edge_length is None else edge_length
+            if 'travel_time' in edge:
+                travel_time[position] = edge['travel_time']
+            else:
+                # Same default as load_bc_province_data
+                travel_time[position] = edge_length / 13.89 if edge_length is not None else 60
+
+            highway_value = edge.get('highway', '')
+            highway_key = json.dumps(highway_value)
+            if highway_key not in highway_index:
+                highway_index[highway_key] = len(highway_classes)
+                highway_classes.append(highway_value)
+            highway[position] = highway_index[highway_key]
+
+            flags = 0
+            if 'oneway' in edge:
+                flags |= EDGE_HAS_ONEWAY | (EDGE_ONEWAY if edge['oneway'] else 0)
+            if 'reversed' in edge:
+                flags |= EDGE_HAS_REVERSED | (EDGE_REVERSED if edge['reversed'] else 0)
+            if edge.get('is_charging_connection', False):
+                flags |= EDGE_CHARGING_CONNECTION
+            edge_flags[position] = flags
+
+            position += 1
+
+    station_nodes = [i for i, data in enumerate(node_attrs) if data.get('is_charging_station', False)]
+
+    node_ids = np.array(node_keys, dtype=np.int64)
+    # Sorted copy of the IDs for binary search lookups of the dense index
+    sorted_node_index = np.argsort(node_ids, kind="stable").astype(np.int32)
+
+    arrays = {
+        "node_ids": node_ids,
+        "sorted_node_ids": node_ids[sorted_node_index],
+        "sorted_node_index": sorted_node_index,
+        "node_y": np.array([np.nan if data.get('y') is None else data['y'] for data in node_attrs], dtype=np.float64),
+        "node_x": np.array([np.nan if data.get('x') is None else data['x'] for data in node_attrs], dtype=np.float64),
+        "street_count": np.array([data.get('street_count', 0) for data in node_attrs], dtype=np.int32),
+        "station_nodes": np.array(station_nodes, dtype=np.int32),
+        "station_names": np.array([node_attrs[i].get('station_name', '') for i in station_nodes], dtype=np.str_),
+        "offsets": offsets,
+        "targets": targets,
+        "length": length,
+        "travel_time": travel_time,
+        "highway": highway,
+        "edge_flags": edge_flags,
+    }
+
+    # Write into a temporary directory and swap it in, so readers never see a half-written snapshot
+    tmp_dir = snapshot_dir.rstrip(os.sep) + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), array)
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "num_nodes": num_nodes,
+        "num_edges": num_edges,
+        "highway_classes": highway_classes,
+        "created_date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(snapshot_dir):
+        old_dir = snapshot_dir.rstrip(os.sep) + ".old"
+        os.replace(snapshot_dir, old_dir)
+        os.replace(tmp_dir, snapshot_dir)
+        for filename in os.listdir(old_dir):
+            os.remove(os.path.join(old_dir, filename))
+        os.rmdir(old_dir)
+    else:
+        os.replace(tmp_dir, snapshot_dir)
+
+    return num_nodes, num_edges
+
+def load_graph_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Memory-map a snapshot written by write_graph_snapshot
+
+    Returns:
+    Dictionary with the manifest entries and the arrays (read-only, backed by the
+    files, so worker processes share the pages). The arrays are plain ndarray views
+    of the memory maps, which index much faster than numpy.memmap objects.
+    """
+    with open(os.path.join(snapshot_dir, "manifest.json"), "r") as f:
+        snapshot = json.load(f)
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported graph snapshot version {snapshot.get('version')} "
+                         f"(expected {SNAPSHOT_VERSION}), convert roads_bc_regions.json again")
+
+    for name in SNAPSHOT_ARRAYS:
+        snapshot[name] = np.load(os.path.join(snapshot_dir, name + ".npy"), mmap_mode='r').view(np.ndarray)
+
+    return snapshot
+
+def lookup_node_index(sorted_node_ids, sorted_node_index, node):
+    """
+    Dense index of a node ID with a binary search over the sorted_node_ids array of a
+    snapshot, None if the node is not in it
+    """
+    try:
+        node = int(node)
+    except (TypeError, ValueError):
+        return None
+
+    position = int(sorted_node_ids.searchsorted(node))
+    if position < len(sorted_node_ids) and int(sorted_node_ids[position]) == node:
+        return int(sorted_node_index[position])
+    return None
+
+def snapshot_is_current(snapshot_dir=SNAPSHOT_DIR, roads_file="roads_bc_regions.json"):
+    """
+    Check that a snapshot of the current version exists and is not older than the
+    roads JSON file it was made from
+    """
+    manifest_file = os.path.join(snapshot_dir, "manifest.json")
+    if not os.path.exists(manifest_file):
+        return False
+    with open(manifest_file, "r") as f:
+        if json.load(f).get("version") != SNAPSHOT_VERSION:
+            return False
+    if os.path.exists(roads_file) and os.path.getmtime(roads_file) > os.path.getmtime(manifest_file):
+        return False
+    return True
+
+def snapshot_to_networkx(snapshot):
+    """
+    Build the networkx MultiDiGraph used by the route planner from a snapshot,
+    with bulk inserts instead of one add_node/add_edge call per element
+    """
+    node_ids = snapshot["node_ids"].tolist()
+    node_y = snapshot["node_y"].tolist()
+    node_x = snapshot["node_x"].tolist()
+    street_count = snapshot["street_count"].tolist()
+
+    node_data = [{"y": None if y != y else y, "x": None if x != x else x, "street_count": count}
+                 for y, x, count in zip(node_y, node_x, street_count)]
+    for index, name in zip(snapshot["station_nodes"].tolist(), snapshot["station_names"].tolist()):
+        node_data[index]["is_charging_station"] = True
+        node_data[index]["station_name"] = name
+
+    offsets = snapshot["offsets"]
+    sources = np.repeat(np.arange(len(node_ids)), np.diff(offsets)).tolist()
+    targets = snapshot["targets"].tolist()
+    length = snapshot["length"].tolist()
+    travel_time = snapshot["travel_time"].tolist()
+    highway_classes = snapshot["highway_classes"]
+    highway = snapshot["highway"].tolist()
+    edge_flags = snapshot["edge_flags"].tolist()
+
+    def edge_data(position):
+        data = {"highway": highway_classes[highway[position]], "travel_time": travel_time[position]}
+        if length[position] == length[position]:
+            data["length"] = length[position]
+        flags = edge_flags[position]
+        if flags & EDGE_HAS_ONEWAY:
+            data["oneway"] = bool(flags & EDGE_ONEWAY)
+        if flags & EDGE_HAS_REVERSED:
+            data["reversed"] = bool(flags & EDGE_REVERSED)
+        if flags & EDGE_CHARGING_CONNECTION:
+            data["is_charging_connection"] = True
+        return data
+
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(zip(node_ids, node_data))
+    G.add_edges_from((node_ids[source], node_ids[target], 0, edge_data(position))
+                     for position, (source, target) in enumerate(zip(sources, targets)))
+
+    return G
+
+def convert_roads_file(roads_file="roads_bc_regions.json", snapshot_dir=SNAPSHOT_DIR):
+    """
+    Convert an existing roads JSON file into a graph snapshot
+    """
+    start_time = time.time()
+
+    print(f"Loading {roads_file}...")
+    with open(roads_file, "r", encoding="utf-8") as f:
+        roads_data = json.load(f)
+
+    num_nodes, num_edges = write_graph_snapshot(roads_data, snapshot_dir)
+    print(f"    ✓ Saved graph snapshot with {num_nodes} nodes and {num_edges} edges to {snapshot_dir}")
+    print(f"    Total time: {time.time() - start_time:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert roads_bc_regions.json into a binary graph snapshot")
+    parser.add_argument("roads_file", nargs="?", default="roads_bc_regions.json")
+    parser.add_argument("--output", default=SNAPSHOT_DIR, help="snapshot directory to write")
+    args = parser.parse_args()
+
+    convert_roads_file(args.roads_file, args.output)
@@ -0,0 +1,402 @@
+"""
+Storage helpers for the nearest charging station data of the road nodes.
+Results are streamed to an append-only NDJSON file (one node per line) and
+compacted into intersections_bc_regions.json when the calculation is done.
+The top-k nearest stations are stored column-wise in a .npz file instead.
+"""
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class IntersectionsWriter:
+    def __init__(self, path, flush_interval=1000):
+        """
+        Append-only NDJSON sink for per-node results
+
+        Args:
+            path (str): NDJSON file to append to (created if missing)
+            flush_interval (int): flush to disk after this many records
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.count = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path):
+            self._drop_partial_line(path)
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = 0
+
+    @staticmethod
+    def _drop_partial_line(path):
+        """Cut off a half-written last line left behind by an interrupted run"""
+        with open(path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            position = size
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            if position != size:
+                f.truncate(position)
+
+    def write(self, node_id, record):
+        """
+        Append the result of one node. record is the intersections entry of the
+        node, or None when the node has no charging station in range.
+        """
+        line = {"node": str(node_id)}
+        if record is None:
+            line["nearest_charging_station"] = None
+        else:
+            line.update(record)
+
+        self._file.write(json.dumps(line) + "\n")
+        self.count += 1
+        self._pending += 1
+
+        if self._pending >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_ndjson_intersections(path, include_empty=False):
+    """
+    Read an NDJSON intersections file into a dictionary
+
+    A truncated last line (e.g. after a crash mid-write) is ignored. If a node
+    appears more than once, the last record wins.
+
+    Args:
+        path (str): NDJSON file
+        include_empty (bool): keep nodes without a charging station in range (as None)
+
+    Returns:
+        dict: {node_id_str: record}
+    """
+    intersections = {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            node_id = record.pop("node")
+            if record.get("nearest_charging_station") is None:
+                if include_empty:
+                    intersections[node_id] = None
+                else:
+                    intersections.pop(node_id, None)
+                continue
+
+            intersections[node_id] = record
+
+    return intersections
+
+
+def compact_intersections(ndjson_path, output_path, node_order=None, indent=2):
+    """
+    Compact an NDJSON intersections file into the intersections_bc_regions.json format
+
+    Args:
+        ndjson_path (str): NDJSON file written by IntersectionsWriter
+        output_path (str): JSON file to write
+        node_order (iterable): optional node ID order for the output (e.g. the
+            node order of roads_bc_regions.json), defaults to file order
+        indent (int): JSON indentation, None for the most compact output
+
+    Returns:
+        int: number of nodes written
+    """
+    intersections = read_ndjson_intersections(ndjson_path)
+
+    if node_order is not None:
+        intersections = {str(node_id): intersections[str(node_id)]
+                         for node_id in node_order if str(node_id) in intersections}
+
+    return write_intersections(intersections, output_path, indent=indent)
+
+
+def write_intersections(intersections, output_path, indent=2):
+    """
+    Write an intersections dictionary to a JSON file, or an NDJSON file if output_path
+    ends with .ndjson. The data goes to a temporary file that replaces output_path when
+    complete, so readers never see a half-written file.
+
+    Args:
+        intersections (dict): {node_id_str: record}
+        output_path (str): JSON or NDJSON file to write
+        indent (int): JSON indentation, None for the most compact output
+
+    Returns:
+        int: number of nodes written
+    """
+    tmp_path = output_path + ".tmp"
+    if output_path.endswith(".ndjson"):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with IntersectionsWriter(tmp_path) as writer:
+            for node_id, record in intersections.items():
+                writer.write(node_id, record)
+    else:
+        with open(tmp_path, "w") as f:
+            json.dump(intersections, f, indent=indent)
+    os.replace(tmp_path, output_path)
+
+    return len(intersections)
+
+
+def newest_file(paths):
+    """
+    Most recently modified of the existing files in paths, so a stale file in another
+    format is never preferred over fresh results. None if none of them exists.
+    """
+    existing = [path for path in paths if os.path.exists(path)]
+    if not existing:
+        return None
+    return max(existing, key=os.path.getmtime)
+
+
+def load_intersections(path):
+    """
+    Load intersections data from either the compacted JSON file or the NDJSON stream
+
+    Returns:
+        dict: {node_id_str: record}
+    """
+    if path.endswith(".ndjson"):
+        return read_ndjson_intersections(path)
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_station_table(path, node_ids, station_idx, distance, stations):
+    """
+    Save the top-k nearest stations of every node as a columnar .npz file
+
+    Args:
+        path (str): .npz file to write
+        node_ids (array): road node IDs, one row per node
+        station_idx (array): [nodes, k] indices into stations, -1 where a node has fewer than k stations in range
+        distance (array): [nodes, k] road distances in meters, inf where station_idx is -1
+        stations (list): station table, [{"name": ..., "location": {"latitude": ..., "longitude": ...}}]
+
+    Returns:
+        int: number of nodes written
+    """
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids, kind="stable")
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # np.savez appends .npz to names without it, so keep the suffix on the temporary file
+    tmp_path = path[:-len(".npz")] + ".tmp.npz" if path.endswith(".npz") else path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        node_ids=node_ids[order],
+        station_idx=np.asarray(station_idx, dtype=np.int32)[order],
+        distance=np.asarray(distance, dtype=np.float32)[order],
+        station_names=np.array([station["name"] for station in stations], dtype=np.str_),
+        station_lat=np.array([station["location"]["latitude"] for station in stations], dtype=np.float64),
+        station_lon=np.array([station["location"]["longitude"] for station in stations], dtype=np.float64),
+    )
+    os.replace(tmp_path, path)
+
+    return len(node_ids)
+
+
+class NearestStationTable:
+    def __init__(self, path):
+        """
+        Read-only lookup of the top-k nearest stations written by save_station_table
+
+        Rows are sorted by node ID and looked up with a binary search, so no
+        per-node Python objects are created.
+
+        Args:
+            path (str): .npz file written by save_station_table
+        """
+        with np.load(path, allow_pickle=False) as data:
+            self.node_ids = data["node_ids"]
+            self.station_idx = data["station_idx"]
+            self.distance = data["distance"]
+            self.station_names = data["station_names"]
+            self.station_lat = data["station_lat"]
+            self.station_lon = data["station_lon"]
+
+        self.k = self.station_idx.shape[1] if self.station_idx.ndim == 2 else 0
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def _row(self, node_id):
+        try:
+            node_id = int(node_id)
+        except (TypeError, ValueError):
+            return None
+
+        row = int(np.searchsorted(self.node_ids, node_id))
+        if row < len(self.node_ids) and self.node_ids[row] == node_id:
+            return row
+        return None
+
+    def __contains__(self, node_id):
+        row = self._row(node_id)
+        return row is not None and self.station_idx[row, 0] >= 0
+
+    def station(self, index):
+        """Station table entry in the intersections_bc_regions.json format (without distance)"""
+        return {
+            "name": str(self.station_names[index]),
+            "location": {
+                "latitude": float(self.station_lat[index]),
+                "longitude": float(self.station_lon[index])
+            }
+        }
+
+    def stations(self, node_id, k=None):
+        """
+        Nearest stations of a node, nearest first
+
+        Returns:
+            list: [{"distance": ..., "name": ..., "location": {...}}], empty if the node
+            has no station in range
+        """
+        row = self._row(node_id)
+        if row is None:
+            return []
+
+        entries = []
+        for index, distance in zip(self.station_idx[row, :k], self.distance[row, :k]):
+            if index < 0:
+                break
+            entry = {"distance": float(distance)}
+            entry.update(self.station(index))
+            entries.append(entry)
+
+        return entries
+
+    def nearest_distance(self, node_id):
+        """Road distance to the nearest station, inf if there is none in range"""
+        row = self._row(node_id)
+        if row is None or self.station_idx[row, 0] < 0:
+            return float("inf")
+        return float(self.distance[row, 0])
+
+    def nearest_stations(self, node_ids=None):
+        """
+        Nearest station of every node as a NearestStationMap, without per-node dictionaries
+
+        Args:
+            node_ids (array): optional road network node IDs to restrict the map to
+
+        Returns:
+            NearestStationMap
+        """
+        in_range = self.station_idx[:, 0] >= 0
+        if node_ids is not None:
+            in_range &= np.isin(self.node_ids, np.asarray(node_ids, dtype=np.int64))
+        return NearestStationMap(self, np.flatnonzero(in_range))
+
+    def to_intersections(self):
+        """
+        Nearest station of every node in the intersections_bc_regions.json format
+
+        Returns:
+            dict: {node_id_str: record}
+        """
+        intersections = {}
+        for row in np.flatnonzero(self.station_idx[:, 0] >= 0):
+            entry = {"distance": float(self.distance[row, 0])}
+            entry.update(self.station(self.station_idx[row, 0]))
+            intersections[str(self.node_ids[row])] = {"nearest_charging_station": entry}
+
+        return intersections
+
+
+class NearestStationMap(Mapping):
+    def __init__(self, table, rows):
+        """
+        Read-only node -> {'distance', 'station': {'name', 'lat', 'lon'}} view of the
+        nearest station column of a NearestStationTable. Entries are built on lookup,
+        the view itself only keeps the node ID, distance and station index columns.
+
+        Args:
+            table (NearestStationTable): station table
+            rows (array): table rows of the nodes in the view, in ascending order
+        """
+        self.table = table
+        self.node_ids = table.node_ids[rows]
+        self.distance = table.distance[rows, 0].astype(np.float64)
+        self.station_idx = table.station_idx[rows, 0]
+
+    def _row(self, node_id):
+        try:
+            node_id = int(node_id)
+        except (TypeError, ValueError):
+            return None
+
+        row = int(np.searchsorted(self.node_ids, node_id))
+        if row < len(self.node_ids) and self.node_ids[row] == node_id:
+            return row
+        return None
+
+    def __contains__(self, node_id):
+        return self._row(node_id) is not None
+
+    def __getitem__(self, node_id):
+        row = self._row(node_id)
+        if row is None:
+            raise KeyError(node_id)
+
+        index = self.station_idx[row]
+        return {
+            "distance": float(self.distance[row]),
+            "station": {
+                "name": str(self.table.station_names[index]),
+                "lat": float(self.table.station_lat[index]),
+                "lon": float(self.table.station_lon[index])
+            }
+        }
+
+    def __iter__(self):
+        return iter(self.node_ids.tolist())
+
+    def __len__(self):
+        return len(self.node_ids)
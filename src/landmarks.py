@@ -0,0 +1,351 @@
+"""
+ALT (A*, landmarks, triangle inequality) travel time bounds for the road network.
+Landmarks are picked offline by farthest-point selection in every region of the
+graph snapshot, and the travel times from and to each landmark are stored as
+float32 arrays in the snapshot directory. At query time they give admissible
+lower bounds on the remaining travel time without any per-query preprocessing.
+"""
+import json
+import os
+import time
+import random
+import heapq
+import argparse
+
+import numpy as np
+
+import graph_snapshot
+from compact_graph import CompactGraph
+
+
+LANDMARKS_MANIFEST = "landmarks.json"
+LANDMARK_ARRAYS = ["landmark_nodes", "landmark_forward", "landmark_backward"]
+LANDMARKS_PER_REGION = 8
+# Weakly connected components smaller than this get no landmarks of their own
+MIN_REGION_NODES = 1000
+
+def csr_dijkstra(offsets, targets, weights, source):
+    """
+    Travel times from a dense node index over CSR lists (offsets, targets and
+    per-edge weights as Python lists)
+
+    Returns:
+    float64 array of travel times, inf for nodes that cannot be reached
+    """
+    distances = [float('inf')] * (len(offsets) - 1)
+    distances[source] = 0.0
+    heap = [(0.0, source)]
+
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if distance > distances[node]:
+            continue
+        for position in range(offsets[node], offsets[node + 1]):
+            target = targets[position]
+            new_distance = distance + weights[position]
+            if new_distance < distances[target]:
+                distances[target] = new_distance
+                heapq.heappush(heap, (new_distance, target))
+
+    return np.array(distances)
+
+def graph_csr_lists(graph):
+    """Forward and backward (offsets, targets, travel_time) CSR lists of a CompactGraph"""
+    reverse_offsets, sources, positions = graph.reverse_csr()
+    forward = (graph.offsets.tolist(), graph.targets.tolist(), graph.travel_time.tolist())
+    backward = (reverse_offsets.tolist(), sources.tolist(), graph.travel_time[positions].tolist())
+    return forward, backward
+
+def select_landmarks(graph, per_region=LANDMARKS_PER_REGION, min_region_nodes=MIN_REGION_NODES):
+    """
+    Farthest-point landmark selection in every region (weakly connected component) of
+    the graph, which keeps the southwest and northeast networks covered separately
+
+    Each region starts from the node farthest from its first node, and every next
+    landmark is the node farthest from the landmarks picked so far. The distance of a
+    node to a landmark is the larger of the finite travel times to and from it.
+
+    Returns:
+    Tuple of (landmark dense indices, forward distances, backward distances), the
+    distance arrays have one row per node and one float32 column per landmark
+    """
+    forward_csr, backward_csr = graph_csr_lists(graph)
+
+    labels = graph.component_labels()
+    region_labels, region_sizes = np.unique(labels, return_counts=True)
+    regions = region_labels[np.argsort(-region_sizes, kind="stable")]
+    regions = [region for region in regions if np.count_nonzero(labels == region) >= min_region_nodes]
+
+    landmarks = []
+    forward = []
+    backward = []
+
+    def spread(from_node, to_node):
+        # inf -> nan so that fmax/fmin skip the direction that cannot be traveled
+        return np.fmax(np.where(np.isinf(from_node), np.nan, from_node), np.where(np.isinf(to_node), np.nan, to_node))
+
+    for region_number, region in enumerate(regions, 1):
+        members = np.flatnonzero(labels == region)
+        region_start = len(landmarks)
+        seed = int(members[0])
+        coverage = spread(csr_dijkstra(*forward_csr, seed), csr_dijkstra(*backward_csr, seed))
+
+        for i in range(per_region):
+            candidates = coverage[members]
+            if np.all(np.isnan(candidates)):
+                break
+            landmark = int(members[np.nanargmax(candidates)])
+
+            from_landmark = csr_dijkstra(*forward_csr, landmark)
+            to_landmark = csr_dijkstra(*backward_csr, landmark)
+            landmarks.append(landmark)
+            forward.append(from_landmark.astype(np.float32))
+            backward.append(to_landmark.astype(np.float32))
+
+            distances = spread(from_landmark, to_landmark)
+            coverage = distances if i == 0 else np.fmin(coverage, distances)
+
+        print(f"    Region {region_number}: {len(members)} nodes, {len(landmarks) - region_start} landmarks")
+
+    num_nodes = len(graph.node_ids)
+    return (np.array(landmarks, dtype=np.int32),
+            np.stack(forward, axis=1) if forward else np.zeros((num_nodes, 0), dtype=np.float32),
+            np.stack(backward, axis=1) if backward else np.zeros((num_nodes, 0), dtype=np.float32))
+
+def write_landmarks(snapshot_dir=graph_snapshot.SNAPSHOT_DIR, per_region=LANDMARKS_PER_REGION,
+                    min_region_nodes=MIN_REGION_NODES):
+    """
+    Select landmarks for a graph snapshot and store their distance arrays next to it.
+    Rewriting the snapshot replaces its directory, which drops stale landmark files.
+    """
+    start_time = time.time()
+    graph = CompactGraph.load(snapshot_dir)
+
+    print(f"Selecting up to {per_region} landmarks per region of {snapshot_dir}...")
+    landmark_nodes, forward, backward = select_landmarks(graph, per_region, min_region_nodes)
+
+    arrays = {
+        "landmark_nodes": landmark_nodes,
+        "landmark_forward": forward,
+        "landmark_backward": backward,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(snapshot_dir, name + ".npy"), array)
+
+    finite = np.concatenate([forward[np.isfinite(forward)], backward[np.isfinite(backward)]])
+    manifest = {
+        "num_nodes": len(graph.node_ids),
+        "num_landmarks": len(landmark_nodes),
+        "max_distance": float(finite.max()) if len(finite) else 0.0,
+        "created_date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(snapshot_dir, LANDMARKS_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    table_bytes = forward.nbytes + backward.nbytes
+    print(f"    ✓ Saved {len(landmark_nodes)} landmarks to {snapshot_dir} "
+          f"({table_bytes / 2**20:.1f} MB, {table_bytes / max(len(graph.node_ids), 1):.0f} bytes per node)")
+    print(f"    Total time: {time.time() - start_time:.1f}s")
+
+
+class LandmarkTable:
+    def __init__(self, snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        """
+        Read-only ALT bounds from the landmark arrays of a graph snapshot
+
+        The arrays are memory-mapped, one row of landmark distances per dense node
+        index. Node IDs are mapped to dense indices with the sorted IDs of the snapshot.
+
+        Args:
+            snapshot_dir (str): snapshot directory the landmarks were written to
+        """
+        with open(os.path.join(snapshot_dir, LANDMARKS_MANIFEST), "r") as f:
+            manifest = json.load(f)
+
+        snapshot = graph_snapshot.load_graph_snapshot(snapshot_dir)
+        if manifest["num_nodes"] != snapshot["num_nodes"]:
+            raise ValueError(f"landmarks in {snapshot_dir} do not match the graph snapshot, run landmarks.py again")
+
+        arrays = {name: np.load(os.path.join(snapshot_dir, name + ".npy"), mmap_mode='r').view(np.ndarray)
+                  for name in LANDMARK_ARRAYS}
+        self.landmark_nodes = arrays["landmark_nodes"]
+        self.landmark_forward = arrays["landmark_forward"]
+        self.landmark_backward = arrays["landmark_backward"]
+        self._sorted_ids = snapshot["sorted_node_ids"]
+        self._sort_order = snapshot["sorted_node_index"]
+
+        # Largest rounding error of a bound computed from two float32 entries
+        self.tolerance = 2 * float(np.finfo(np.float32).eps) * manifest["max_distance"]
+
+    @staticmethod
+    def exists(snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        return os.path.exists(os.path.join(snapshot_dir, LANDMARKS_MANIFEST))
+
+    def __len__(self):
+        return len(self.landmark_nodes)
+
+    @property
+    def nbytes(self):
+        return self.landmark_forward.nbytes + self.landmark_backward.nbytes + self.landmark_nodes.nbytes
+
+    def index_of(self, node):
+        return graph_snapshot.lookup_node_index(self._sorted_ids, self._sort_order, node)
+
+    def _rows(self, index):
+        return self.landmark_forward[index].tolist(), self.landmark_backward[index].tolist()
+
+    def _bound(self, index, end_rows):
+        """
+        Largest triangle inequality bound over the landmarks L:
+        d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L).
+        Infinite when a landmark reaches v but not t, or t reaches a landmark that v
+        does not (inf - inf is nan and never raises the bound).
+        """
+        bound = 0.0
+        from_landmarks, to_landmarks = self._rows(index)
+        end_from_landmarks, end_to_landmarks = end_rows
+        for from_landmark, to_landmark, end_from, end_to in zip(
+                from_landmarks, to_landmarks, end_from_landmarks, end_to_landmarks):
+            if end_from - from_landmark > bound:
+                bound = end_from - from_landmark
+            if to_landmark - end_to > bound:
+                bound = to_landmark - end_to
+
+        if bound == float('inf'):
+            return bound
+        return max(0.0, bound - self.tolerance)
+
+    def index_heuristic(self, end_index):
+        """Lower bound on the travel time from a dense node index to end_index"""
+        end_rows = self._rows(end_index)
+        return lambda index: self._bound(index, end_rows)
+
+    def heuristic(self, end_node):
+        """
+        Admissible (and consistent) A* heuristic towards end_node for node IDs,
+        cached per node. Nodes outside the snapshot get 0.
+        """
+        end_index = self.index_of(end_node)
+        if end_index is None:
+            return lambda node: 0
+
+        bound = self.index_heuristic(end_index)
+        cache = {}
+
+        def heuristic(node):
+            h_score = cache.get(node)
+            if h_score is None:
+                index = self.index_of(node)
+                h_score = 0 if index is None else bound(index)
+                cache[node] = h_score
+            return h_score
+
+        return heuristic
+
+    def connected(self, source, target):
+        """
+        True if a landmark proves that target can be reached from source (source reaches
+        the landmark and the landmark reaches target), False if the bounds prove it cannot,
+        None if the landmarks cannot tell
+        """
+        source_index = self.index_of(source)
+        target_index = self.index_of(target)
+        if source_index is None or target_index is None:
+            return None
+
+        source_to_landmarks = self.landmark_backward[source_index]
+        target_from_landmarks = self.landmark_forward[target_index]
+        if np.any(np.isfinite(source_to_landmarks) & np.isfinite(target_from_landmarks)):
+            return True
+        if self._bound(source_index, self._rows(target_index)) == float('inf'):
+            return False
+        return None
+
+
+def astar_travel_time(csr, source, target, heuristic):
+    """
+    Single-objective A* on travel time between dense node indices
+
+    Returns:
+    Tuple of (travel time, number of settled nodes)
+    """
+    offsets, targets, weights = csr
+    distances = {source: 0.0}
+    settled = set()
+    heap = [(heuristic(source), 0.0, source)]
+
+    while heap:
+        _, distance, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        if node == target:
+            return distance, len(settled)
+        for position in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[position]
+            new_distance = distance + weights[position]
+            if new_distance < distances.get(neighbor, float('inf')):
+                distances[neighbor] = new_distance
+                heapq.heappush(heap, (new_distance + heuristic(neighbor), new_distance, neighbor))
+
+    return float('inf'), len(settled)
+
+def benchmark_landmarks(snapshot_dir=graph_snapshot.SNAPSHOT_DIR, num_pairs=100, seed=0):
+    """
+    Report the memory of the landmark table and the speedup of ALT over Dijkstra
+    on random connected origin-destination pairs
+    """
+    graph = CompactGraph.load(snapshot_dir)
+    table = LandmarkTable(snapshot_dir)
+    forward_csr, _ = graph_csr_lists(graph)
+
+    print(f"{len(table)} landmarks, {table.nbytes / 2**20:.1f} MB "
+          f"({table.nbytes / max(len(graph.node_ids), 1):.0f} bytes per node)")
+
+    rng = random.Random(seed)
+    node_ids = graph.node_ids
+    pairs = []
+    attempts = 0
+    while len(pairs) < num_pairs and attempts < num_pairs * 100:
+        attempts += 1
+        source = rng.randrange(len(node_ids))
+        target = rng.randrange(len(node_ids))
+        if source != target and table.connected(int(node_ids[source]), int(node_ids[target])):
+            pairs.append((source, target))
+
+    totals = {"dijkstra": [0.0, 0], "alt": [0.0, 0]}
+    for source, target in pairs:
+        heuristics = {"dijkstra": lambda index: 0.0, "alt": table.index_heuristic(target)}
+        results = {}
+        for name, heuristic in heuristics.items():
+            start_time = time.time()
+            results[name], settled = astar_travel_time(forward_csr, source, target, heuristic)
+            totals[name][0] += time.time() - start_time
+            totals[name][1] += settled
+        if abs(results["dijkstra"] - results["alt"]) > 1e-6 * max(results["dijkstra"], 1.0):
+            print(f"Warning: ALT travel time {results['alt']:.3f}s differs from {results['dijkstra']:.3f}s")
+
+    if not pairs:
+        print("No connected pairs found")
+        return
+
+    for name, (seconds, settled) in totals.items():
+        print(f"{name}: {seconds / len(pairs) * 1000:.1f} ms and {settled / len(pairs):.0f} settled nodes per query")
+    print(f"Speedup over {len(pairs)} pairs: {totals['dijkstra'][0] / max(totals['alt'][0], 1e-9):.1f}x time, "
+          f"{totals['dijkstra'][1] / max(totals['alt'][1], 1):.1f}x settled nodes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Select ALT landmarks for the graph snapshot")
+    parser.add_argument("--snapshot", default=graph_snapshot.SNAPSHOT_DIR, help="graph snapshot directory")
+    parser.add_argument("--per-region", type=int, default=LANDMARKS_PER_REGION,
+                        help="landmarks per region (weakly connected component)")
+    parser.add_argument("--min-region-nodes", type=int, default=MIN_REGION_NODES,
+                        help="smallest component that gets landmarks")
+    parser.add_argument("--benchmark", type=int, default=None, metavar="PAIRS",
+                        help="benchmark the existing landmarks on this many random pairs instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_landmarks(args.snapshot, args.benchmark)
+    else:
+        write_landmarks(args.snapshot, args.per_region, args.min_region_nodes)
@@ -8,18 +8,74 @@ import math
 from math import radians, sin, cos, sqrt, atan2
 from shapely import wkt
 import os
-from queue import PriorityQueue
+import io
+import time
+import heapq
+import bisect
 import re
+import contextlib
+import multiprocessing
+from array import array
+import numpy as np
 import map_renderer
+from intersections_store import load_intersections, newest_file, NearestStationTable, NearestStationMap
+import graph_snapshot
+from compact_graph import CompactGraph
+from landmarks import LandmarkTable
+from contraction_hierarchy import ContractionHierarchy
+from station_overlay import StationOverlay
+from vehicle_profiles import get_vehicle_profile
+from calculate_nearest_stations import MAX_STATION_DISTANCE
 
 
 SAFETY_FACTOR = 0.85 # Safety margin factor for available SOC when planning detours
+# "compact" serves requests from the array-backed CompactGraph when a graph snapshot exists,
+# "networkx" always builds a networkx MultiDiGraph
+GRAPH_BACKEND = os.environ.get('EV_GRAPH_BACKEND', 'compact')
+# Plan every route with the single search of find_charging_routes, which returns routes with zero,
+# one or several charging stops, instead of a direct search followed by a two-segment route
+CHARGING_SEARCH = os.environ.get('EV_CHARGING_SEARCH', '1') == '1'
+# "charging" is find_charging_routes (the default with CHARGING_SEARCH), "astar" find_pareto_paths,
+# "boa" the exact bi-objective A* of find_pareto_paths_boa, "sweep" the exact safety threshold
+# sweep of find_pareto_paths_sweep and "fastest" the time-only route of find_fastest_path
+SEARCH_ENGINE = os.environ.get('EV_SEARCH_ENGINE', 'charging' if CHARGING_SEARCH else 'astar')
+MAX_ROAD_SPEED = 130 # km/h, upper bound on edge speeds for the admissible travel time heuristic
+# Replace the heuristics of the search engines with exact bounds from reverse searches (see reverse_search_bounds)
+REVERSE_BOUNDS = os.environ.get('EV_REVERSE_BOUNDS', '0') == '1'
+REVERSE_BOUND_SLACK = 1.5 # reverse searches stop at this multiple of the start node's bound
+MAX_CHARGING_STOPS = 3 # charging stops per route in find_charging_routes
+# Default number of candidate charging stations of a two-segment route (a request may set its own),
+# and the wall-clock budget in seconds for searching the sections via them
+TWO_SEGMENT_CANDIDATES = int(os.environ.get('EV_TWO_SEGMENT_CANDIDATES', '4'))
+TWO_SEGMENT_BUDGET = float(os.environ.get('EV_TWO_SEGMENT_BUDGET', '60'))
+# Worker processes of the section pool started by start_section_pool. Each worker loads the BC data
+# itself, which the compact backend memory-maps and the networkx backend copies per worker.
+TWO_SEGMENT_WORKERS = int(os.environ.get('EV_TWO_SEGMENT_WORKERS', '2'))
+# Relative box size of the epsilon-dominance mode of find_pareto_paths (0 keeps exact dominance),
+# and the hard limit on the labels of one search
+PARETO_EPSILON = float(os.environ.get('EV_PARETO_EPSILON', '0'))
+MAX_LABELS = int(os.environ.get('EV_MAX_LABELS', '2000000'))
+# Wall-clock budget in seconds of one route search, after which it returns the paths found so far (0: no budget)
+SEARCH_TIME_BUDGET = float(os.environ.get('EV_SEARCH_TIME_BUDGET', '0'))
+# Vehicle energy profile of vehicle_profiles.py used when a request names none ('constant': fixed rate per km)
+VEHICLE_PROFILE = os.environ.get('EV_VEHICLE_PROFILE', 'constant')
+# Prune search labels that can no longer reach the destination above threshold_soc
+SOC_PRUNING = os.environ.get('EV_SOC_PRUNING', '1') == '1'
+SOC_DISTANCE_BOUND_FACTOR = 0.99 # share of the straight-line distance used as a lower bound on the road distance left
 
 
 # Global variables for caching data to avoid repeated overloading
 _cached_road_network = None
 _cached_charging_stations = None
 _cached_intersections = None
+_cached_station_table = None
+_cached_landmarks = None
+_cached_hierarchy = None
+_cached_overlay = None
+_cached_nearest_stations = None
+_cached_search_arrays = None
+# Long-lived process pool of evaluate_charging_stations, see start_section_pool
+_section_pool = None
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -93,22 +149,471 @@ def filter_similar_routes(paths, costs, socs, time_diff_threshold=0.02):
     
     return filtered_paths, filtered_costs, filtered_socs
 
-def find_pareto_paths(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc, energy_consumption):
+def edge_travel_time(edge_data):
     """
-    Find Pareto-optimal paths using A* search with state space exploration.
-    Optimizes for both travel time and charging safety (distance to nearest charging station).
+    Travel time of an edge in seconds, estimated from its length and road type
+    when the edge has no travel_time
+    """
+    if 'travel_time' in edge_data:
+        return edge_data['travel_time']
+    
+    edge_length = edge_data.get('length', 0)  
+    
+    road_type = edge_data.get('highway', 'residential')
+    if isinstance(road_type, list):
+        road_type = road_type[0] if road_type else 'residential'
+    
+    speed = {
+        'motorway': 100,     
+        'trunk': 80,         
+        'primary': 50,        
+        'secondary': 50,      
+        'tertiary': 50,       
+    }.get(road_type, 30)     
+    
+    speed_ms = speed * 1000 / 3600
+    
+    return edge_length / speed_ms if speed_ms > 0 else 60  
+
+def describe_infeasible_path(G, path, path_index, remaining_soc, initial_soc, threshold_soc, energy_consumption,
+                             station_table=None):
+    """
+    Find the last node of a path that is reachable on the available SOC and the charging
+    station nearest to it, print them and return the infeasible path info dictionary
+    """
+    available_soc = SAFETY_FACTOR * (initial_soc - threshold_soc)
+    max_distance_km = available_soc / energy_consumption
+    max_distance_m = max_distance_km * 1000
+    
+    cumulative_distance = 0
+    last_reachable_node_idx = 0
+    
+    for j in range(len(path) - 1):
+        try:
+            edge_data = G.edges[path[j], path[j+1], 0]
+    
+            if 'length' in edge_data:
+                distance = edge_data['length']  
+            else:
+                start_y, start_x = G.nodes[path[j]]['y'], G.nodes[path[j]]['x']
+                end_y, end_x = G.nodes[path[j+1]]['y'], G.nodes[path[j+1]]['x']
+                distance = haversine_distance(start_y, start_x, end_y, end_x)
+    
+            cumulative_distance += distance
+    
+            if cumulative_distance > max_distance_m:
+                break
+    
+            last_reachable_node_idx = j + 1
+    
+        except Exception as e:
+            continue
+    
+    last_node_info = ""
+    nearest_charging_station_info = ""
+    station_id = None  
+    fallback_stations = []
+    
+    if last_reachable_node_idx < len(path):
+        last_node = path[last_reachable_node_idx]
+        try:
+            node_data = G.nodes[last_node]
+            if 'y' in node_data and 'x' in node_data:
+                last_node_info = f"Coordinates: ({node_data['y']:.6f}, {node_data['x']:.6f})"
+    
+                try:
+                    if station_table is not None and last_node in station_table:
+                        fallback_stations = station_table.stations(last_node)
+                        nearest_station = fallback_stations[0]
+                    else:
+                        with open('charging_stations_bc_regions.json', 'r') as f:
+                            charging_stations = json.load(f)
+    
+                        nearest_station = find_nearest_charging_station(
+                            node_data['y'], node_data['x'], charging_stations)
+    
+                    if nearest_station:
+                        station_name = nearest_station['name']
+                        station_lat = nearest_station['location']['latitude']
+                        station_lon = nearest_station['location']['longitude']
+                        nearest_charging_station_info = f"{station_name} (Location: {station_lat:.6f}, {station_lon:.6f})"
+    
+                        station_id = f"{station_name}|{station_lat}|{station_lon}"
+                except Exception as e:
+                    print(f"Error finding nearest charging station: {str(e)}")
+        except:
+            pass
+    
+    info = {
+        'path_index': path_index,
+        'remaining_soc': remaining_soc,
+        'threshold_soc': threshold_soc,
+        'total_nodes': len(path),
+        'last_reachable_node_idx': last_reachable_node_idx,
+        'last_node_info': last_node_info,
+        'nearest_charging_station': nearest_charging_station_info,
+        'station_id': station_id,
+        'fallback_stations': fallback_stations
+    }
+    
+    print(f"Path #{path_index} not feasible")
+    print(f"Remaining: {remaining_soc:.1f}%")
+    print(f"Threshold: {threshold_soc}%")
+    print(f"Total Nodes: {len(path)}")
+    print(f"Last Node Visited: #{last_reachable_node_idx+1}")
+    if last_node_info:
+        print(f"Last Node Info: {last_node_info}")
+    if nearest_charging_station_info:
+        print(f"Nearest Charging Station to Last Node: {nearest_charging_station_info}")
+    for station in fallback_stations[1:]:
+        print(f"Alternative Charging Station: {station['name']} ({station['distance'] / 1000:.2f}km by road)")
+    print("")
+    
+    return info
+    
+def edge_length(G, u, v, edge_data):
+    """
+    Length of the edge (u, v) in meters, the straight-line distance between its nodes
+    when the edge has no length (like calculate_remaining_soc)
+    """
+    if 'length' in edge_data:
+        return edge_data['length']
+    
+    try:
+        start_y, start_x = G.nodes[u]['y'], G.nodes[u]['x']
+        end_y, end_x = G.nodes[v]['y'], G.nodes[v]['x']
+        return haversine_distance(start_y, start_x, end_y, end_x)
+    except:
+        return 500
+
+class SearchArrays:
+    def __init__(self, G, nearest_stations):
+        """
+        Flat per-edge and per-node costs of a road network for the label searches
+        
+        Edges are stored in CSR form over dense node indices: the outgoing edges of node
+        index i are at positions offsets[i] to offsets[i + 1] of targets, travel_time and
+        length. The fallbacks of edge_travel_time and edge_length are applied once here, and
+        safety holds the nearest charging station distance of every node (inf for nodes
+        without one), so relaxing an edge is plain indexing. The values are kept in typed
+        arrays (8 bytes each), which index as fast as lists without a Python object per
+        value. The energy of an edge depends on the vehicle profile and the consumption
+        of the request (see energy).
+        
+        Args:
+            G: CompactGraph or networkx road network
+            nearest_stations (dict): node -> {'distance', 'station'} (see build_nearest_stations),
+                or a NearestStationMap
+        """
+        self.graph = G
+        self.nearest_stations = nearest_stations
+        
+        if isinstance(G, CompactGraph):
+            self.node_ids = typed_array('q', G.node_ids)
+            self._index = None
+            self.offsets = typed_array('q', G.offsets)
+            self.targets = typed_array('q', G.targets)
+            self.travel_time = typed_array('d', G.travel_time)
+            
+            # Edges without a length get the straight-line distance, 500m without coordinates
+            length = np.array(G.length, dtype=np.float64)
+            missing = np.flatnonzero(np.isnan(length))
+            if len(missing):
+                sources = np.searchsorted(G.offsets, missing, side='right') - 1
+                targets = G.targets[missing]
+                lat1, lon1 = np.radians(G.node_y[sources]), np.radians(G.node_x[sources])
+                lat2, lon2 = np.radians(G.node_y[targets]), np.radians(G.node_x[targets])
+                a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+                distance = 6371000 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+                length[missing] = np.where(np.isnan(distance), 500, distance)
+            self.length = typed_array('d', length)
+            self.highway = G.highway
+            self.highway_classes = G.highway_classes
+            
+            safety = np.full(len(self.node_ids), np.inf)
+            if nearest_stations:
+                # A station table view already holds the node and distance columns
+                if isinstance(nearest_stations, NearestStationMap):
+                    station_nodes = nearest_stations.node_ids
+                    distances = nearest_stations.distance
+                else:
+                    station_nodes = np.fromiter(nearest_stations.keys(), dtype=np.int64, count=len(nearest_stations))
+                    distances = np.fromiter((data['distance'] for data in nearest_stations.values()),
+                                            dtype=np.float64, count=len(nearest_stations))
+                indices = G.index_array(station_nodes)
+                safety[indices[indices >= 0]] = distances[indices >= 0]
+            self.safety = typed_array('d', safety)
+        else:
+            # Node IDs of a networkx graph need not be integers, so they stay in a list
+            self.node_ids = list(G.nodes())
+            self._index = {node: index for index, node in enumerate(self.node_ids)}
+            self.offsets = array('q', [0])
+            self.targets = array('q')
+            self.travel_time = array('d')
+            self.length = array('d')
+            highway = array('q')
+            self.highway_classes = []
+            highway_index = {}
+            for node in self.node_ids:
+                for neighbor, neighbor_edges in G.adj[node].items():
+                    edge_data = neighbor_edges[0]
+                    self.targets.append(self._index[neighbor])
+                    self.travel_time.append(edge_travel_time(edge_data))
+                    self.length.append(edge_length(G, node, neighbor, edge_data))
+                    highway_key = json.dumps(edge_data.get('highway', ''))
+                    if highway_key not in highway_index:
+                        highway_index[highway_key] = len(self.highway_classes)
+                        self.highway_classes.append(edge_data.get('highway', ''))
+                    highway.append(highway_index[highway_key])
+                self.offsets.append(len(self.targets))
+            self.highway = np.frombuffer(highway, dtype=np.int64)
+            self.safety = array('d', (nearest_stations[node]['distance'] if node in nearest_stations else float('inf')
+                                      for node in self.node_ids))
+        
+        # Energy terms per vehicle profile name, and the energy of the last consumption rate of each
+        self._energy_terms = {}
+        self._energy = {}
+    
+    def index_of(self, node):
+        """Dense index of a node ID, None if the node is not in the graph"""
+        if self._index is None:
+            return self.graph.index_of(node)
+        return self._index.get(node)
+    
+    def energy_terms(self, vehicle_profile):
+        """(driving_km, auxiliary) arrays of VehicleProfile.edge_terms, computed once per profile"""
+        terms = self._energy_terms.get(vehicle_profile.name)
+        if terms is None:
+            terms = vehicle_profile.edge_terms(np.frombuffer(self.length, dtype=np.float64),
+                                               np.frombuffer(self.travel_time, dtype=np.float64),
+                                               self.highway, self.highway_classes)
+            self._energy_terms[vehicle_profile.name] = terms
+        return terms
+    
+    def energy(self, vehicle_profile, energy_consumption):
+        """% SOC used on every edge by a vehicle profile at a consumption rate (% per km)"""
+        cached = self._energy.get(vehicle_profile.name)
+        if cached is None or cached[0] != energy_consumption:
+            driving_km, auxiliary = self.energy_terms(vehicle_profile)
+            energy = driving_km * energy_consumption
+            if auxiliary is not None:
+                energy += auxiliary
+            cached = (energy_consumption, typed_array('d', energy))
+            self._energy[vehicle_profile.name] = cached
+        return cached[1]
+    
+    def per_node(self, function):
+        """function of a node ID as a function of the dense index, evaluated once per node"""
+        values = [None] * len(self.node_ids)
+        node_ids = self.node_ids
+        
+        def value_at(index):
+            value = values[index]
+            if value is None:
+                value = values[index] = function(node_ids[index])
+            return value
+        
+        return value_at
+
+def typed_array(typecode, values):
+    """Copy of a numpy array as an array.array of int64 ('q') or float64 ('d') values"""
+    result = array(typecode)
+    result.frombytes(np.ascontiguousarray(values, dtype=np.int64 if typecode == 'q' else np.float64).tobytes())
+    return result
+
+def search_arrays(G, nearest_stations):
+    """SearchArrays of a road network and its nearest stations, built once and cached"""
+    global _cached_search_arrays
+    
+    if _cached_search_arrays is None or _cached_search_arrays.graph is not G or \
+            _cached_search_arrays.nearest_stations is not nearest_stations:
+        start_time = time.time()
+        _cached_search_arrays = SearchArrays(G, nearest_stations)
+        _cached_search_arrays.energy_terms(get_vehicle_profile(VEHICLE_PROFILE))
+        print(f"Prepared the search arrays of {len(_cached_search_arrays.node_ids)} nodes and "
+              f"{len(_cached_search_arrays.targets)} edges ({time.time() - start_time:.1f}s)")
+    return _cached_search_arrays
+
+def soc_range_check(G, end_node, initial_soc, threshold_soc, energy_consumption, vehicle_profile=None):
+    """
+    SOC-aware pruning for the search engines. Returns a function out_of_range(node, energy)
+    telling whether a label at node, after using energy % SOC, can no longer reach end_node
+    with threshold_soc left. The straight-line distance to end_node at the lowest energy per
+    km of the vehicle profile is the lower bound on the rest of the trip. Returns None when
+    SOC_PRUNING is off or no route can drop below threshold_soc (calculate_remaining_soc
+    never goes below 0).
     """
+    if not SOC_PRUNING or energy_consumption <= 0 or threshold_soc <= 0:
+        return None
+    
+    min_rate = energy_consumption * get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE).min_rate_factor
+    distance_bound = soc_distance_bound(G, end_node)
+    
+    def out_of_range(node, energy):
+        # Same formula as calculate_remaining_soc, so labels reaching end_node are pruned exactly when infeasible
+        return initial_soc - energy - distance_bound(node) / 1000 * min_rate < threshold_soc
+    
+    return out_of_range
 
+def soc_distance_bound(G, end_node):
+    """
+    Lower bound in meters on the road distance from a node to end_node for the SOC-aware
+    pruning: a share of the straight-line distance, cached per node
+    """
+    try:
+        end_y = G.nodes[end_node]['y']
+        end_x = G.nodes[end_node]['x']
+    except:
+        end_y = end_x = None
+    
+    distance_bound_cache = {}
+    
+    def distance_bound(node):
+        bound = distance_bound_cache.get(node)
+        if bound is None:
+            try:
+                node_data = G.nodes[node]
+                bound = haversine_distance(node_data['y'], node_data['x'], end_y, end_x) * SOC_DISTANCE_BOUND_FACTOR
+            except:
+                bound = 0
+            distance_bound_cache[node] = bound
+        return bound
+    
+    return distance_bound
+
+def soc_scenario_check(G, end_node, soc_margins, energy_consumption, vehicle_profile=None):
+    """
+    soc_range_check for several battery scenarios, given by their sorted margins
+    initial_soc - threshold_soc (inf for a scenario without threshold). Returns a function
+    missed_scenarios(node, energy) counting the scenarios in which a label at node, after
+    using energy % SOC, can no longer reach end_node. The count never decreases along a path.
+    """
+    min_rate = energy_consumption * get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE).min_rate_factor
+    distance_bound = soc_distance_bound(G, end_node) if SOC_PRUNING else None
+    
+    def missed_scenarios(node, energy):
+        if distance_bound is not None:
+            energy += distance_bound(node) / 1000 * min_rate
+        return bisect.bisect_left(soc_margins, energy)
+    
+    return missed_scenarios
+
+def describe_out_of_range_route(G, start_node, end_node, pruned_labels, initial_soc, threshold_soc,
+                                energy_consumption, station_table=None, vehicle_profile=None):
+    """
+    Called when SOC-aware pruning left no route to end_node. Describes the fastest path,
+    ignoring the battery, as infeasible so that the two-segment route planning still gets
+    the charging stations near its last reachable node.
+    
+    Returns:
+    List with the infeasible path info dictionary, empty if end_node cannot be reached
+    """
+    print(f"No route within range: {pruned_labels} search labels ran out of battery")
+    
+    path, _ = fastest_path(G, start_node, end_node, travel_time_lower_bound(G, end_node))
+    if path is None:
+        return []
+    
+    remaining_soc = calculate_remaining_soc(path, G, initial_soc, energy_consumption, vehicle_profile)
+    return [describe_infeasible_path(G, path, 1, remaining_soc, initial_soc, threshold_soc, energy_consumption,
+                                     station_table)]
+
+def finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, max_paths,
+                         initial_soc, energy_consumption, cost_details=None, complete=True):
+    """
+    Sort the Pareto front by travel time, drop similar routes and print the result.
+    Shared by the search engines, returns (paths, costs, infeasible_paths_info, socs).
+    cost_details holds extra entries for the costs dictionary of each path. complete is
+    False when a budget stopped the search before its front was proven complete, the
+    costs dictionary of every path carries it.
+    """
+    if len(pareto_paths) == 0 and infeasible_paths_info:
+        stations_dict = {}
+        for info in infeasible_paths_info:
+            if info['station_id']:
+                if info['station_id'] not in stations_dict:
+                    stations_dict[info['station_id']] = {
+                        'station_info': info['nearest_charging_station'],
+                        'paths': []
+                    }
+                stations_dict[info['station_id']]['paths'].append(info['path_index'])
+        
+        print("\n===== Summary of Nearest Charging Stations =====")
+        print(f"Found {len(stations_dict)} unique charging stations near the last reachable nodes:")
+        
+        for i, (station_id, data) in enumerate(stations_dict.items()):
+            print(f"\n{i+1}. {data['station_info']}")
+            print(f"   Found in paths: {', '.join(map(str, data['paths']))}")
+        
+        print("\n=================================================")
+    
+    formatted_costs = []
+    for time_cost, safety_cost in pareto_costs:
+        formatted_costs.append({'time': time_cost, 'safety': safety_cost})
+    if cost_details is not None:
+        for cost, details in zip(formatted_costs, cost_details):
+            cost.update(details)
+    for cost in formatted_costs:
+        cost['complete'] = complete
+    
+    sorted_indices = sorted(range(len(formatted_costs)), key=lambda i: formatted_costs[i]['time'])
+    paths = [pareto_paths[i] for i in sorted_indices]
+    costs = [formatted_costs[i] for i in sorted_indices]
+    socs = [remaining_socs[i] for i in sorted_indices]
+    
+    if len(paths) > max_paths:
+        paths = paths[:max_paths]
+        costs = costs[:max_paths]
+        socs = socs[:max_paths]
+    
+    paths, costs, socs = filter_similar_routes(paths, costs, socs)
+
+    if complete:
+        print("\nPareto-optimal paths:")
+    else:
+        print("\nBest paths found within the search budget (the Pareto front may be incomplete):")
+    for i, (path, cost, remaining_soc) in enumerate(zip(paths, costs, socs)):
+        safety_km = cost['safety'] / 1000
+        charging_info = ""
+        if cost.get('charging_stops'):
+            charging_info = f", Charging stops: {len(cost['charging_stops'])} ({cost['charging_time']:.1f}s)"
+        print(f"Path {i+1}: Travel time: {cost['time']:.1f}s, Safety: {safety_km:.2f}km, Remaining SOC: {remaining_soc:.1f}%{charging_info}")
+    
+    return paths, costs, infeasible_paths_info, socs
+
+def iter_pareto_paths(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc, energy_consumption,
+                      station_table=None, reverse_bounds=None, landmarks=None, epsilon=None, max_labels=None,
+                      time_budget=None, vehicle_profile=None, soc_margins=None):
+    """
+    The search of find_pareto_paths as a generator, for streaming routes to the user.
+    As soon as a path reaches end_node and enters the Pareto front, a dictionary is yielded
+    with its route ID, path, time, safety, soc and energy, and the IDs of the front paths it
+    displaces (displaced). Returns (pareto_paths, pareto_costs, remaining_socs,
+    infeasible_paths_info, complete) through StopIteration.
+    With soc_margins, the sorted margins of several battery scenarios (see soc_scenario_check),
+    the energy a label has used is a third criterion of the dominance between labels at a node,
+    and the number of scenarios it can no longer serve one of the dominance between labels and
+    front paths. That count is exact at end_node and only a lower bound before it, so labels
+    at a node compare their energy instead, and the front holds the paths of every scenario
+    (see find_soc_scenarios). initial_soc and threshold_soc are then the scenario with the
+    widest margin.
+    """
+
+    try:
+        end_y = G.nodes[end_node]['y']
+        end_x = G.nodes[end_node]['x']
+    except:
+        end_y = end_x = None
+    
     def heuristic(node):
         """
         Estimate remaining time to goal using Euclidean distance and average speed
         This is the heuristic function for A* algorithm.
         """
         try:
-            node_y = G.nodes[node]['y']
-            node_x = G.nodes[node]['x']
-            end_y = G.nodes[end_node]['y']
-            end_x = G.nodes[end_node]['x']
+            node_data = G.nodes[node]
+            node_y = node_data['y']
+            node_x = node_data['x']
             
             dist_degrees = ((node_y - end_y)**2 + (node_x - end_x)**2)**0.5
             
@@ -121,21 +626,89 @@ def find_pareto_paths(G, nearest_stations, start_node, end_node, max_paths, init
         except:
             return 0  
     
+    if reverse_bounds is None:
+        reverse_bounds = REVERSE_BOUNDS
+    safety_bound = None
+    if reverse_bounds:
+        heuristic, safety_bound = reverse_search_bounds(G, nearest_stations, start_node, end_node)
+    elif landmarks is not None:
+        heuristic = landmarks.heuristic(end_node)
+    
+    # The distance estimate can overestimate, pruning against the destination needs a lower bound
+    time_bound = heuristic if reverse_bounds or landmarks is not None else travel_time_lower_bound(G, end_node)
+    
+    if epsilon is None:
+        epsilon = PARETO_EPSILON
+    if max_labels is None:
+        max_labels = MAX_LABELS
+    deadline = search_deadline(time_budget)
+    complete = True
+    
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    out_of_range = soc_range_check(G, end_node, initial_soc, threshold_soc, energy_consumption, vehicle_profile)
+    soc_pruned_labels = 0
+    missed_scenarios = None
+    if soc_margins is not None:
+        missed_scenarios = soc_scenario_check(G, end_node, soc_margins, energy_consumption, vehicle_profile)
+    
+    # The search runs on dense node indices over the precomputed edge and node costs
+    arrays = search_arrays(G, nearest_stations)
+    node_ids = arrays.node_ids
+    offsets = arrays.offsets
+    targets = arrays.targets
+    edge_time = arrays.travel_time
+    edge_energy = arrays.energy(vehicle_profile, energy_consumption)
+    node_safety = arrays.safety
+    start_index = arrays.index_of(start_node)
+    if start_index is None:
+        raise KeyError(start_node)
+    end_index = arrays.index_of(end_node)
+    if end_index is None:
+        end_index = -1
+    shared_bound = time_bound is heuristic
+    heuristic = arrays.per_node(heuristic)
+    time_bound = heuristic if shared_bound else arrays.per_node(time_bound)
+    if safety_bound is not None:
+        safety_bound = arrays.per_node(safety_bound)
+    
+    # Label pool: label i is node index label_node[i], reached from label label_parent[i]
+    # (-1 for the start label) after using label_energy[i] % SOC, and can no longer serve
+    # label_missed[i] of the soc_margins scenarios.
+    # Paths are only rebuilt for labels reaching the destination.
+    label_node = [start_index]
+    label_parent = [-1]
+    label_energy = [0]
+    label_missed = [missed_scenarios(start_node, 0) if missed_scenarios is not None else 0]
+    
+    def reconstruct_path(label):
+        """Follow the parent pointers of a label back to the start node"""
+        path = []
+        while label != -1:
+            path.append(node_ids[label_node[label]])
+            label = label_parent[label]
+        path.reverse()
+        return path
+    
     # Initialize the priority queue for A* search
     # The frontier represents the set of nodes to be explored in the A* search.
-    # Each element in the frontier is a tuple of (f_score, total_time, max_charging_dist, node, path)
+    # Each element in the frontier is a tuple of (f_score, total_time, max_charging_dist, node, label)
     # Nodes with lower combined cost are explored first, ensuring we prioritize efficient and safe paths toward the destination.
-    frontier = PriorityQueue()
+    frontier = []
     
     #Calculate the initial heuristic score (h_score) for the start node.
-    h_score = heuristic(start_node)
+    h_score = heuristic(start_index)
     f_score = h_score
     
-    frontier.put((f_score, 0, 0, start_node, [start_node]))
+    heapq.heappush(frontier, (f_score, 0, 0, start_index, 0))
     
     pareto_paths = []
     pareto_costs = []
     remaining_socs = []
+    # Route ID of each front path: the label that reached end_node
+    pareto_labels = []
+    # Missed scenarios of each front path, for the dominance with soc_margins
+    pareto_missed = []
+    front_missed = pareto_missed if soc_margins is not None else None
     
     visited = {}
     
@@ -143,261 +716,1411 @@ def find_pareto_paths(G, nearest_stations, start_node, end_node, max_paths, init
     
     infeasible_paths_info = []
     
-    unique_charging_stations = set()
+    box_size = math.log1p(epsilon) if epsilon else None
     
-    def is_dominated(costs, existing_costs_list, tolerance=0.05):
-        """Check if costs are dominated by any existing costs with tolerance"""
-        for existing_costs in existing_costs_list:
-            if (existing_costs[0] * (1 + tolerance) <= costs[0] and 
-                existing_costs[1] * (1 + tolerance) <= costs[1]):
-                return True
-        return False
+    def state_key(time, max_dist):
+        """Costs compared by the dominance of visited states, their grid box in epsilon mode"""
+        if box_size is None:
+            return time, max_dist
+        time_box = int(math.log1p(time) / box_size)
+        dist_box = int(math.log1p(max_dist) / box_size) if max_dist != float('inf') else max_dist
+        return time_box, dist_box
     
-    def is_state_dominated(node, time, max_dist):
+    def is_state_dominated(node, time, max_dist, energy):
         """Check if current state is dominated by previously visited states"""
         if node not in visited:
             return False
         
-        for v_time, v_max_dist in visited[node]:
-            if v_time <= time and v_max_dist <= max_dist:
+        time, max_dist = state_key(time, max_dist)
+        for v_time, v_max_dist, v_energy in visited[node]:
+            if v_time <= time and v_max_dist <= max_dist and v_energy <= energy:
                 return True
         return False
     
-    def update_visited(node, time, max_dist):
+    def update_visited(node, time, max_dist, energy):
         """Update visited states, removing dominated states"""
+        time, max_dist = state_key(time, max_dist)
         if node not in visited:
             visited[node] = []
-            visited[node].append((time, max_dist))
+            visited[node].append((time, max_dist, energy))
             return
         
-        new_states = [(time, max_dist)]
+        new_states = [(time, max_dist, energy)]
         
-        for v_time, v_max_dist in visited[node]:
-            if not (time <= v_time and max_dist <= v_max_dist):
-                new_states.append((v_time, v_max_dist))
+        for v_time, v_max_dist, v_energy in visited[node]:
+            if not (time <= v_time and max_dist <= v_max_dist and energy <= v_energy):
+                new_states.append((v_time, v_max_dist, v_energy))
         
         visited[node] = new_states
     
     # A* search loop
     # max_paths is the maximum number of Pareto-optimal paths to find and this variable can be changed
-    while not frontier.empty() and len(pareto_paths) < max_paths:
-        f_score, total_time, max_charging_dist, current, path = frontier.get()
+    while frontier and len(pareto_paths) < max_paths:
+        if len(label_node) >= max_labels:
+            print(f"Stopped the search at the limit of {max_labels} labels")
+            complete = False
+            break
+        if deadline is not None and time.time() > deadline:
+            print(f"Stopped the search at the time budget, {len(frontier)} labels left")
+            complete = False
+            break
         
-        if is_state_dominated(current, total_time, max_charging_dist):
+        f_score, total_time, max_charging_dist, current, label = heapq.heappop(frontier)
+        energy = label_energy[label]
+        missed = label_missed[label]
+        # The energy only takes part in the dominance of the visited states with scenarios
+        state_energy = energy if missed_scenarios is not None else 0
+        
+        if is_state_dominated(current, total_time, max_charging_dist, state_energy):
             continue
         
-        update_visited(current, total_time, max_charging_dist)
+        if pareto_costs and current != end_index and dominated_by_front(
+                total_time + time_bound(current), max_charging_dist, pareto_costs, front_missed, missed):
+            continue
         
-        if current == end_node:
-            remaining_soc = calculate_remaining_soc(path, G, initial_soc, energy_consumption)
+        update_visited(current, total_time, max_charging_dist, state_energy)
+        
+        if current == end_index:
+            path = reconstruct_path(label)
+            remaining_soc = max(0, initial_soc - energy)
             
             if remaining_soc < threshold_soc:
                 infeasible_path_counter += 1
-                
-                available_soc = SAFETY_FACTOR * (initial_soc - threshold_soc)
-                max_distance_km = available_soc / energy_consumption
-                max_distance_m = max_distance_km * 1000
-                
-                cumulative_distance = 0
-                last_reachable_node_idx = 0
-                
-                for j in range(len(path) - 1):
-                    try:
-                        edge_data = G.edges[path[j], path[j+1], 0]
-                        
-                        if 'length' in edge_data:
-                            distance = edge_data['length']  
-                        else:
-                            start_y, start_x = G.nodes[path[j]]['y'], G.nodes[path[j]]['x']
-                            end_y, end_x = G.nodes[path[j+1]]['y'], G.nodes[path[j+1]]['x']
-                            distance = haversine_distance(start_y, start_x, end_y, end_x)
-                        
-                        cumulative_distance += distance
-                        
-                        if cumulative_distance > max_distance_m:
-                            break
-                        
-                        last_reachable_node_idx = j + 1
-                        
-                    except Exception as e:
-                        continue
-                
-                last_node_info = ""
-                nearest_charging_station_info = ""
-                station_id = None  
-                
-                if last_reachable_node_idx < len(path):
-                    last_node = path[last_reachable_node_idx]
-                    try:
-                        node_data = G.nodes[last_node]
-                        if 'y' in node_data and 'x' in node_data:
-                            last_node_info = f"Coordinates: ({node_data['y']:.6f}, {node_data['x']:.6f})"
-                            
-                            try:
-                                with open('charging_stations_bc_regions.json', 'r') as f:
-                                    charging_stations = json.load(f)
-                                
-                                nearest_station = find_nearest_charging_station(
-                                    node_data['y'], node_data['x'], charging_stations)
-                                
-                                if nearest_station:
-                                    station_name = nearest_station['name']
-                                    station_lat = nearest_station['location']['latitude']
-                                    station_lon = nearest_station['location']['longitude']
-                                    nearest_charging_station_info = f"{station_name} (Location: {station_lat:.6f}, {station_lon:.6f})"
-                                    
-                                    station_id = f"{station_name}|{station_lat}|{station_lon}"
-                                    unique_charging_stations.add(station_id)
-                            except Exception as e:
-                                print(f"Error finding nearest charging station: {str(e)}")
-                    except:
-                        pass
-                
-                infeasible_paths_info.append({
-                    'path_index': infeasible_path_counter,
-                    'remaining_soc': remaining_soc,
-                    'threshold_soc': threshold_soc,
-                    'total_nodes': len(path),
-                    'last_reachable_node_idx': last_reachable_node_idx,
-                    'last_node_info': last_node_info,
-                    'nearest_charging_station': nearest_charging_station_info,
-                    'station_id': station_id
-                })
-                
-                print(f"Path #{infeasible_path_counter} not feasible")
-                print(f"Remaining: {remaining_soc:.1f}%")
-                print(f"Threshold: {threshold_soc}%")
-                print(f"Total Nodes: {len(path)}")
-                print(f"Last Node Visited: #{last_reachable_node_idx+1}")
-                if last_node_info:
-                    print(f"Last Node Info: {last_node_info}")
-                if nearest_charging_station_info:
-                    print(f"Nearest Charging Station to Last Node: {nearest_charging_station_info}")
-                print("")  
-                
+                infeasible_paths_info.append(describe_infeasible_path(
+                    G, path, infeasible_path_counter, remaining_soc, initial_soc, threshold_soc, energy_consumption,
+                    station_table))
                 continue
             
             costs = (total_time, max_charging_dist)
             
-            if not is_dominated(costs, pareto_costs):
+            if front_missed is not None:
+                dominating_costs = [existing_costs for existing_costs, existing_missed in zip(pareto_costs, pareto_missed)
+                                    if existing_missed <= missed]
+            else:
+                dominating_costs = pareto_costs
+            
+            if not is_dominated(costs, dominating_costs):
                 non_dominated_idx = []
                 non_dominated_costs = []
                 non_dominated_socs = []
                 for i, existing_costs in enumerate(pareto_costs):
-                    if not (costs[0] <= existing_costs[0] and costs[1] <= existing_costs[1] and 
-                           (costs[0] < existing_costs[0] or costs[1] < existing_costs[1])):
+                    replaced = missed <= pareto_missed[i] and (displaces(costs, existing_costs) or (
+                        missed < pareto_missed[i] and costs[0] <= existing_costs[0] and costs[1] <= existing_costs[1]))
+                    if not replaced:
                         non_dominated_idx.append(i)
                         non_dominated_costs.append(existing_costs)
                         non_dominated_socs.append(remaining_socs[i])
                 
+                kept = set(non_dominated_idx)
+                displaced = [pareto_labels[i] for i in range(len(pareto_labels)) if i not in kept]
                 pareto_paths = [pareto_paths[i] for i in non_dominated_idx]
+                pareto_labels = [pareto_labels[i] for i in non_dominated_idx]
+                pareto_missed[:] = [pareto_missed[i] for i in non_dominated_idx]
                 pareto_costs = non_dominated_costs
                 remaining_socs = non_dominated_socs
                 
                 pareto_paths.append(path)
+                pareto_labels.append(label)
+                pareto_missed.append(missed)
                 pareto_costs.append(costs)
                 remaining_socs.append(remaining_soc)
                 
+                yield {'route': label, 'path': path, 'time': total_time, 'safety': max_charging_dist,
+                       'soc': remaining_soc, 'energy': energy, 'displaced': displaced}
+                continue
+        
+        # No explicit cycle check: the states of the nodes already on this path are in
+        # visited and dominate any label that returns to them, so is_state_dominated skips it
+        for position in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[position]
+            
+            new_total_time = total_time + edge_time[position]
+            
+            new_max_charging_dist = max(max_charging_dist, node_safety[neighbor])
+            
+            new_energy = energy + edge_energy[position]
+            if missed_scenarios is not None:
+                new_missed = missed_scenarios(node_ids[neighbor], new_energy)
+                new_state_energy = new_energy
+            else:
+                new_missed = new_state_energy = 0
+            if is_state_dominated(neighbor, new_total_time, new_max_charging_dist, new_state_energy):
+                continue
+            
+            if out_of_range is not None and out_of_range(node_ids[neighbor], new_energy):
+                soc_pruned_labels += 1
+                continue
+            
+            h_score = heuristic(neighbor)
+            
+            if safety_bound is not None:
+                if h_score == float('inf') or dominated_by_front(
+                        new_total_time + h_score, max(new_max_charging_dist, safety_bound(neighbor)), pareto_costs,
+                        front_missed, new_missed):
+                    continue
+            elif pareto_costs and neighbor != end_index and dominated_by_front(
+                    new_total_time + time_bound(neighbor), new_max_charging_dist, pareto_costs, front_missed,
+                    new_missed):
+                continue
+            
+            time_norm = 3600  
+            dist_norm = 10000  
+            
+            if new_max_charging_dist <= 10000:
+                safety_score = new_max_charging_dist / 10000
+            else:
+                excess = new_max_charging_dist - 10000
+                safety_score = 1.0 + 0.5 * math.log10(1 + excess / 10000)  
+            
+            f_score = ((new_total_time + h_score) / time_norm) + safety_score
+            
+            label_node.append(neighbor)
+            label_parent.append(label)
+            label_energy.append(new_energy)
+            label_missed.append(new_missed)
+            heapq.heappush(frontier, (f_score, new_total_time, new_max_charging_dist, neighbor, len(label_node) - 1))
+    
+    if not pareto_paths and not infeasible_paths_info and soc_pruned_labels:
+        infeasible_paths_info = describe_out_of_range_route(G, start_node, end_node, soc_pruned_labels, initial_soc,
+                                                            threshold_soc, energy_consumption, station_table,
+                                                            vehicle_profile)
+    
+    return pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, complete
+
+def find_pareto_paths(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc, energy_consumption,
+                      station_table=None, reverse_bounds=None, landmarks=None, epsilon=None, max_labels=None,
+                      time_budget=None, vehicle_profile=None):
+    """
+    Find Pareto-optimal paths using A* search with state space exploration.
+    Optimizes for both travel time and charging safety (distance to nearest charging station).
+    If a station_table (top-k nearest stations) is given, the charging stations near the
+    last reachable node of infeasible paths are looked up in it instead of searched for.
+    With reverse_bounds (default REVERSE_BOUNDS) the heuristic is the exact travel time bound
+    of reverse_search_bounds and labels that cannot beat the paths found so far are pruned.
+    Otherwise a LandmarkTable (landmarks) replaces the distance estimate with ALT bounds.
+    Labels carry the energy they used, from the per-edge energy of the vehicle profile
+    (default VEHICLE_PROFILE, see vehicle_profiles.py), and are pruned as soon as they cannot
+    reach end_node above threshold_soc (see soc_range_check). Labels whose travel time lower bound and
+    charging safety are dominated by the paths already found at end_node are pruned too.
+    With epsilon (default PARETO_EPSILON) the visited states of a node are compared by their
+    box in a logarithmic grid of relative size epsilon, which keeps at most one label per box.
+    The search stops after max_labels (default MAX_LABELS) labels, or after time_budget seconds
+    (default SEARCH_TIME_BUDGET, 0 for none), and then returns the non-dominated paths found so
+    far with complete=False in their costs. iter_pareto_paths runs the search and yields every
+    path as it is found.
+    """
+    search = iter_pareto_paths(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc,
+                               energy_consumption, station_table, reverse_bounds, landmarks, epsilon, max_labels,
+                               time_budget, vehicle_profile)
+    try:
+        while True:
+            next(search)
+    except StopIteration as finished:
+        pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, complete = finished.value
+    
+    return finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, max_paths,
+                                initial_soc, energy_consumption, complete=complete)
+
+def find_soc_scenarios(G, nearest_stations, start_node, end_node, max_paths, scenarios, energy_consumption,
+                       station_table=None, landmarks=None, time_budget=None, vehicle_profile=None):
+    """
+    What-if planning for several batteries with a single search. scenarios is a list of
+    (initial_soc, threshold_soc) pairs. Apart from the SOC pruning and the feasibility of its
+    paths the search does not depend on the battery, so iter_pareto_paths runs once with the
+    pruning of the scenario with the widest margin. A label only dominates labels at its node
+    that used at least as much energy, and a front path only labels that can serve no more
+    scenarios than it does, so no scenario loses a path to a label it cannot use. The energy
+    carried in the labels then splits the front between the scenarios. The energy criterion
+    keeps many more labels per node than a single search, time_budget bounds the search.
+    
+    Returns:
+    List with the (paths, costs, infeasible_paths_info, socs) of find_pareto_paths for each
+    scenario. A scenario without a path within range describes the path of the front that
+    used the least energy as infeasible, and gets no charging stops.
+    """
+    def margin(scenario):
+        # calculate_remaining_soc never goes below 0, so a path is always feasible without a threshold
+        initial_soc, threshold_soc = scenario
+        return initial_soc - threshold_soc if threshold_soc > 0 else float('inf')
+    
+    widest_soc, widest_threshold = max(scenarios, key=margin)
+    search = iter_pareto_paths(G, nearest_stations, start_node, end_node, max_paths * len(scenarios), widest_soc,
+                               widest_threshold, energy_consumption, station_table, landmarks=landmarks,
+                               time_budget=time_budget, vehicle_profile=vehicle_profile,
+                               soc_margins=sorted(margin(scenario) for scenario in scenarios))
+    found_paths = []
+    try:
+        while True:
+            found_paths.append(next(search))
+    except StopIteration as finished:
+        _, _, _, infeasible_paths_info, complete = finished.value
+    
+    results = []
+    for initial_soc, threshold_soc in scenarios:
+        print(f"\n===== Scenario: initial SOC {initial_soc}%, threshold {threshold_soc}% =====")
+        # Replay the paths in the order of the search with the front updates of find_pareto_paths
+        paths = []
+        costs = []
+        socs = []
+        for found in found_paths:
+            if len(paths) >= max_paths:
+                break
+            remaining_soc = max(0, initial_soc - found['energy'])
+            found_costs = (found['time'], found['safety'])
+            # The search of find_pareto_paths prunes the labels of paths that a front path beats,
+            # the replay sees them and drops them exactly
+            if remaining_soc < threshold_soc or is_dominated(found_costs, costs) or \
+                    any(displaces(existing_costs, found_costs) for existing_costs in costs):
+                continue
+            kept = [i for i, existing_costs in enumerate(costs) if not displaces(found_costs, existing_costs)]
+            paths = [paths[i] for i in kept] + [found['path']]
+            costs = [costs[i] for i in kept] + [found_costs]
+            socs = [socs[i] for i in kept] + [remaining_soc]
+        
+        scenario_infeasible = infeasible_paths_info
+        if not paths and found_paths:
+            cheapest = min(found_paths, key=lambda found: found['energy'])
+            scenario_infeasible = [describe_infeasible_path(
+                G, cheapest['path'], 1, max(0, initial_soc - cheapest['energy']), initial_soc, threshold_soc,
+                energy_consumption, station_table)]
+        
+        results.append(finish_pareto_search(G, paths, costs, socs, scenario_infeasible, max_paths, initial_soc,
+                                            energy_consumption, complete=complete))
+    
+    return results
+
+def travel_time_lower_bound(G, end_node):
+    """
+    Admissible A* heuristic for the exact search engines: the straight-line distance to
+    end_node at MAX_ROAD_SPEED. Unlike the estimate of find_pareto_paths it never
+    overestimates the remaining travel time. The connector edges of a charging station
+    have no travel time, so when end_node is a station the straight-line distance of its
+    connectors is taken off first, which keeps the bound admissible and consistent across
+    them. Values are cached per node.
+    """
+    try:
+        end_y = G.nodes[end_node]['y']
+        end_x = G.nodes[end_node]['x']
+    except:
+        end_y = end_x = None
+    
+    # Longest straight-line distance covered at no travel time by an edge into end_node
+    slack = 0
+    try:
+        for neighbor, neighbor_edges in G.pred[end_node].items():
+            if edge_travel_time(neighbor_edges[0]) == 0:
+                neighbor_data = G.nodes[neighbor]
+                slack = max(slack, haversine_distance(neighbor_data['y'], neighbor_data['x'], end_y, end_x))
+    except:
+        pass
+    
+    max_speed_ms = MAX_ROAD_SPEED * 1000 / 3600
+    heuristic_cache = {}
+    
+    def heuristic(node):
+        h_score = heuristic_cache.get(node)
+        if h_score is None:
+            try:
+                node_data = G.nodes[node]
+                distance = haversine_distance(node_data['y'], node_data['x'], end_y, end_x)
+                h_score = max(0, distance - slack) / max_speed_ms
+            except:
+                h_score = 0
+            heuristic_cache[node] = h_score
+        return h_score
+    
+    return heuristic
+
+def reverse_search_bounds(G, nearest_stations, start_node, end_node):
+    """
+    Exact lower bounds towards end_node from two searches on the reversed graph: a Dijkstra
+    on travel time and a bottleneck search on the nearest-station distance of the nodes
+    after each node. Both stop once their key passes REVERSE_BOUND_SLACK times the bound of
+    start_node. Nodes they did not settle get the smallest key left in the frontier, which
+    is still a lower bound, or infinity if end_node cannot be reached from them.
+    
+    Returns:
+    Tuple of functions (time_bound, safety_bound) giving the bounds of a node
+    """
+    def charging_distance(node):
+        if node in nearest_stations:
+            return nearest_stations[node]['distance']
+        return float('inf')
+    
+    def reverse_search(extend):
+        bounds = {end_node: 0}
+        best = {end_node: 0}
+        frontier = [(0, end_node)]
+        radius = float('inf')
+        
+        while frontier:
+            key, node = heapq.heappop(frontier)
+            if key > best[node]:
+                continue
+            if key > radius:
+                return bounds, key
+            bounds[node] = key
+            if node == start_node:
+                radius = key * REVERSE_BOUND_SLACK
+            
+            for predecessor, predecessor_edges in G.pred[node].items():
+                new_key = extend(key, node, predecessor_edges[0])
+                if new_key < best.get(predecessor, float('inf')):
+                    best[predecessor] = new_key
+                    heapq.heappush(frontier, (new_key, predecessor))
+        
+        return bounds, float('inf')
+    
+    time_bounds, time_default = reverse_search(lambda key, node, edge_data: key + edge_travel_time(edge_data))
+    safety_bounds, safety_default = reverse_search(lambda key, node, edge_data: max(key, charging_distance(node)))
+    
+    def time_bound(node):
+        return time_bounds.get(node, time_default)
+    
+    def safety_bound(node):
+        return safety_bounds.get(node, safety_default)
+    
+    return time_bound, safety_bound
+
+def search_deadline(time_budget):
+    """time.time() value at which a search with this budget in seconds stops, None without a budget"""
+    if time_budget is None:
+        time_budget = SEARCH_TIME_BUDGET
+    return time.time() + time_budget if time_budget > 0 else None
+
+def is_dominated(costs, existing_costs_list, tolerance=0.05):
+    """Check if (time, safety) costs are dominated by any existing costs with tolerance"""
+    for existing_costs in existing_costs_list:
+        if (existing_costs[0] * (1 + tolerance) <= costs[0] and 
+            existing_costs[1] * (1 + tolerance) <= costs[1]):
+            return True
+    return False
+
+def displaces(costs, existing_costs):
+    """Check if (time, safety) costs are no worse than existing_costs in both and better in one"""
+    return costs[0] <= existing_costs[0] and costs[1] <= existing_costs[1] and \
+        (costs[0] < existing_costs[0] or costs[1] < existing_costs[1])
+
+def dominated_by_front(time_bound, safety_bound, front_costs, front_missed=None, missed=0):
+    """
+    Check if any (time, safety) costs of the Pareto front are no worse than the bounds of a label.
+    With front_missed, the battery scenarios each front path cannot serve, only paths that miss
+    no more scenarios than the label count.
+    """
+    for i, (front_time, front_safety) in enumerate(front_costs):
+        if front_time <= time_bound and front_safety <= safety_bound and \
+                (front_missed is None or front_missed[i] <= missed):
+            return True
+    return False
+
+def find_pareto_paths_boa(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc,
+                          energy_consumption, station_table=None, reverse_bounds=None, landmarks=None,
+                          time_budget=None, vehicle_profile=None):
+    """
+    Find the Pareto front of travel time and charging safety with bi-objective A* (BOA*).
+    Labels are expanded in lexicographic (time + heuristic, max charging distance) order, so a
+    label is dominated exactly when its max charging distance is not below the smallest one
+    already expanded at its node. Keeping that value per node (g2_min) makes every dominance
+    check a single dictionary lookup. This function can replace find_pareto_paths. With
+    reverse_bounds (default REVERSE_BOUNDS) the bounds of reverse_search_bounds tighten the
+    heuristic and the pruning against the destination. Otherwise a LandmarkTable (landmarks)
+    gives ALT bounds. The order needs a consistent heuristic: the reverse and ALT bounds come
+    from exact travel times, and travel_time_lower_bound discounts the connector edges of a
+    station end_node, which have no travel time. Labels run on the dense node indices of
+    search_arrays and carry the energy they used, from the per-edge energy of vehicle_profile.
+    With SOC-aware pruning, labels out of range of end_node are pruned like in
+    find_pareto_paths, and a label using less energy can be the only one to stay in range, so
+    the dominance also compares energy: it is the exact front of the paths that keep
+    threshold_soc. Without it the dominance ignores energy, so it is the front of all paths,
+    and those of its paths that drop below threshold_soc are reported as infeasible. Every
+    path found is a point of the front, so when time_budget (see find_pareto_paths) expires
+    the paths so far are returned as the fastest part of the front.
+    """
+    
+    if reverse_bounds is None:
+        reverse_bounds = REVERSE_BOUNDS
+    safety_bound = None
+    if reverse_bounds:
+        heuristic, safety_bound = reverse_search_bounds(G, nearest_stations, start_node, end_node)
+    elif landmarks is not None:
+        heuristic = landmarks.heuristic(end_node)
+    else:
+        heuristic = travel_time_lower_bound(G, end_node)
+    deadline = search_deadline(time_budget)
+    complete = True
+    
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    out_of_range = soc_range_check(G, end_node, initial_soc, threshold_soc, energy_consumption, vehicle_profile)
+    soc_pruned_labels = 0
+    
+    arrays = search_arrays(G, nearest_stations)
+    node_ids = arrays.node_ids
+    offsets = arrays.offsets
+    targets = arrays.targets
+    edge_time = arrays.travel_time
+    edge_energy = arrays.energy(vehicle_profile, energy_consumption)
+    node_safety = arrays.safety
+    start_index = arrays.index_of(start_node)
+    if start_index is None:
+        raise KeyError(start_node)
+    end_index = arrays.index_of(end_node)
+    if end_index is None:
+        end_index = -1
+    heuristic = arrays.per_node(heuristic)
+    if safety_bound is not None:
+        safety_bound = arrays.per_node(safety_bound)
+    
+    label_node = [start_index]
+    label_parent = [-1]
+    label_energy = [0]
+    
+    def reconstruct_path(label):
+        """Follow the parent pointers of a label back to the start node"""
+        path = []
+        while label != -1:
+            path.append(node_ids[label_node[label]])
+            label = label_parent[label]
+        path.reverse()
+        return path
+    
+    # Each element is (f_time, max_charging_dist, total_time, label), popped in lexicographic order
+    frontier = [(heuristic(start_index), 0, 0, 0)]
+    
+    # Smallest max charging distance expanded at each node. Infeasible paths to end_node count
+    # too, like the visited states of find_pareto_paths.
+    g2_min = {}
+    
+    # With SOC-aware pruning the labels expanded at a node form a staircase of (max charging
+    # distance, energy) instead, sorted by distance with decreasing energy. A label is dominated
+    # when the expanded label with the largest distance not above its own used no more energy.
+    energy_dominance = out_of_range is not None
+    staircases = {}
+    
+    def is_dominated(node, charging_dist, energy):
+        if not energy_dominance:
+            best = g2_min.get(node)
+            return best is not None and charging_dist >= best
+        staircase = staircases.get(node)
+        if staircase is None:
+            return False
+        position = bisect.bisect_right(staircase[0], charging_dist) - 1
+        return position >= 0 and staircase[1][position] <= energy
+    
+    def add_expanded(node, charging_dist, energy):
+        if not energy_dominance:
+            g2_min[node] = charging_dist
+            return
+        distances, energies = staircases.setdefault(node, ([], []))
+        start = bisect.bisect_left(distances, charging_dist)
+        end = start
+        while end < len(energies) and energies[end] >= energy:
+            end += 1
+        distances[start:end] = [charging_dist]
+        energies[start:end] = [energy]
+    
+    # Max charging distance of the last path expanded at end_node, each one is below the previous
+    goal_best = None
+    
+    pareto_paths = []
+    pareto_costs = []
+    remaining_socs = []
+    infeasible_path_counter = 0
+    infeasible_paths_info = []
+    
+    while frontier and len(pareto_paths) < max_paths:
+        if deadline is not None and time.time() > deadline:
+            print(f"Stopped the search at the time budget, {len(frontier)} labels left")
+            complete = False
+            break
+        
+        f_time, max_charging_dist, total_time, label = heapq.heappop(frontier)
+        current = label_node[label]
+        
+        if is_dominated(current, max_charging_dist, label_energy[label]):
+            continue
+        if goal_best is not None and max_charging_dist >= goal_best:
+            continue
+        
+        add_expanded(current, max_charging_dist, label_energy[label])
+        
+        if current == end_index:
+            goal_best = max_charging_dist
+            path = reconstruct_path(label)
+            remaining_soc = max(0, initial_soc - label_energy[label])
+            
+            if remaining_soc < threshold_soc:
+                infeasible_path_counter += 1
+                infeasible_paths_info.append(describe_infeasible_path(
+                    G, path, infeasible_path_counter, remaining_soc, initial_soc, threshold_soc, energy_consumption,
+                    station_table))
+            else:
+                pareto_paths.append(path)
+                pareto_costs.append((total_time, max_charging_dist))
+                remaining_socs.append(remaining_soc)
+            
+            continue
+        
+        # Cycles need no check: the nodes on the path were expanded with a label that dominates
+        for position in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[position]
+            new_max_charging_dist = max(max_charging_dist, node_safety[neighbor])
+            new_energy = label_energy[label] + edge_energy[position]
+            
+            if is_dominated(neighbor, new_max_charging_dist, new_energy):
+                continue
+            
+            final_charging_dist = new_max_charging_dist
+            if safety_bound is not None:
+                if heuristic(neighbor) == float('inf'):
+                    continue
+                final_charging_dist = max(new_max_charging_dist, safety_bound(neighbor))
+            if goal_best is not None and final_charging_dist >= goal_best:
+                continue
+            
+            if out_of_range is not None and out_of_range(node_ids[neighbor], new_energy):
+                soc_pruned_labels += 1
+                continue
+            
+            new_total_time = total_time + edge_time[position]
+            
+            label_node.append(neighbor)
+            label_parent.append(label)
+            label_energy.append(new_energy)
+            heapq.heappush(frontier, (new_total_time + heuristic(neighbor), new_max_charging_dist, new_total_time,
+                                      len(label_node) - 1))
+    
+    if not pareto_paths and not infeasible_paths_info and soc_pruned_labels:
+        infeasible_paths_info = describe_out_of_range_route(G, start_node, end_node, soc_pruned_labels, initial_soc,
+                                                            threshold_soc, energy_consumption, station_table,
+                                                            vehicle_profile)
+    
+    return finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, max_paths,
+                                initial_soc, energy_consumption, complete=complete)
+
+def find_pareto_paths_sweep(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc,
+                            energy_consumption, station_table=None, reverse_bounds=None, landmarks=None,
+                            time_budget=None, vehicle_profile=None):
+    """
+    Find the exact Pareto front of travel time and charging safety with a threshold sweep.
+    Safety is a bottleneck objective (the largest nearest-station distance on the path), so
+    each point of the front is the fastest feasible path over the nodes whose station distance
+    is at most some threshold. Nodes are activated in increasing station distance and a single
+    A* search over the active nodes is continued after every activation instead of restarted.
+    Whenever the travel time to end_node drops, the current path and threshold are a new
+    point of the front. While that fastest path drops below threshold_soc, a second search
+    over (time, energy) labels, continued the same way, finds the fastest path of the
+    threshold that keeps threshold_soc. Returns the same values as find_pareto_paths. With
+    reverse_bounds (default REVERSE_BOUNDS) the heuristic is the exact reverse travel time
+    bound and nodes are only activated once the threshold reaches their reverse safety bound
+    as well. Otherwise a LandmarkTable (landmarks) gives ALT travel time bounds. The searches
+    run on the dense node indices of search_arrays with the per-edge energy of vehicle_profile
+    (default VEHICLE_PROFILE). When time_budget (see find_pareto_paths) expires, the points
+    found at the lower thresholds are returned.
+    """
+    
+    if reverse_bounds is None:
+        reverse_bounds = REVERSE_BOUNDS
+    safety_bound = None
+    if reverse_bounds:
+        heuristic, safety_bound = reverse_search_bounds(G, nearest_stations, start_node, end_node)
+    elif landmarks is not None:
+        heuristic = landmarks.heuristic(end_node)
+    else:
+        heuristic = travel_time_lower_bound(G, end_node)
+    deadline = search_deadline(time_budget)
+    complete = True
+    
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    out_of_range = soc_range_check(G, end_node, initial_soc, threshold_soc, energy_consumption, vehicle_profile)
+    
+    arrays = search_arrays(G, nearest_stations)
+    node_ids = arrays.node_ids
+    offsets = arrays.offsets
+    targets = arrays.targets
+    edge_time = arrays.travel_time
+    edge_energy = arrays.energy(vehicle_profile, energy_consumption)
+    node_safety = arrays.safety
+    start_index = arrays.index_of(start_node)
+    if start_index is None:
+        raise KeyError(start_node)
+    end_index = arrays.index_of(end_node)
+    if end_index is None:
+        end_index = -1
+    heuristic = arrays.per_node(heuristic)
+    if safety_bound is not None:
+        safety_bound = arrays.per_node(safety_bound)
+    
+    def charging_distance(index):
+        """Threshold at which a node is activated"""
+        charging_dist = node_safety[index]
+        if safety_bound is not None:
+            # No path from the node to end_node stays below its safety bound
+            charging_dist = max(charging_dist, safety_bound(index))
+        return charging_dist
+    
+    # Nodes with a charging distance above the threshold are inactive. The start node is
+    # always active, its own distance is not part of the safety cost in the other engines either.
+    threshold = 0
+    best_time = {start_index: 0}
+    parent = {start_index: None}
+    frontier = [(heuristic(start_index), 0, start_index)]
+    
+    # Best time and parent of the inactive nodes reached so far, and a heap of
+    # (charging_dist, node) to activate them in order
+    blocked_time = {}
+    blocked_parent = {}
+    blocked = []
+    
+    def reconstruct_path():
+        path = []
+        node = end_index
+        while node is not None:
+            path.append(node_ids[node])
+            node = parent[node]
+        path.reverse()
+        return path
+    
+    # The (time, energy) label search for feasible paths: the labels in parent pointer lists,
+    # its frontier of (f_time, total_time, energy, label), the (time, energy) of the labels
+    # expanded at each node, and its labels at inactive nodes with their own activation heap.
+    # Labels over the energy left for threshold_soc are never created.
+    label_node = [start_index]
+    label_parent = [-1]
+    label_energy = [0]
+    label_frontier = [(heuristic(start_index), 0, 0, 0)]
+    expanded = {}
+    blocked_labels = {}
+    label_blocked = []
+    
+    def is_dominated(node, total_time, energy):
+        """Whether a label expanded at node is at least as fast and uses at most as much energy"""
+        for node_time, node_energy in expanded.get(node, ()):
+            if node_time <= total_time and node_energy <= energy:
+                return True
+        return False
+    
+    def fastest_feasible_path(time_limit):
+        """
+        Continue the label search until no label can reach end_node faster than time_limit.
+        The heuristic is consistent, so the first label popped at end_node is the fastest
+        feasible path over the active nodes.
+        
+        Returns:
+        Tuple of (list of nodes, travel time, energy), (None, inf, None) if there is no
+        faster feasible path or the time budget expired
+        """
+        nonlocal complete
+        
+        while label_frontier:
+            f_time, total_time, energy, label = label_frontier[0]
+            if f_time >= time_limit:
+                break
+            if deadline is not None and time.time() > deadline:
+                complete = False
+                break
+            heapq.heappop(label_frontier)
+            
+            current = label_node[label]
+            if is_dominated(current, total_time, energy):
+                continue
+            expanded.setdefault(current, []).append((total_time, energy))
+            
+            if current == end_index:
+                path = []
+                while label != -1:
+                    path.append(node_ids[label_node[label]])
+                    label = label_parent[label]
+                path.reverse()
+                return path, total_time, energy
+            
+            for position in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[position]
+                new_energy = energy + edge_energy[position]
+                if initial_soc - new_energy < threshold_soc:
+                    continue
+                if out_of_range is not None and out_of_range(node_ids[neighbor], new_energy):
+                    continue
+                new_total_time = total_time + edge_time[position]
+                if is_dominated(neighbor, new_total_time, new_energy):
+                    continue
+                
+                label_node.append(neighbor)
+                label_parent.append(label)
+                label_energy.append(new_energy)
+                entry = (new_total_time + heuristic(neighbor), new_total_time, new_energy, len(label_node) - 1)
+                
+                charging_dist = charging_distance(neighbor)
+                if charging_dist > threshold and neighbor != start_index:
+                    if neighbor not in blocked_labels:
+                        heapq.heappush(label_blocked, (charging_dist, neighbor))
+                        blocked_labels[neighbor] = []
+                    blocked_labels[neighbor].append(entry)
+                else:
+                    heapq.heappush(label_frontier, entry)
+        
+        return None, float('inf'), None
+    
+    pareto_paths = []
+    pareto_costs = []
+    remaining_socs = []
+    infeasible_path_counter = 0
+    infeasible_paths_info = []
+    last_end_time = float('inf')
+    last_feasible_time = float('inf')
+    
+    while True:
+        # Continue the search until no frontier entry can improve the time to end_node
+        while frontier:
+            f_time, total_time, current = frontier[0]
+            if f_time >= best_time.get(end_index, float('inf')):
+                break
+            if deadline is not None and time.time() > deadline:
+                complete = False
+                break
+            heapq.heappop(frontier)
+            
+            if total_time > best_time[current] or current == end_index:
                 continue
+            
+            for position in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[position]
+                new_total_time = total_time + edge_time[position]
+                
+                charging_dist = charging_distance(neighbor)
+                if charging_dist > threshold:
+                    if new_total_time < blocked_time.get(neighbor, float('inf')):
+                        if neighbor not in blocked_time:
+                            heapq.heappush(blocked, (charging_dist, neighbor))
+                        blocked_time[neighbor] = new_total_time
+                        blocked_parent[neighbor] = current
+                    continue
+                
+                if new_total_time < best_time.get(neighbor, float('inf')):
+                    best_time[neighbor] = new_total_time
+                    parent[neighbor] = current
+                    heapq.heappush(frontier, (new_total_time + heuristic(neighbor), new_total_time, neighbor))
+        
+        # A new point uses a node activated at this threshold, so its safety cost is the threshold
+        # (a node activated at its safety bound has a node at that distance after it)
+        end_time = best_time.get(end_index)
+        if complete and end_time is not None and end_time < last_end_time:
+            last_end_time = end_time
+            path = reconstruct_path()
+            remaining_soc = calculate_remaining_soc(path, G, initial_soc, energy_consumption, vehicle_profile)
+            
+            if remaining_soc < threshold_soc:
+                infeasible_path_counter += 1
+                infeasible_paths_info.append(describe_infeasible_path(
+                    G, path, infeasible_path_counter, remaining_soc, initial_soc, threshold_soc, energy_consumption,
+                    station_table))
+            else:
+                last_feasible_time = end_time
+                pareto_paths.append(path)
+                pareto_costs.append((end_time, threshold))
+                remaining_socs.append(remaining_soc)
+        
+        if complete and end_time is not None and end_time < last_feasible_time:
+            # The fastest path of this threshold drops below threshold_soc, a slower one may not
+            path, feasible_time, energy = fastest_feasible_path(last_feasible_time)
+            if path is not None:
+                last_feasible_time = feasible_time
+                pareto_paths.append(path)
+                pareto_costs.append((feasible_time, threshold))
+                remaining_socs.append(max(0, initial_soc - energy))
+        
+        if not complete:
+            # The times to end_node at this threshold are not final yet
+            print(f"Stopped the search at the time budget, threshold {threshold / 1000:.2f}km")
+            break
+        
+        if not blocked and not label_blocked:
+            break
+        
+        # Raise the threshold to the next station distance and activate the nodes at it
+        threshold = min(blocked[0][0] if blocked else float('inf'),
+                        label_blocked[0][0] if label_blocked else float('inf'))
+        while blocked and blocked[0][0] == threshold:
+            _, node = heapq.heappop(blocked)
+            node_time = blocked_time.pop(node)
+            node_parent = blocked_parent.pop(node)
+            if node_time < best_time.get(node, float('inf')):
+                best_time[node] = node_time
+                parent[node] = node_parent
+                heapq.heappush(frontier, (node_time + heuristic(node), node_time, node))
+        while label_blocked and label_blocked[0][0] == threshold:
+            _, node = heapq.heappop(label_blocked)
+            for entry in blocked_labels.pop(node):
+                heapq.heappush(label_frontier, entry)
+    
+    return finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, max_paths,
+                                initial_soc, energy_consumption, complete=complete)
+
+def fastest_path(G, start_node, end_node, heuristic):
+    """
+    Single-objective A* on travel time
+    
+    Returns:
+    Tuple of (list of nodes, travel time), (None, inf) if end_node cannot be reached
+    """
+    best_time = {start_node: 0}
+    parent = {start_node: None}
+    frontier = [(heuristic(start_node), 0, start_node)]
+    
+    while frontier:
+        f_time, total_time, current = heapq.heappop(frontier)
+        if total_time > best_time[current]:
+            continue
+        
+        if current == end_node:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = parent[current]
+            path.reverse()
+            return path, total_time
+        
+        for neighbor, neighbor_edges in G.adj[current].items():
+            new_total_time = total_time + edge_travel_time(neighbor_edges[0])
+            if new_total_time < best_time.get(neighbor, float('inf')):
+                best_time[neighbor] = new_total_time
+                parent[neighbor] = current
+                heapq.heappush(frontier, (new_total_time + heuristic(neighbor), new_total_time, neighbor))
+    
+    return None, float('inf')
+
+def find_fastest_path(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc,
+                      energy_consumption, station_table=None, landmarks=None, hierarchy=None, time_budget=None,
+                      vehicle_profile=None):
+    """
+    Time-only route mode: the fastest path, with its charging safety and remaining SOC
+    reported like the paths of the Pareto search engines. The path comes from the contraction
+    hierarchy (default: the one loaded by load_bc_province_data), or from A* with the
+    landmark or straight-line heuristic when there is none. A single path has no partial
+    result to return, so time_budget is accepted for the common signature only. The SOC uses
+    the energy of vehicle_profile (default VEHICLE_PROFILE).
+    """
+    if hierarchy is None:
+        hierarchy = _cached_hierarchy
+    
+    if hierarchy is not None:
+        path, total_time = hierarchy.path(start_node, end_node)
+    else:
+        heuristic = landmarks.heuristic(end_node) if landmarks is not None else travel_time_lower_bound(G, end_node)
+        path, total_time = fastest_path(G, start_node, end_node, heuristic)
+    
+    pareto_paths = []
+    pareto_costs = []
+    remaining_socs = []
+    infeasible_paths_info = []
+    
+    if path is not None:
+        max_charging_dist = 0
+        for node in path[1:]:
+            charging_dist = nearest_stations[node]['distance'] if node in nearest_stations else float('inf')
+            max_charging_dist = max(max_charging_dist, charging_dist)
+        
+        remaining_soc = calculate_remaining_soc(path, G, initial_soc, energy_consumption, vehicle_profile)
+        if remaining_soc < threshold_soc:
+            infeasible_paths_info.append(describe_infeasible_path(
+                G, path, 1, remaining_soc, initial_soc, threshold_soc, energy_consumption, station_table))
+        else:
+            pareto_paths.append(path)
+            pareto_costs.append((total_time, max_charging_dist))
+            remaining_socs.append(remaining_soc)
+    
+    return finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, infeasible_paths_info, max_paths,
+                                initial_soc, energy_consumption)
+
+def find_pareto_paths_one_to_many(G, nearest_stations, source, targets, max_paths, initial_soc, threshold_soc,
+                                  energy_consumption, reverse=False, deadline=None, vehicle_profile=None):
+    """
+    Pareto-optimal paths from source to each of several targets with a single bi-objective
+    Dijkstra, using the edge costs of find_pareto_paths. Labels are expanded in lexicographic
+    (travel time, max charging distance) order with the per-node dominance of
+    find_pareto_paths_boa. The search stops once no label can add a point to the front of any
+    target that has fewer than max_paths paths. Labels using more energy of vehicle_profile
+    (default VEHICLE_PROFILE) than initial_soc allows above threshold_soc are pruned, the
+    battery takes no part in the dominance like in the search engines. With reverse the search
+    runs on the reversed graph from source to every target (many-to-one), and the paths are
+    returned from the target to source. At deadline (a time.time() value) the search stops with
+    the paths found so far, which may be none, and complete=False in their costs.
+    
+    Returns:
+    Dictionary target -> (paths, costs, infeasible_paths_info, socs) like the search engines
+    """
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    neighbors_of = G.pred if reverse else G.adj
+    targets = list(dict.fromkeys(targets))
+    front_costs = {target: [] for target in targets}
+    front_labels = {target: [] for target in targets}
+    
+    def charging_distance(node):
+        if node in nearest_stations:
+            return nearest_stations[node]['distance']
+        return float('inf')
+    
+    def useless(total_time, max_charging_dist):
+        """No target can get a new Pareto point from a label with these costs"""
+        for target in targets:
+            if len(front_costs[target]) < max_paths and not dominated_by_front(total_time, max_charging_dist,
+                                                                                front_costs[target]):
+                return False
+        return True
+    
+    label_node = [source]
+    label_parent = [-1]
+    label_energy = [0]
+    
+    frontier = [(0, 0, 0)]
+    g2_min = {}
+    complete = True
+    
+    while frontier:
+        if deadline is not None and time.time() > deadline:
+            print(f"One-to-many search stopped at the deadline, {len(frontier)} labels left")
+            complete = False
+            break
+        
+        total_time, max_charging_dist, label = heapq.heappop(frontier)
+        current = label_node[label]
+        
+        best = g2_min.get(current)
+        if best is not None and max_charging_dist >= best:
+            continue
+        if useless(total_time, max_charging_dist):
+            continue
+        g2_min[current] = max_charging_dist
+        
+        if current in front_costs:
+            front_costs[current].append((total_time, max_charging_dist))
+            front_labels[current].append(label)
+        
+        for neighbor, neighbor_edges in neighbors_of[current].items():
+            edge_data = neighbor_edges[0]
+            
+            # The safety cost covers the nodes after the first one of a path, which on the
+            # reversed graph is the node a label is extended from
+            new_max_charging_dist = max(max_charging_dist, charging_distance(current if reverse else neighbor))
+            best = g2_min.get(neighbor)
+            if best is not None and new_max_charging_dist >= best:
+                continue
+            
+            if reverse:
+                length = edge_length(G, neighbor, current, edge_data)
+            else:
+                length = edge_length(G, current, neighbor, edge_data)
+            new_energy = label_energy[label] + vehicle_profile.edge_energy(length, edge_travel_time(edge_data),
+                                                                           edge_data.get('highway', ''),
+                                                                           energy_consumption)
+            if energy_consumption > 0 and threshold_soc > 0 and initial_soc - new_energy < threshold_soc:
+                continue
+            
+            new_total_time = total_time + edge_travel_time(edge_data)
+            if useless(new_total_time, new_max_charging_dist):
+                continue
+            
+            label_node.append(neighbor)
+            label_parent.append(label)
+            label_energy.append(new_energy)
+            heapq.heappush(frontier, (new_total_time, new_max_charging_dist, len(label_node) - 1))
+    
+    results = {}
+    for target in targets:
+        paths = []
+        remaining_socs = []
+        for label in front_labels[target]:
+            path = []
+            while label != -1:
+                path.append(label_node[label])
+                label = label_parent[label]
+            if not reverse:
+                path.reverse()
+            paths.append(path)
+            remaining_socs.append(calculate_remaining_soc(path, G, initial_soc, energy_consumption, vehicle_profile))
+        results[target] = finish_pareto_search(G, paths, front_costs[target], remaining_socs, [], max_paths,
+                                               initial_soc, energy_consumption, complete=complete)
+    return results
+
+def rank_charging_stations(G, hierarchy, stations_dict, start_node, end_node, initial_soc, threshold_soc,
+                           energy_consumption, vehicle_profile=None):
+    """
+    Score the candidate charging stations of the two-segment route with contraction hierarchy
+    queries: the fastest travel time from start_node via the station to end_node, and whether
+    the fastest path to the station keeps the remaining SOC of vehicle_profile (default
+    VEHICLE_PROFILE) above threshold_soc.
+    
+    Returns:
+    List of candidate dictionaries, the stations within range first, each group by travel time
+    """
+    candidates = []
+    
+    for station_id, station in stations_dict.items():
+        location = station['station_location']
+        node, node_distance = find_nearest_node(G, location['latitude'], location['longitude'])
+        if node is None:
+            continue
         
-        for neighbor in G.neighbors(current):
-            if neighbor in path:
-                continue
-                
-            edge_data = G.edges[current, neighbor, 0]
-            
-            if 'travel_time' in edge_data:
-                travel_time = edge_data['travel_time']
+        path, time_to_station = hierarchy.path(start_node, node)
+        time_from_station = hierarchy.distance(node, end_node)
+        if path is None or time_from_station == float('inf'):
+            continue
+        
+        candidates.append({
+            'station_id': station_id,
+            'node': node,
+            'node_distance': node_distance,
+            'time': time_to_station + time_from_station,
+            'in_range': calculate_remaining_soc(path, G, initial_soc, energy_consumption,
+                                                vehicle_profile) >= threshold_soc
+        })
+    
+    candidates.sort(key=lambda candidate: (not candidate['in_range'], candidate['time']))
+    return candidates
+
+def describe_charging_stop(G, nearest_stations, node, charging_time):
+    """Charging stop dictionary of a route: station node, name, coordinates and charging time"""
+    stop = {'node': node, 'name': 'Charging station', 'charging_time': charging_time}
+    try:
+        stop['latitude'] = G.nodes[node]['y']
+        stop['longitude'] = G.nodes[node]['x']
+    except:
+        pass
+    if node in nearest_stations and 'station' in nearest_stations[node]:
+        station = nearest_stations[node]['station']
+        stop['name'] = station.get('name', stop['name'])
+    return stop
+
+def find_charging_routes(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc,
+                         energy_consumption, station_table=None, reverse_bounds=None, landmarks=None,
+                         max_stops=MAX_CHARGING_STOPS, time_budget=None, vehicle_profile=None):
+    """
+    Find Pareto-optimal routes with zero, one or several charging stops in a single search.
+    Labels carry their SOC and number of stops besides travel time and charging safety. At
+    charging station nodes (is_charging_station) a label may charge to 100%, which costs the
+    time of calculate_charging_time and counts as a stop. Labels whose SOC drops below
+    threshold_soc, or that cannot reach end_node or a charging station any more, are pruned.
+    Travel time includes the charging time, the costs of each route also list its
+    driving_time, charging_time and charging_stops. Labels are expanded in order of
+    time + heuristic like find_pareto_paths_boa. reverse_bounds (default REVERSE_BOUNDS) and
+    landmarks give the same bounds as there, charging only adds time. When time_budget (see
+    find_pareto_paths) expires, the routes found so far are returned. The SOC of the labels
+    drops by the edge energy of vehicle_profile (default VEHICLE_PROFILE). With CHARGING_SEARCH
+    this is the default engine of test_route_planning and replaces its direct search, the
+    charging station picked from the infeasible paths and the searches of both sections.
+    """
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    min_rate = energy_consumption * vehicle_profile.min_rate_factor
+    
+    if reverse_bounds is None:
+        reverse_bounds = REVERSE_BOUNDS
+    safety_bound = None
+    if reverse_bounds:
+        heuristic, safety_bound = reverse_search_bounds(G, nearest_stations, start_node, end_node)
+    elif landmarks is not None:
+        heuristic = landmarks.heuristic(end_node)
+    else:
+        heuristic = travel_time_lower_bound(G, end_node)
+    
+    try:
+        end_y = G.nodes[end_node]['y']
+        end_x = G.nodes[end_node]['x']
+    except:
+        end_y = end_x = None
+    
+    distance_bound_cache = {}
+    
+    def distance_bound(node):
+        """Lower bound on the distance from node to end_node or to the nearest charging station"""
+        bound = distance_bound_cache.get(node)
+        if bound is None:
+            try:
+                node_data = G.nodes[node]
+                bound = haversine_distance(node_data['y'], node_data['x'], end_y, end_x)
+            except:
+                bound = 0
+            # Nodes without a nearest station have none within MAX_STATION_DISTANCE
+            if node in nearest_stations:
+                bound = min(bound, nearest_stations[node]['distance'])
             else:
-                edge_length = edge_data.get('length', 0)  
-                
-                road_type = edge_data.get('highway', 'residential')
-                if isinstance(road_type, list):
-                    road_type = road_type[0] if road_type else 'residential'
-                
-                speed = {
-                    'motorway': 100,     
-                    'trunk': 80,         
-                    'primary': 50,        
-                    'secondary': 50,      
-                    'tertiary': 50,       
-                }.get(road_type, 30)     
-                
-                speed_ms = speed * 1000 / 3600
-                
-                travel_time = edge_length / speed_ms if speed_ms > 0 else 60  
+                bound = min(bound, MAX_STATION_DISTANCE)
+            bound *= SOC_DISTANCE_BOUND_FACTOR
+            distance_bound_cache[node] = bound
+        return bound
+    
+    def is_station(node):
+        try:
+            return G.nodes[node].get('is_charging_station', False)
+        except:
+            return False
+    
+    # Label pool with parent pointers; a charging label stays at the node of its parent
+    label_node = [start_node]
+    label_parent = [-1]
+    label_charging_time = [0]
+    
+    def reconstruct_route(label):
+        """Path and charging stops (node, charging time) of a label"""
+        path = []
+        stops = []
+        while label != -1:
+            if label_charging_time[label] > 0:
+                stops.append((label_node[label], label_charging_time[label]))
+            elif not path or path[-1] != label_node[label]:
+                path.append(label_node[label])
+            label = label_parent[label]
+        path.reverse()
+        stops.reverse()
+        return path, stops
+    
+    # (time, max charging dist, soc, stops) of the labels expanded at each node
+    visited = {}
+    
+    def is_state_dominated(node, state):
+        for v_time, v_max_dist, v_soc, v_stops in visited.get(node, ()):
+            if v_time <= state[0] and v_max_dist <= state[1] and v_soc >= state[2] and v_stops <= state[3]:
+                return True
+        return False
+    
+    def update_visited(node, state):
+        time, max_dist, soc, stops = state
+        visited[node] = [state] + [v for v in visited.get(node, ())
+                                   if not (time <= v[0] and max_dist <= v[1] and soc >= v[2] and stops <= v[3])]
+    
+    # Each element is (f_time, max_charging_dist, total_time, soc, stops, label)
+    frontier = [(heuristic(start_node), 0, 0, initial_soc, 0, 0)]
+    
+    pareto_paths = []
+    pareto_costs = []
+    remaining_socs = []
+    cost_details = []
+    deadline = search_deadline(time_budget)
+    complete = True
+    
+    while frontier and len(pareto_paths) < max_paths:
+        if deadline is not None and time.time() > deadline:
+            print(f"Stopped the search at the time budget, {len(frontier)} labels left")
+            complete = False
+            break
+        
+        f_time, max_charging_dist, total_time, soc, stops, label = heapq.heappop(frontier)
+        current = label_node[label]
+        state = (total_time, max_charging_dist, soc, stops)
+        
+        if dominated_by_front(f_time, max_charging_dist, pareto_costs) or is_state_dominated(current, state):
+            continue
+        update_visited(current, state)
+        
+        if current == end_node:
+            path, route_stops = reconstruct_route(label)
+            charging_time = sum(stop_time for _, stop_time in route_stops)
+            pareto_paths.append(path)
+            pareto_costs.append((total_time, max_charging_dist))
+            remaining_socs.append(soc)
+            cost_details.append({
+                'driving_time': total_time - charging_time,
+                'charging_time': charging_time,
+                'charging_stops': [describe_charging_stop(G, nearest_stations, node, stop_time)
+                                   for node, stop_time in route_stops]
+            })
+            continue
+        
+        if stops < max_stops and is_station(current):
+            charging_time = calculate_charging_time(soc)
+            if charging_time > 0:
+                label_node.append(current)
+                label_parent.append(label)
+                label_charging_time.append(charging_time)
+                heapq.heappush(frontier, (f_time + charging_time, max_charging_dist, total_time + charging_time,
+                                          100, stops + 1, len(label_node) - 1))
+        
+        for neighbor, neighbor_edges in G.adj[current].items():
+            edge_data = neighbor_edges[0]
             
-            new_total_time = total_time + travel_time
+            new_soc = soc - vehicle_profile.edge_energy(edge_length(G, current, neighbor, edge_data),
+                                                        edge_travel_time(edge_data), edge_data.get('highway', ''),
+                                                        energy_consumption)
+            if new_soc - distance_bound(neighbor) / 1000 * min_rate < threshold_soc:
+                continue
             
             if neighbor in nearest_stations:
                 charging_dist = nearest_stations[neighbor]['distance']
             else:
                 charging_dist = float('inf')
             new_max_charging_dist = max(max_charging_dist, charging_dist)
-            
-            if is_state_dominated(neighbor, new_total_time, new_max_charging_dist):
-                continue
+            new_total_time = total_time + edge_travel_time(edge_data)
+            new_state = (new_total_time, new_max_charging_dist, new_soc, stops)
             
             h_score = heuristic(neighbor)
+            if h_score == float('inf') or is_state_dominated(neighbor, new_state):
+                continue
+            final_charging_dist = new_max_charging_dist
+            if safety_bound is not None:
+                final_charging_dist = max(new_max_charging_dist, safety_bound(neighbor))
+            if dominated_by_front(new_total_time + h_score, final_charging_dist, pareto_costs):
+                continue
             
-            time_norm = 3600  
-            dist_norm = 10000  
-            
-            if new_max_charging_dist <= 10000:
-                safety_score = new_max_charging_dist / 10000
-            else:
-                excess = new_max_charging_dist - 10000
-                safety_score = 1.0 + 0.5 * math.log10(1 + excess / 10000)  
-            
-            f_score = ((new_total_time + h_score) / time_norm) + safety_score
-            
-            new_path = path + [neighbor]
-            frontier.put((f_score, new_total_time, new_max_charging_dist, neighbor, new_path))
-    
-    if len(pareto_paths) == 0 and infeasible_paths_info:
-        stations_dict = {}
-        for info in infeasible_paths_info:
-            if info['station_id']:
-                if info['station_id'] not in stations_dict:
-                    stations_dict[info['station_id']] = {
-                        'station_info': info['nearest_charging_station'],
-                        'paths': []
-                    }
-                stations_dict[info['station_id']]['paths'].append(info['path_index'])
-        
-        print("\n===== Summary of Nearest Charging Stations =====")
-        print(f"Found {len(stations_dict)} unique charging stations near the last reachable nodes:")
-        
-        for i, (station_id, data) in enumerate(stations_dict.items()):
-            print(f"\n{i+1}. {data['station_info']}")
-            print(f"   Found in paths: {', '.join(map(str, data['paths']))}")
-        
-        print("\n=================================================")
+            label_node.append(neighbor)
+            label_parent.append(label)
+            label_charging_time.append(0)
+            heapq.heappush(frontier, (new_total_time + h_score, new_max_charging_dist, new_total_time, new_soc,
+                                      stops, len(label_node) - 1))
     
-    formatted_costs = []
-    for time_cost, safety_cost in pareto_costs:
-        formatted_costs.append({'time': time_cost, 'safety': safety_cost})
+    return finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, [], max_paths,
+                                initial_soc, energy_consumption, cost_details, complete)
+
+def bounded_road_search(G, source, max_energy, energy_consumption, target=None, reverse=False, vehicle_profile=None):
+    """
+    Dijkstra on travel time from source over the road network (towards source on the
+    reversed graph with reverse) that does not extend paths using more than max_energy % SOC
+    with the edge energy of vehicle_profile (default VEHICLE_PROFILE). Stops once target is
+    settled.
     
-    sorted_indices = sorted(range(len(formatted_costs)), key=lambda i: formatted_costs[i]['time'])
-    paths = [pareto_paths[i] for i in sorted_indices]
-    costs = [formatted_costs[i] for i in sorted_indices]
-    socs = [remaining_socs[i] for i in sorted_indices]
+    Returns:
+    Tuple of dictionaries (travel times, energies, parents) of the settled nodes, the parent
+    of a node is the next node towards source
+    """
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    neighbors_of = G.pred if reverse else G.adj
+    times = {source: 0}
+    energies = {source: 0}
+    parents = {source: None}
+    settled_times = {}
+    heap = [(0, source)]
     
-    if len(paths) > max_paths:
-        paths = paths[:max_paths]
-        costs = costs[:max_paths]
-        socs = socs[:max_paths]
+    while heap:
+        node_time, node = heapq.heappop(heap)
+        if node in settled_times:
+            continue
+        settled_times[node] = node_time
+        if node == target:
+            break
+        
+        for neighbor, neighbor_edges in neighbors_of[node].items():
+            edge_data = neighbor_edges[0]
+            if reverse:
+                length = edge_length(G, neighbor, node, edge_data)
+            else:
+                length = edge_length(G, node, neighbor, edge_data)
+            new_energy = energies[node] + vehicle_profile.edge_energy(length, edge_travel_time(edge_data),
+                                                                      edge_data.get('highway', ''), energy_consumption)
+            if new_energy > max_energy:
+                continue
+            new_time = node_time + edge_travel_time(edge_data)
+            if new_time < times.get(neighbor, float('inf')):
+                times[neighbor] = new_time
+                energies[neighbor] = new_energy
+                parents[neighbor] = node
+                heapq.heappush(heap, (new_time, neighbor))
     
-    paths, costs, socs = filter_similar_routes(paths, costs, socs)
+    return settled_times, {node: energies[node] for node in settled_times}, parents
 
-    print("\nPareto-optimal paths:")
-    for i, (path, cost) in enumerate(zip(paths, costs)):
-        remaining_soc = calculate_remaining_soc(path, G, initial_soc, energy_consumption)
+def find_overlay_route(G, nearest_stations, start_node, end_node, max_paths, initial_soc, threshold_soc,
+                       energy_consumption, station_table=None, overlay=None, vehicle_profile=None):
+    """
+    Plan a long trip with several charging stops over the station overlay of station_overlay.py
+    (default: the one loaded by load_bc_province_data). Range-bounded road searches attach
+    start_node to the stations it reaches on initial_soc and end_node to the stations that
+    reach it on a full battery. The overlay gives the fastest sequence of stops, charging to
+    100% at each, and only the legs of that route are expanded on the road network.
+    The overlay keeps the fastest path between two stations only, so the route can be a
+    little slower than the one of find_charging_routes, which may take a shorter leg to
+    charge for less time. Energy follows vehicle_profile (default VEHICLE_PROFILE). The
+    overlay only stores the length and travel time of a leg, so it plans with the energy of
+    the leg at its average speed, and the expanded legs give the exact energy and charging
+    times. Returns the route like find_charging_routes, with no route if the stations do
+    not connect start_node and end_node.
+    """
+    if overlay is None:
+        overlay = _cached_overlay
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
+    
+    pareto_paths = []
+    pareto_costs = []
+    remaining_socs = []
+    cost_details = []
+    
+    if overlay is not None and energy_consumption > 0:
+        full_energy = 100 - threshold_soc
         
-        safety_km = cost['safety'] / 1000
-        print(f"Path {i+1}: Travel time: {cost['time']:.1f}s, Safety: {safety_km:.2f}km, Remaining SOC: {remaining_soc:.1f}%")
+        start_times, start_energies, start_parents = bounded_road_search(
+            G, start_node, initial_soc - threshold_soc, energy_consumption, vehicle_profile=vehicle_profile)
+        end_times, end_energies, end_parents = bounded_road_search(
+            G, end_node, full_energy, energy_consumption, reverse=True, vehicle_profile=vehicle_profile)
+        
+        start_departures = {}
+        for node, node_time in start_times.items():
+            if node in overlay:
+                start_departures[node] = node_time + calculate_charging_time(initial_soc - start_energies[node])
+        end_legs = {node: node_time for node, node_time in end_times.items() if node in overlay}
+        print(f"Attached the start to {len(start_departures)} and the destination to {len(end_legs)} "
+              f"of {len(overlay)} charging stations")
+        
+        def leg_energy(leg_length, leg_time):
+            return vehicle_profile.edge_energy(leg_length, leg_time, '', energy_consumption)
+        
+        stops, _ = overlay.plan(start_departures, end_legs, full_energy, leg_energy,
+                                lambda energy: calculate_charging_time(100 - energy))
+        
+        if stops is not None:
+            # First leg from the start search, middle legs searched again, last leg from the end search
+            path = []
+            node = stops[0]
+            while node is not None:
+                path.append(node)
+                node = start_parents[node]
+            path.reverse()
+            
+            driving_time = start_times[stops[0]] + end_times[stops[-1]]
+            charging_stops = [describe_charging_stop(G, nearest_stations, stops[0],
+                                                     start_departures[stops[0]] - start_times[stops[0]])]
+            for leg_start, leg_end in zip(stops, stops[1:]):
+                leg_times, leg_energies, leg_parents = bounded_road_search(
+                    G, leg_start, full_energy, energy_consumption, target=leg_end, vehicle_profile=vehicle_profile)
+                if leg_end not in leg_times:
+                    print(f"The leg from charging station {leg_start} to {leg_end} is out of range")
+                    stops = None
+                    break
+                leg = []
+                node = leg_end
+                while node != leg_start:
+                    leg.append(node)
+                    node = leg_parents[node]
+                path.extend(reversed(leg))
+                driving_time += leg_times[leg_end]
+                charging_stops.append(describe_charging_stop(G, nearest_stations, leg_end,
+                                                             calculate_charging_time(100 - leg_energies[leg_end])))
+        
+        if stops is not None:
+            node = end_parents[stops[-1]]
+            while node is not None:
+                path.append(node)
+                node = end_parents[node]
+            
+            max_charging_dist = 0
+            for node in path[1:]:
+                charging_dist = nearest_stations[node]['distance'] if node in nearest_stations else float('inf')
+                max_charging_dist = max(max_charging_dist, charging_dist)
+            
+            charging_total = sum(stop['charging_time'] for stop in charging_stops)
+            pareto_paths.append(path)
+            pareto_costs.append((driving_time + charging_total, max_charging_dist))
+            remaining_socs.append(100 - end_energies[stops[-1]])
+            cost_details.append({
+                'driving_time': driving_time,
+                'charging_time': charging_total,
+                'charging_stops': charging_stops
+            })
     
-    return paths, costs, infeasible_paths_info, socs
+    return finish_pareto_search(G, pareto_paths, pareto_costs, remaining_socs, [], max_paths,
+                                initial_soc, energy_consumption, cost_details)
+
+SEARCH_ENGINES = {
+    'astar': find_pareto_paths,
+    'boa': find_pareto_paths_boa,
+    'sweep': find_pareto_paths_sweep,
+    'fastest': find_fastest_path,
+    'charging': find_charging_routes
+}
 
 def calculate_charging_time(current_soc, target_soc=100, charging_rate=3.0):
     """
@@ -413,13 +2136,329 @@ def calculate_charging_time(current_soc, target_soc=100, charging_rate=3.0):
     return charging_time_seconds
 
 
-def test_route_planning(start_address, end_address, initial_soc, threshold_soc, energy_consumption):
+def start_section_pool(workers=TWO_SEGMENT_WORKERS, graph_backend=None):
+    """
+    Start the process pool that evaluate_charging_stations runs its section searches on.
+    Called once at startup rather than per request. The workers are spawned instead of
+    forked, so starting the pool from a threaded server cannot copy locks held by other
+    threads, and each worker loads the BC data in its initializer. A request only sends
+    the parameters of its searches.
+    
+    Returns:
+    The pool, None when workers is 0
+    """
+    global _section_pool
+    
+    if _section_pool is None and workers > 0:
+        _section_pool = multiprocessing.get_context("spawn").Pool(processes=workers, initializer=init_section_worker,
+                                                                  initargs=(graph_backend,))
+    return _section_pool
+
+def init_section_worker(graph_backend):
+    """Pool initializer: load the BC data into the caches of the worker process"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        load_bc_province_data(graph_backend=graph_backend)
+
+def section_worker(task):
+    """
+    Pool worker: search_section on the data loaded by init_section_worker. Returns
+    (section, station node, results), results are None when the worker has no data.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        road_network, charging_stations, intersections = load_bc_province_data()
+        if not (road_network and charging_stations and intersections):
+            return task['section'], task['node'], None
+        nearest_stations = build_nearest_stations(road_network, intersections)
+    return task['section'], task['node'], search_section(road_network, nearest_stations, task)
+
+def search_section(road_network, nearest_stations, task):
+    """
+    One section of the two-segment route via one candidate station: section 1 from the start
+    to the station, section 2 from the station to the end (a many-to-one search on the
+    reversed graph). The search output is captured, not printed.
+    
+    Returns:
+    (paths, costs, infeasible_paths_info, socs) of the section
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        if task['section'] == 1:
+            results = find_pareto_paths_one_to_many(
+                road_network, nearest_stations, task['start_node'], [task['node']],
+                5, task['initial_soc'], task['threshold_soc'], task['energy_consumption'],
+                deadline=task['deadline'], vehicle_profile=task['vehicle_profile'])
+        else:
+            results = find_pareto_paths_one_to_many(
+                road_network, nearest_stations, task['end_node'], [task['node']],
+                5, 100, task['threshold_soc'], task['energy_consumption'],
+                reverse=True, deadline=task['deadline'], vehicle_profile=task['vehicle_profile'])
+    return results[task['node']]
+
+def evaluate_charging_stations(road_network, nearest_stations, candidates, start_node, end_node,
+                               initial_soc, threshold_soc, energy_consumption, budget=TWO_SEGMENT_BUDGET,
+                               vehicle_profile=None):
+    """
+    Search both sections of a two-segment route for each candidate charging station. The
+    searches of all candidates run in parallel on the pool of start_section_pool when it is
+    running and serves the loaded road network, otherwise one after the other in this
+    process. The candidates are ranked by the fastest total time including the charging
+    time. After budget seconds every search stops, candidates without paths by then get no
+    result. The sections use the energy of vehicle_profile (default VEHICLE_PROFILE).
+    
+    Parameters:
+    candidates: list of dictionaries with the station 'node', in order of preference
+    
+    Returns:
+    List of the candidates with their 'section1' and 'section2' search results and 'total_time'
+    (inf when a section has no feasible path), fastest first
+    """
+    start_time = time.time()
+    deadline = start_time + budget
+    
+    # The sections of the preferred candidates are queued first
+    tasks = {}
+    for candidate in candidates:
+        for section in (1, 2):
+            tasks[(section, candidate['node'])] = {
+                'section': section, 'node': candidate['node'], 'start_node': start_node, 'end_node': end_node,
+                'initial_soc': initial_soc, 'threshold_soc': threshold_soc,
+                'energy_consumption': energy_consumption, 'deadline': deadline,
+                'vehicle_profile': vehicle_profile
+            }
+    
+    results = {}
+    if _section_pool is not None and road_network is _cached_road_network:
+        for section, node, section_results in _section_pool.imap_unordered(section_worker, tasks.values()):
+            if section_results is not None:
+                results[(section, node)] = section_results
+    for key, task in tasks.items():
+        if key not in results:
+            results[key] = search_section(road_network, nearest_stations, task)
+    
+    evaluated = []
+    for candidate in candidates:
+        section1 = results[(1, candidate['node'])]
+        section2 = results[(2, candidate['node'])]
+        
+        total_time = float('inf')
+        if section1[0] and section2[0]:
+            section1_time = min(cost['time'] + calculate_charging_time(soc) for cost, soc in zip(section1[1], section1[3]))
+            section2_time = min(cost['time'] for cost in section2[1])
+            total_time = section1_time + section2_time
+        
+        evaluated.append(dict(candidate, section1=section1, section2=section2, total_time=total_time))
+    
+    print(f"Evaluated {len(candidates)} candidate charging stations in {time.time() - start_time:.1f}s")
+    evaluated.sort(key=lambda candidate: candidate['total_time'])
+    return evaluated
+
+def build_nearest_stations(road_network, intersections):
+    """
+    Nearest charging station of every road network node in the intersections data, as
+    node -> {'distance', 'station': {'name', 'lat', 'lon'}} for the search engines.
+    Built once per loaded data set, so its SearchArrays are reused by every request.
+    A NearestStationTable gives a NearestStationMap over its columns instead of a dict.
+    """
+    global _cached_nearest_stations
+    
+    if _cached_nearest_stations is not None and _cached_nearest_stations[0] is road_network and \
+            _cached_nearest_stations[1] is intersections:
+        return _cached_nearest_stations[2]
+    
+    if isinstance(intersections, NearestStationTable):
+        if isinstance(road_network, CompactGraph):
+            node_ids = road_network.node_ids
+        else:
+            node_ids = np.fromiter((node for node in road_network.nodes() if isinstance(node, (int, np.integer))),
+                                   dtype=np.int64)
+        nearest_stations = intersections.nearest_stations(node_ids)
+        print(f"Prepared nearest stations data for {len(nearest_stations)} nodes")
+        _cached_nearest_stations = (road_network, intersections, nearest_stations)
+        return nearest_stations
+    
+    nearest_stations = {}
+    road_network_nodes = set(road_network.nodes())
+    
+    for node_id, data in intersections.items():
+        node_id_int = int(node_id) if node_id.isdigit() else node_id
+        
+        if node_id_int not in road_network_nodes:
+            continue
+        
+        if 'nearest_charging_station' in data and data['nearest_charging_station'] is not None:
+            nearest_stations[node_id_int] = {
+                'distance': data['nearest_charging_station']['distance'],
+                'station': {
+                    'name': data['nearest_charging_station']['name'],
+                    'lat': data['nearest_charging_station']['location']['latitude'],
+                    'lon': data['nearest_charging_station']['location']['longitude']
+                }
+            }
+    
+    print(f"Prepared nearest stations data for {len(nearest_stations)} nodes")
+    _cached_nearest_stations = (road_network, intersections, nearest_stations)
+    return nearest_stations
+
+def locate_route(start_address, end_address):
+    """
+    Load the BC data and find the road network nodes of two addresses for the lightweight
+    endpoints (stream_route_planning, sweep_route_planning)
+    
+    Returns:
+    Tuple of (road_network, intersections, start_coords, end_coords, start_node, end_node),
+    raises ValueError with a message for the user
+    """
+    road_network, charging_stations, intersections = load_bc_province_data()
+    if not (road_network and charging_stations and intersections):
+        raise ValueError("BC region data not found.")
+    
+    start_coords = geocode_address(start_address + ", BC, Canada")
+    end_coords = geocode_address(end_address + ", BC, Canada")
+    start_node = end_node = None
+    if start_coords and end_coords:
+        start_node, _ = find_nearest_node(road_network, *start_coords)
+        end_node, _ = find_nearest_node(road_network, *end_coords)
+    if start_node is None or end_node is None:
+        raise ValueError("Invalid address entered. Please check your start or destination address.")
+    
+    connected = _cached_landmarks.connected(start_node, end_node) if _cached_landmarks is not None else None
+    if connected is None and _cached_hierarchy is not None:
+        connected = _cached_hierarchy.reachable(start_node, end_node)
+    if connected is False:
+        raise ValueError("No path exists between the start and destination.")
+    
+    return road_network, intersections, start_coords, end_coords, start_node, end_node
+
+def stream_route_planning(start_address, end_address, initial_soc, threshold_soc, energy_consumption, time_budget=None,
+                          vehicle_profile=None):
+    """
+    Route planning for the streaming endpoint: yields lightweight event dictionaries while
+    iter_pareto_paths searches, so the first route reaches the user long before the search,
+    the filtering and the map rendering of test_route_planning are done.
+    
+    Events (the 'event' key):
+    start: start and end coordinates as [lat, lon]
+    route: a new Pareto-optimal route with its ID, coordinates, time, safety_km, soc and the
+           IDs of the routes it displaces
+    done: IDs of the routes on the final front, and whether the search completed the front
+          (complete) or found no route within range (infeasible, test_route_planning then
+          plans charging stops)
+    error: a message for the user
+    """
+    try:
+        try:
+            road_network, intersections, start_coords, end_coords, start_node, end_node = locate_route(
+                start_address, end_address)
+        except ValueError as e:
+            yield {'event': 'error', 'error': str(e)}
+            return
+        
+        yield {'event': 'start', 'start': list(start_coords), 'end': list(end_coords)}
+        
+        nearest_stations = build_nearest_stations(road_network, intersections)
+        search = iter_pareto_paths(road_network, nearest_stations, start_node, end_node, 10, initial_soc,
+                                   threshold_soc, energy_consumption, station_table=_cached_station_table,
+                                   landmarks=_cached_landmarks, time_budget=time_budget,
+                                   vehicle_profile=vehicle_profile)
+        routes = []
+        try:
+            while True:
+                found = next(search)
+                routes = [route for route in routes if route not in found['displaced']] + [found['route']]
+                yield {
+                    'event': 'route',
+                    'route': found['route'],
+                    'coordinates': [[round(road_network.nodes[node]['y'], 5), round(road_network.nodes[node]['x'], 5)]
+                                    for node in found['path']],
+                    'time': round(found['time'], 1),
+                    'safety_km': round(found['safety'] / 1000, 2),
+                    'soc': round(found['soc'], 1),
+                    'displaced': found['displaced']
+                }
+        except StopIteration as finished:
+            _, _, _, infeasible_paths_info, complete = finished.value
+        
+        yield {'event': 'done', 'routes': routes, 'complete': complete,
+               'infeasible': not routes and bool(infeasible_paths_info)}
+    except Exception as e:
+        print(f"Streaming error: {str(e)}")
+        yield {'event': 'error', 'error': str(e)}
+
+def sweep_route_planning(start_address, end_address, scenarios, energy_consumption, time_budget=None,
+                         vehicle_profile=None):
+    """
+    What-if route planning for several batteries: one find_soc_scenarios search instead of a
+    test_route_planning run with its map per scenario. scenarios is a list of
+    (initial_soc, threshold_soc) pairs.
+    
+    Returns:
+    Dictionary with the start and end coordinates, the routes of all scenarios (coordinates,
+    time, safety_km) with their list index as route ID, and for every scenario the IDs and remaining SOC of its
+    routes, or infeasible with the charging stations near the last reachable node. Scenarios
+    without a route within range are not planned with charging stops. complete is False when
+    the search budget stopped the search. An error message for the user raises ValueError.
+    """
+    road_network, intersections, start_coords, end_coords, start_node, end_node = locate_route(
+        start_address, end_address)
+    nearest_stations = build_nearest_stations(road_network, intersections)
+    
+    results = find_soc_scenarios(road_network, nearest_stations, start_node, end_node, 10, scenarios,
+                                 energy_consumption, station_table=_cached_station_table,
+                                 landmarks=_cached_landmarks, time_budget=time_budget,
+                                 vehicle_profile=vehicle_profile)
+    
+    routes = []
+    route_ids = {}
+    scenario_results = []
+    complete = True
+    for (initial_soc, threshold_soc), (paths, costs, infeasible_paths_info, socs) in zip(scenarios, results):
+        scenario_routes = []
+        for path, cost, remaining_soc in zip(paths, costs, socs):
+            complete = complete and cost['complete']
+            route_id = route_ids.setdefault(tuple(path), len(route_ids))
+            if route_id == len(routes):
+                routes.append({
+                    'coordinates': [[round(road_network.nodes[node]['y'], 5), round(road_network.nodes[node]['x'], 5)]
+                                    for node in path],
+                    'time': round(cost['time'], 1),
+                    'safety_km': round(cost['safety'] / 1000, 2)
+                })
+            scenario_routes.append({'route': route_id, 'soc': round(remaining_soc, 1)})
+        
+        scenario_results.append({
+            'initial_soc': initial_soc,
+            'threshold_soc': threshold_soc,
+            'routes': scenario_routes,
+            'infeasible': not paths,
+            'charging_stations': [info['nearest_charging_station'] for info in infeasible_paths_info
+                                  if info['nearest_charging_station']] if not paths else []
+        })
+    
+    return {'start': list(start_coords), 'end': list(end_coords), 'routes': routes, 'scenarios': scenario_results,
+            'complete': complete}
+
+def test_route_planning(start_address, end_address, initial_soc, threshold_soc, energy_consumption, search_engine=None,
+                        time_budget=None, vehicle_profile=None, two_segment_candidates=None):
     """
     Test route planning with given parameters and return the results.
     This function is the main entry point for the route planning process. It loads necessary data, 
     geocodes the start and end addresses, and then calls the route_planning function to find the optimal paths. 
+    search_engine selects the Pareto search from SEARCH_ENGINES and defaults to SEARCH_ENGINE.
+    The "charging" engine is the only search of a request: it returns direct routes and routes
+    with charging stops alike, or the overlay route for trips beyond a full battery. The other
+    engines search direct routes and fall back to a route with charging stops (with
+    CHARGING_SEARCH) or the two-segment route via a charging station when none is feasible.
+    time_budget bounds each route search in seconds (default SEARCH_TIME_BUDGET); a search that
+    runs out of it returns its best paths so far with complete=False in their costs.
+    vehicle_profile names the energy model of vehicle_profiles.py (default VEHICLE_PROFILE) for
+    all searches, including the overlay and two-segment routes.
+    two_segment_candidates is the number of candidate charging stations the two-segment route
+    evaluates (default TWO_SEGMENT_CANDIDATES).
     
     """
+    search_engine = search_engine or SEARCH_ENGINE
+    two_segment_candidates = two_segment_candidates or TWO_SEGMENT_CANDIDATES
+    search_pareto_paths = SEARCH_ENGINES[search_engine]
+    
     try:
         road_network, charging_stations, intersections = load_bc_province_data()
         
@@ -456,34 +2495,28 @@ def test_route_planning(start_address, end_address, initial_soc, threshold_soc,
             print(f"Start node: {start_node} (distance: {start_dist:.2f}m)")
             print(f"End node: {end_node} (distance: {end_dist:.2f}m)")
             
-            nearest_stations = {}
-            road_network_nodes = set(road_network.nodes())
-            
-            for node_id, data in intersections.items():
-                node_id_int = int(node_id) if node_id.isdigit() else node_id
-                
-                if node_id_int not in road_network_nodes:
-                    continue
-                
-                if 'nearest_charging_station' in data and data['nearest_charging_station'] is not None:
-                    nearest_stations[node_id_int] = {
-                        'distance': data['nearest_charging_station']['distance'],
-                        'station': {
-                            'name': data['nearest_charging_station']['name'],
-                            'lat': data['nearest_charging_station']['location']['latitude'],
-                            'lon': data['nearest_charging_station']['location']['longitude']
-                        }
-                    }
-            
-            print(f"Prepared nearest stations data for {len(nearest_stations)} nodes")
+            nearest_stations = build_nearest_stations(road_network, intersections)
             
             print("Checking if start and end nodes are connected...")
             try:
-                test_path = nx.shortest_path(road_network, start_node, end_node)
+                # The landmarks usually settle this without a search, the contraction hierarchy always does
+                connected = _cached_landmarks.connected(start_node, end_node) if _cached_landmarks is not None else None
+                if connected is None and _cached_hierarchy is not None:
+                    connected = _cached_hierarchy.reachable(start_node, end_node)
+                if connected is False:
+                    raise nx.NetworkXNoPath(f"No path between {start_node} and {end_node}")
+                elif connected is None and isinstance(road_network, CompactGraph):
+                    if not road_network.has_path(start_node, end_node):
+                        raise nx.NetworkXNoPath(f"No path between {start_node} and {end_node}")
+                elif connected is None:
+                    test_path = nx.shortest_path(road_network, start_node, end_node)
                 print(f"Start and end nodes are connected with a path")
             except nx.NetworkXNoPath:
                 print("No path exists between start and end nodes!")
-                connected_components = list(nx.weakly_connected_components(road_network))
+                if isinstance(road_network, CompactGraph):
+                    connected_components = road_network.weakly_connected_components()
+                else:
+                    connected_components = list(nx.weakly_connected_components(road_network))
                 start_component = None
                 end_component = None
                 
@@ -532,12 +2565,49 @@ def test_route_planning(start_address, end_address, initial_soc, threshold_soc,
                 
                 return None, None, None, None, "invalid_address", None
             
-            print("Finding Pareto optimal paths...")
-            paths, costs, infeasible_paths_info, remaining_socs = find_pareto_paths(road_network, nearest_stations, start_node, end_node,
-                                                                max_paths=10, initial_soc=initial_soc, 
-                                                                threshold_soc=threshold_soc, energy_consumption=energy_consumption)
+            # Trips longer than a full battery need several stops, which the overlay plans. The lowest
+            # energy per km of the vehicle profile gives the longest range a full battery can have.
+            min_rate = energy_consumption * get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE).min_rate_factor
+            full_range = (100 - threshold_soc) / min_rate * 1000
+            long_trip = _cached_overlay is not None and haversine_distance(start_lat, start_lon, end_lat, end_lon) > full_range
+            
+            if search_engine == 'charging' and long_trip:
+                print("Planning a long-distance route over the charging stations...")
+                paths, costs, infeasible_paths_info, remaining_socs = find_overlay_route(
+                    road_network, nearest_stations, start_node, end_node,
+                    max_paths=10, initial_soc=initial_soc,
+                    threshold_soc=threshold_soc, energy_consumption=energy_consumption,
+                    station_table=_cached_station_table, vehicle_profile=vehicle_profile
+                )
+            else:
+                print("Finding Pareto optimal paths...")
+                paths, costs, infeasible_paths_info, remaining_socs = search_pareto_paths(road_network, nearest_stations, start_node, end_node,
+                                                                    max_paths=10, initial_soc=initial_soc, 
+                                                                    threshold_soc=threshold_soc, energy_consumption=energy_consumption,
+                                                                    station_table=_cached_station_table, landmarks=_cached_landmarks,
+                                                                    time_budget=time_budget, vehicle_profile=vehicle_profile)
             
-            if not paths and infeasible_paths_info:
+            # The charging engine and the overlay report no infeasible paths, so only the direct engines fall back
+            if not paths and infeasible_paths_info and CHARGING_SEARCH:
+                if long_trip:
+                    print("\n\nNo feasible direct paths found. Planning a long-distance route over the charging stations...")
+                    paths, costs, infeasible_paths_info, remaining_socs = find_overlay_route(
+                        road_network, nearest_stations, start_node, end_node,
+                        max_paths=10, initial_soc=initial_soc,
+                        threshold_soc=threshold_soc, energy_consumption=energy_consumption,
+                        station_table=_cached_station_table, vehicle_profile=vehicle_profile
+                    )
+                else:
+                    print("\n\nNo feasible direct paths found. Searching routes with charging stops...")
+                    paths, costs, infeasible_paths_info, remaining_socs = find_charging_routes(
+                        road_network, nearest_stations, start_node, end_node,
+                        max_paths=10, initial_soc=initial_soc,
+                        threshold_soc=threshold_soc, energy_consumption=energy_consumption,
+                        station_table=_cached_station_table, landmarks=_cached_landmarks,
+                        time_budget=time_budget, vehicle_profile=vehicle_profile
+                    )
+
+            elif not paths and infeasible_paths_info:
                 print("\n\nNo feasible direct paths found. Attempting two-segment route with charging station...")
                 
                 stations_dict = {}
@@ -554,31 +2624,68 @@ def test_route_planning(start_address, end_address, initial_soc, threshold_soc,
                                 'paths': []
                             }
                         stations_dict[info['station_id']]['paths'].append(info['path_index'])
-                
+
+                # The other nearest stations of the last reachable nodes are candidates as well
+                for info in infeasible_paths_info:
+                    for station in info.get('fallback_stations', [])[1:]:
+                        station_lat = station['location']['latitude']
+                        station_lon = station['location']['longitude']
+                        station_id = f"{station['name']}|{station_lat}|{station_lon}"
+                        if station_id not in stations_dict:
+                            stations_dict[station_id] = {
+                                'station_info': f"{station['name']} (Location: {station_lat:.6f}, {station_lon:.6f})",
+                                'station_name': station['name'],
+                                'station_location': {'latitude': station_lat, 'longitude': station_lon},
+                                'paths': []
+                            }
+                        stations_dict[station_id]['paths'].append(info['path_index'])
+
                 if stations_dict:
-                    first_station_id = list(stations_dict.keys())[0]
-                    charging_station = stations_dict[first_station_id]
+                    # Candidate stations in order of preference: fastest via the station first when the
+                    # contraction hierarchy is loaded, otherwise in the order of the infeasible paths
+                    candidates = []
+                    if _cached_hierarchy is not None:
+                        candidates = rank_charging_stations(road_network, _cached_hierarchy, stations_dict,
+                                                            start_node, end_node, initial_soc, threshold_soc,
+                                                            energy_consumption, vehicle_profile)
+                        if candidates:
+                            print(f"\nRanked {len(candidates)} charging stations by fastest travel time via the station, "
+                                  f"best: {candidates[0]['time']:.1f}s ({'within' if candidates[0]['in_range'] else 'out of'} range)")
+                    if not candidates:
+                        for station_id, station in stations_dict.items():
+                            location = station['station_location']
+                            node, node_distance = find_nearest_node(road_network, location['latitude'], location['longitude'])
+                            if node is not None:
+                                candidates.append({'station_id': station_id, 'node': node, 'node_distance': node_distance})
+                            if len(candidates) == two_segment_candidates:
+                                break
+                    candidates = candidates[:two_segment_candidates]
+                    
+                    if not candidates:
+                        print("Could not find a road network node near the charging station.")
+                        return None, None, None, None
+                    
+                    print(f"\nSearching both sections via {len(candidates)} candidate charging stations...")
+                    evaluated_stations = evaluate_charging_stations(road_network, nearest_stations, candidates,
+                                                                    start_node, end_node, initial_soc,
+                                                                    threshold_soc, energy_consumption,
+                                                                    budget=time_budget or TWO_SEGMENT_BUDGET,
+                                                                    vehicle_profile=vehicle_profile)
+                    best_station = evaluated_stations[0]
+                    charging_station = stations_dict[best_station['station_id']]
+                    charging_station_node = best_station['node']
+                    charging_station_dist = best_station['node_distance']
                     
                     print(f"\nPlanning two-segment route via charging station: {charging_station['station_name']}")
                     
                     charging_station_lat = charging_station['station_location']['latitude']
                     charging_station_lon = charging_station['station_location']['longitude']
-                    
-                    charging_station_node, charging_station_dist = find_nearest_node(road_network, charging_station_lat, charging_station_lon)
-                    
-                    if charging_station_node is None:
-                        print("Could not find a road network node near the charging station.")
-                        return None, None, None, None
 
                     print(f"Found charging station node at coordinates: ({charging_station_lat}, {charging_station_lon})")
                     print(f"Node ID: {charging_station_node}, Distance: {charging_station_dist:.2f}m")
                     
                     print("\n--- Section 1: Start to Charging Station ---")
-                    section1_paths, section1_costs, section1_infeasible, section1_socs = find_pareto_paths(
-                        road_network, nearest_stations, start_node, charging_station_node,
-                        max_paths=5, initial_soc=initial_soc, 
-                        threshold_soc=threshold_soc, energy_consumption=energy_consumption
-                    )
+                    section1_paths, section1_costs, section1_infeasible, section1_socs = best_station['section1']
 
                     for i, (path, cost, soc) in enumerate(zip(section1_paths, section1_costs, section1_socs)):
                         # Calculate charging time from current SOC to 100%
@@ -590,11 +2697,10 @@ def test_route_planning(start_address, end_address, initial_soc, threshold_soc,
                         print(f"Path {i+1}: Travel time: {cost['time']:.1f}s, Charging time: {charging_time:.1f}s, Total time: {cost['total_time']:.1f}s")
                     
                     print("\n--- Section 2: Charging Station to End ---")
-                    section2_paths, section2_costs, section2_infeasible, section2_socs = find_pareto_paths(
-                        road_network, nearest_stations, charging_station_node, end_node,
-                        max_paths=5, initial_soc=100,  
-                        threshold_soc=threshold_soc, energy_consumption=energy_consumption
-                    )
+                    section2_paths, section2_costs, section2_infeasible, section2_socs = best_station['section2']
+                    
+                    for i, (path, cost) in enumerate(zip(section2_paths, section2_costs)):
+                        print(f"Path {i+1}: Travel time: {cost['time']:.1f}s, Safety: {cost['safety'] / 1000:.2f}km")
                     
                     if section1_paths and section2_paths:
                         print(f"\nFound {len(section1_paths)} paths for Section 1 and {len(section2_paths)} paths for Section 2")
@@ -681,18 +2787,24 @@ def test_route_planning(start_address, end_address, initial_soc, threshold_soc,
         traceback.print_exc()
         return None, None, None, None, "invalid_address", None
 
-def load_bc_province_data(force_reload=False):
+def load_bc_province_data(force_reload=False, graph_backend=None):
     """
     Load BC province data files from local storage with caching
     
     Parameters:
     force_reload (bool): Whether to force reload data even if cached
+    graph_backend (str): "compact" or "networkx", defaults to GRAPH_BACKEND
     
     Returns:
-    Tuple of (road_network, charging_stations, intersections)
+    Tuple of (road_network, charging_stations, intersections), intersections is the
+    NearestStationTable when intersections_bc_regions_topk.npz is the newest nearest station file
     """
-    global _cached_road_network, _cached_charging_stations, _cached_intersections
+    global _cached_road_network, _cached_charging_stations, _cached_intersections, _cached_station_table, _cached_landmarks
+    global _cached_hierarchy, _cached_overlay
     
+    graph_backend = graph_backend or GRAPH_BACKEND
+    if graph_backend == 'networkx' and isinstance(_cached_road_network, CompactGraph):
+        force_reload = True
 
     if not force_reload and _cached_road_network is not None and _cached_charging_stations is not None and _cached_intersections is not None:
         print("Using cached data (road network, charging stations, intersections)")
@@ -700,67 +2812,88 @@ def load_bc_province_data(force_reload=False):
     
     print("Loading BC province data from local files...")
     
+    # calculate_nearest_stations writes the compacted JSON, the NDJSON stream (usable without compacting
+    # it first) or with --top-k the columnar station table, which spares the per-node dictionaries.
+    # The most recently written of them holds the current stations.
+    station_table_file = 'intersections_bc_regions_topk.npz'
+    intersections_file = newest_file(['intersections_bc_regions.json', 'intersections_bc_regions.ndjson',
+                                      station_table_file]) or 'intersections_bc_regions.json'
+    print(f"Using the nearest station data of {intersections_file}")
+    
+    # The binary snapshot written by get_road_networks / graph_snapshot.py loads much faster than the JSON
+    use_snapshot = graph_snapshot.snapshot_is_current()
+    
     bc_files_exist = all(os.path.exists(f) for f in [
-        'roads_bc_regions.json', 
+        graph_snapshot.SNAPSHOT_DIR if use_snapshot else 'roads_bc_regions.json', 
         'charging_stations_bc_regions.json', 
-        'intersections_bc_regions.json'
+        intersections_file
     ])
     
     if not bc_files_exist:
         print("Error: Required data files not found. Please ensure the following files exist:")
-        print("- roads_bc_regions.json")
+        print("- roads_bc_regions.json (or the roads_bc_regions.snapshot directory)")
         print("- charging_stations_bc_regions.json")
-        print("- intersections_bc_regions.json")
+        print("- intersections_bc_regions.json (or intersections_bc_regions.ndjson / intersections_bc_regions_topk.npz)")
         return None, None, None
 
     try:
-        with open('roads_bc_regions.json', 'r', encoding='utf-8') as f:
-            road_data = json.load(f)
+        if use_snapshot and graph_backend == 'compact':
+            road_network = CompactGraph.load()
+            print(f"Loaded compact road network from {graph_snapshot.SNAPSHOT_DIR}")
+        elif use_snapshot:
+            road_network = graph_snapshot.snapshot_to_networkx(graph_snapshot.load_graph_snapshot())
+            print(f"Loaded road network snapshot from {graph_snapshot.SNAPSHOT_DIR}")
+        else:
+            road_network = load_road_network_json('roads_bc_regions.json')
         
-        road_network = nx.MultiDiGraph()
+        print(f"Loaded road network with {len(road_network.nodes)} nodes and {len(road_network.edges)} edges")
         
-        for node_id, node_data in road_data['nodes'].items():
-            road_network.add_node(int(node_id) if node_id.isdigit() else node_id, **node_data)
+        # ALT landmarks written by landmarks.py, indexed like the snapshot
+        landmarks = None
+        if use_snapshot and LandmarkTable.exists():
+            landmarks = LandmarkTable()
+            print(f"Loaded {len(landmarks)} landmarks ({landmarks.nbytes / 2**20:.1f} MB)")
         
-        for edge in road_data['edges']:
-            source = int(edge['source']) if edge['source'].isdigit() else edge['source']
-            target = int(edge['target']) if edge['target'].isdigit() else edge['target']
-            key = edge['key']
-            
-            edge_data = {k: v for k, v in edge.items() if k not in ['source', 'target', 'key']}
-            
-            if 'geometry' in edge_data and isinstance(edge_data['geometry'], str):
-                try:
-                    edge_data['geometry'] = wkt.loads(edge_data['geometry'])
-                except:
-                    del edge_data['geometry']
-            
-            if 'travel_time' not in edge_data:
-                if 'length' in edge_data:
-                    length = edge_data['length']  
-                    speed = 13.89  
-                    edge_data['travel_time'] = length / speed  
-                else:
-                    edge_data['travel_time'] = 60 
-            
-            road_network.add_edge(source, target, key=key, **edge_data)
+        # Contraction hierarchy written by contraction_hierarchy.py, indexed like the snapshot
+        hierarchy = None
+        if use_snapshot and ContractionHierarchy.exists():
+            hierarchy = ContractionHierarchy()
+            print(f"Loaded contraction hierarchy with {hierarchy.num_shortcuts} shortcuts")
         
-        print(f"Loaded road network with {len(road_network.nodes)} nodes and {len(road_network.edges)} edges")
+        # Station-to-station legs written by station_overlay.py
+        overlay = None
+        if use_snapshot and StationOverlay.exists():
+            overlay = StationOverlay()
+            print(f"Loaded the station overlay with {len(overlay)} charging stations")
         
         with open('charging_stations_bc_regions.json', 'r') as f:
             charging_stations = json.load(f)
         
         print(f"Loaded {len(charging_stations)} charging stations")
         
-        with open('intersections_bc_regions.json', 'r') as f:
-            intersections = json.load(f)
+        station_table = None
+        if intersections_file == station_table_file:
+            station_table = NearestStationTable(station_table_file)
+            print(f"Loaded the {station_table.k} nearest charging stations of {len(station_table)} nodes")
+        elif os.path.exists(station_table_file):
+            print(f"Ignoring {station_table_file}, it is older than {intersections_file}")
         
-        print(f"Loaded {len(intersections)} intersections")
+        if station_table is not None:
+            intersections = station_table
+        else:
+            intersections = load_intersections(intersections_file)
+            print(f"Loaded {len(intersections)} intersections")
         
+        # Edge and node costs of the label searches, prepared here instead of on the first request
+        search_arrays(road_network, build_nearest_stations(road_network, intersections))
 
         _cached_road_network = road_network
         _cached_charging_stations = charging_stations
         _cached_intersections = intersections
+        _cached_station_table = station_table
+        _cached_landmarks = landmarks
+        _cached_hierarchy = hierarchy
+        _cached_overlay = overlay
         
         return road_network, charging_stations, intersections
         
@@ -770,18 +2903,64 @@ def load_bc_province_data(force_reload=False):
         traceback.print_exc()
         return None, None, None
 
-def calculate_remaining_soc(path, road_network, initial_soc, energy_consumption):
+def load_road_network_json(roads_file):
+    """
+    Build the road network graph from roads_bc_regions.json
+    
+    Parameters:
+    roads_file (str): road network JSON file
+    
+    Returns:
+    networkx MultiDiGraph of the road network
+    """
+    with open(roads_file, 'r', encoding='utf-8') as f:
+        road_data = json.load(f)
+    
+    road_network = nx.MultiDiGraph()
+    
+    for node_id, node_data in road_data['nodes'].items():
+        road_network.add_node(int(node_id) if node_id.isdigit() else node_id, **node_data)
+        
+    for edge in road_data['edges']:
+        source = int(edge['source']) if edge['source'].isdigit() else edge['source']
+        target = int(edge['target']) if edge['target'].isdigit() else edge['target']
+        key = edge['key']
+            
+        edge_data = {k: v for k, v in edge.items() if k not in ['source', 'target', 'key']}
+            
+        if 'geometry' in edge_data and isinstance(edge_data['geometry'], str):
+            try:
+                edge_data['geometry'] = wkt.loads(edge_data['geometry'])
+            except:
+                del edge_data['geometry']
+            
+        if 'travel_time' not in edge_data:
+            if 'length' in edge_data:
+                length = edge_data['length']  
+                speed = 13.89  
+                edge_data['travel_time'] = length / speed  
+            else:
+                edge_data['travel_time'] = 60 
+            
+        road_network.add_edge(source, target, key=key, **edge_data)
+    
+    return road_network
+
+def calculate_remaining_soc(path, road_network, initial_soc, energy_consumption, vehicle_profile=None):
     """
     Calculate the remaining state of charge (SOC) after traveling along a path
     
     path: list of node IDs representing the path
-    road_network: NetworkX graph of the road network
+    road_network: NetworkX graph (or CompactGraph) of the road network
     initial_soc: initial state of charge (percentage)
     energy_consumption: energy consumption rate (percentage per km)
+    vehicle_profile: name or VehicleProfile of vehicle_profiles.py, defaults to VEHICLE_PROFILE
     
     Returns: remaining SOC (percentage)
     """
+    vehicle_profile = get_vehicle_profile(vehicle_profile or VEHICLE_PROFILE)
     total_distance = 0
+    energy_consumed = 0
     
     for i in range(len(path) - 1):
         try:
@@ -795,13 +2974,19 @@ def calculate_remaining_soc(path, road_network, initial_soc, energy_consumption)
                 distance = haversine_distance(start_y, start_x, end_y, end_x)
             
             total_distance += distance
+            if not vehicle_profile.is_constant:
+                energy_consumed += vehicle_profile.edge_energy(distance, edge_travel_time(edge_data),
+                                                               edge_data.get('highway', ''), energy_consumption)
         except Exception as e:
             print(f"Error calculating distance for edge ({path[i]}, {path[i+1]}): {str(e)}")
             total_distance += 500 
+            if not vehicle_profile.is_constant:
+                energy_consumed += 0.5 * energy_consumption
     
     total_distance_km = total_distance / 1000
     
-    energy_consumed = total_distance_km * energy_consumption
+    if vehicle_profile.is_constant:
+        energy_consumed = total_distance_km * energy_consumption
     
     remaining_soc = initial_soc - energy_consumed
     
@@ -827,6 +3012,9 @@ def find_nearest_node(G, lat, lon):
     Find the nearest node in the graph to the given coordinates
     Returns (node_id, distance) tuple
     """
+    if isinstance(G, CompactGraph):
+        return G.nearest_node(lat, lon)
+    
     min_distance = float('inf')
     nearest_node = None
     
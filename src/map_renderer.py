@@ -274,6 +274,9 @@ def display_paths_on_map(road_network, charging_stations, paths, costs, remainin
         #     tooltip=f"Path {i+1}: {cost['time']:.1f}s, {cost['safety']/1000:.2f}km"
         # ).add_to(m)
         group_name = f"Path {i+1}: {int(cost['time']//60)}m {int(cost['time']%60)}s, {cost['safety']/1000:.2f} km"
+        charging_stops = cost.get('charging_stops', [])
+        if charging_stops:
+            group_name += f", {len(charging_stops)} charging stop{'s' if len(charging_stops) > 1 else ''}"
         feature_group = folium.FeatureGroup(name=group_name)
 
         # Route line
@@ -284,7 +287,17 @@ def display_paths_on_map(road_network, charging_stations, paths, costs, remainin
             opacity=0.8,
             tooltip=group_name
         ).add_to(feature_group)
-        
+
+        # Charging stops of routes planned with find_charging_routes
+        for stop in charging_stops:
+            if 'latitude' not in stop:
+                continue
+            folium.Marker(
+                [stop['latitude'], stop['longitude']],
+                popup=f"Charging Stop: {stop['name']} ({format_time(stop['charging_time'])} charging)",
+                icon=folium.Icon(icon="bolt", prefix="fa", color="purple", icon_color="white")
+            ).add_to(feature_group)
+
         max_dist = 0
         critical_node = None
         for node in path:
@@ -343,7 +356,7 @@ def display_paths_on_map(road_network, charging_stations, paths, costs, remainin
             'color': color,
             'time': cost['time'],
             'max_dist': cost['safety'],
-            'description': f"Path {i+1}",
+            'description': f"Path {i+1}" + (f" ({len(charging_stops)} charging stops)" if charging_stops else ""),
             'critical_dist': max_dist / 1000 if critical_node else 0,
             'remaining_soc': remaining_socs[i] if i < len(remaining_socs) else 0  
         })
@@ -0,0 +1,289 @@
+"""
+Station-to-station overlay graph for long trips with several charging stops.
+An offline step runs a Dijkstra on travel time from every charging station of the
+graph snapshot, bounded by the maximum battery range, and keeps the travel time and
+length of the fastest path it finds to every other station within range. The legs
+are stored as CSR arrays over the stations in the snapshot directory, so a route
+with many stops is planned over a few thousand stations instead of the road network.
+"""
+import json
+import os
+import time
+import heapq
+import argparse
+import multiprocessing
+
+import numpy as np
+
+import graph_snapshot
+from compact_graph import CompactGraph
+
+
+OVERLAY_MANIFEST = "station_overlay.json"
+OVERLAY_ARRAYS = ["overlay_stations", "overlay_offsets", "overlay_targets", "overlay_time", "overlay_length"]
+# Longest leg between two stations, above the range of the vehicles on the road today
+DEFAULT_MAX_RANGE_KM = 500
+
+# CSR lists and station positions shared with the pool workers, inherited through fork
+_overlay_context = None
+
+def bounded_station_search(offsets, targets, travel_time, length, source, max_length, station_position):
+    """
+    Dijkstra on travel time from a dense node index over CSR lists that does not extend
+    paths longer than max_length meters. Every node keeps only its fastest path, so a
+    station can be missed when the fastest paths through some node are too long while a
+    slower, shorter one would reach it. A second Dijkstra on length finds those stations,
+    and they get the leg of their shortest path. Edges without a length (NaN) are skipped.
+
+    Returns:
+    List of (station position, travel time, length) of all stations within max_length of
+    source by road, without source itself. A leg is the fastest path the search found within
+    range, not necessarily the fastest of all paths within range.
+    """
+    legs = {}
+    for weight in (travel_time, length):
+        costs = {source: 0.0}
+        times = {source: 0.0}
+        lengths = {source: 0.0}
+        heap = [(0.0, source)]
+
+        while heap:
+            node_cost, node = heapq.heappop(heap)
+            if node_cost > costs[node]:
+                continue
+            if node != source and node in station_position and station_position[node] not in legs:
+                legs[station_position[node]] = (times[node], lengths[node])
+
+            node_time = times[node]
+            node_length = lengths[node]
+            for position in range(offsets[node], offsets[node + 1]):
+                new_length = node_length + length[position]
+                # Also false for a NaN length
+                if not new_length <= max_length:
+                    continue
+                target = targets[position]
+                new_cost = node_cost + weight[position]
+                if new_cost < costs.get(target, float('inf')):
+                    costs[target] = new_cost
+                    times[target] = node_time + travel_time[position]
+                    lengths[target] = new_length
+                    heapq.heappush(heap, (new_cost, target))
+
+    return [(station, leg_time, leg_length) for station, (leg_time, leg_length) in legs.items()]
+
+def station_legs(station):
+    """Pool worker: legs from the station at one position of the overlay"""
+    context = _overlay_context
+    return station, bounded_station_search(*context['csr'], context['stations'][station], context['max_length'],
+                                           context['station_position'])
+
+def build_overlay(graph, max_length, workers=None):
+    """
+    Legs between all pairs of stations of a CompactGraph within max_length meters,
+    searched from every station on a process pool with this many workers
+
+    Returns:
+    Tuple of (station dense indices, offsets, target positions, travel times, lengths)
+    """
+    global _overlay_context
+
+    stations = sorted(graph.station_names)
+    _overlay_context = {
+        'csr': (graph.offsets.tolist(), graph.targets.tolist(), graph.travel_time.tolist(), graph.length.tolist()),
+        'stations': stations,
+        'station_position': {node: position for position, node in enumerate(stations)},
+        'max_length': max_length,
+    }
+
+    workers = workers or multiprocessing.cpu_count()
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("    Process pools need the fork start method to share the graph, searching in this process")
+        workers = 1
+
+    legs = [None] * len(stations)
+    start_time = time.time()
+    try:
+        if workers > 1 and len(stations) > 1:
+            with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+                results = pool.imap_unordered(station_legs, range(len(stations)), chunksize=4)
+                for done, (station, station_result) in enumerate(results, 1):
+                    legs[station] = station_result
+                    if done % 100 == 0:
+                        print(f"    Searched {done}/{len(stations)} stations ({time.time() - start_time:.1f}s)")
+        else:
+            for station in range(len(stations)):
+                legs[station] = station_legs(station)[1]
+    finally:
+        _overlay_context = None
+
+    offsets = [0]
+    overlay_targets = []
+    overlay_time = []
+    overlay_length = []
+    for station_result in legs:
+        for target, leg_time, leg_length in sorted(station_result):
+            overlay_targets.append(target)
+            overlay_time.append(leg_time)
+            overlay_length.append(leg_length)
+        offsets.append(len(overlay_targets))
+
+    return (np.array(stations, dtype=np.int32), np.array(offsets, dtype=np.int64),
+            np.array(overlay_targets, dtype=np.int32), np.array(overlay_time, dtype=np.float32),
+            np.array(overlay_length, dtype=np.float32))
+
+def write_station_overlay(snapshot_dir=graph_snapshot.SNAPSHOT_DIR, max_range_km=DEFAULT_MAX_RANGE_KM, workers=None):
+    """
+    Build the station overlay of a graph snapshot and store its arrays next to it.
+    Rewriting the snapshot replaces its directory, which drops a stale overlay.
+    """
+    start_time = time.time()
+    graph = CompactGraph.load(snapshot_dir)
+
+    print(f"Searching the legs between {len(graph.station_names)} charging stations "
+          f"within {max_range_km} km in {snapshot_dir}...")
+    stations, offsets, targets, leg_time, leg_length = build_overlay(graph, max_range_km * 1000, workers)
+
+    arrays = {
+        "overlay_stations": stations,
+        "overlay_offsets": offsets,
+        "overlay_targets": targets,
+        "overlay_time": leg_time,
+        "overlay_length": leg_length,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(snapshot_dir, name + ".npy"), array)
+
+    manifest = {
+        "num_nodes": len(graph.node_ids),
+        "num_stations": len(stations),
+        "num_legs": len(targets),
+        "max_range_m": max_range_km * 1000,
+        "created_date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(snapshot_dir, OVERLAY_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    overlay_bytes = sum(array.nbytes for array in arrays.values())
+    print(f"    ✓ Saved {len(targets)} legs between {len(stations)} stations to {snapshot_dir} "
+          f"({overlay_bytes / 2**20:.1f} MB)")
+    print(f"    Total time: {time.time() - start_time:.1f}s")
+
+
+class StationOverlay:
+    def __init__(self, snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        """
+        Read-only station-to-station legs of a graph snapshot
+
+        The arrays are memory-mapped, one CSR row of legs per station. Stations are
+        exposed by their node IDs.
+
+        Args:
+            snapshot_dir (str): snapshot directory the overlay was written to
+        """
+        with open(os.path.join(snapshot_dir, OVERLAY_MANIFEST), "r") as f:
+            manifest = json.load(f)
+
+        snapshot = graph_snapshot.load_graph_snapshot(snapshot_dir)
+        if manifest["num_nodes"] != snapshot["num_nodes"]:
+            raise ValueError(f"station overlay in {snapshot_dir} does not match the graph snapshot, "
+                             f"run station_overlay.py again")
+
+        arrays = {name: np.load(os.path.join(snapshot_dir, name + ".npy"), mmap_mode='r').view(np.ndarray)
+                  for name in OVERLAY_ARRAYS}
+        self.offsets = arrays["overlay_offsets"]
+        self.targets = arrays["overlay_targets"]
+        self.leg_time = arrays["overlay_time"]
+        self.leg_length = arrays["overlay_length"]
+        self.max_range = manifest["max_range_m"]
+
+        self.station_ids = snapshot["node_ids"][arrays["overlay_stations"]].tolist()
+        self._position = {node: position for position, node in enumerate(self.station_ids)}
+
+    @staticmethod
+    def exists(snapshot_dir=graph_snapshot.SNAPSHOT_DIR):
+        return os.path.exists(os.path.join(snapshot_dir, OVERLAY_MANIFEST))
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def __contains__(self, node):
+        return node in self._position
+
+    def plan(self, start_departures, end_legs, max_leg_energy, leg_energy, charging_time):
+        """
+        Fastest sequence of stations with a Dijkstra over the departure times at the
+        stations. Every stop charges to full, so the state at a departure is the same
+        for every way of reaching the station.
+
+        Args:
+            start_departures (dict): station node ID -> departure time after the first stop
+            end_legs (dict): station node ID -> travel time of the last leg to the destination
+            max_leg_energy (float): most energy in % SOC a leg may use on a full battery
+            leg_energy (callable): energy in % SOC of a leg of the given length and travel time
+            charging_time (callable): charging time in seconds after a leg using the given energy
+
+        Returns:
+        Tuple of (station node IDs of the stops, arrival time at the destination),
+        (None, inf) if the stations do not connect start and destination
+        """
+        departures = {}
+        parent = {}
+        heap = []
+        for node, departure in start_departures.items():
+            position = self._position.get(node)
+            if position is not None and departure < departures.get(position, float('inf')):
+                departures[position] = departure
+                parent[position] = None
+                heap.append((departure, position))
+        heapq.heapify(heap)
+
+        end_times = {self._position[node]: leg_time for node, leg_time in end_legs.items() if node in self._position}
+        best_time = float('inf')
+        best_station = None
+
+        while heap:
+            departure, station = heapq.heappop(heap)
+            if departure > departures[station]:
+                continue
+            if departure >= best_time:
+                break
+
+            if station in end_times and departure + end_times[station] < best_time:
+                best_time = departure + end_times[station]
+                best_station = station
+
+            start, end = int(self.offsets[station]), int(self.offsets[station + 1])
+            for target, leg_time, leg_length in zip(self.targets[start:end].tolist(), self.leg_time[start:end].tolist(),
+                                                    self.leg_length[start:end].tolist()):
+                if leg_length > self.max_range:
+                    continue
+                energy = leg_energy(leg_length, leg_time)
+                if energy > max_leg_energy:
+                    continue
+                new_departure = departure + leg_time + charging_time(energy)
+                if new_departure < departures.get(target, float('inf')):
+                    departures[target] = new_departure
+                    parent[target] = station
+                    heapq.heappush(heap, (new_departure, target))
+
+        if best_station is None:
+            return None, float('inf')
+
+        stops = []
+        station = best_station
+        while station is not None:
+            stops.append(self.station_ids[station])
+            station = parent[station]
+        stops.reverse()
+        return stops, best_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the station-to-station overlay graph for the graph snapshot")
+    parser.add_argument("--snapshot", default=graph_snapshot.SNAPSHOT_DIR, help="graph snapshot directory")
+    parser.add_argument("--max-range-km", type=float, default=DEFAULT_MAX_RANGE_KM,
+                        help="longest leg between two charging stations")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="search the stations on a process pool with this many workers")
+    args = parser.parse_args()
+
+    write_station_overlay(args.snapshot, args.max_range_km, args.workers)
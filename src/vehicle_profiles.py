@@ -0,0 +1,117 @@
+"""
+Vehicle energy profiles for the route planner.
+A profile turns the consumption rate entered by the user (% SOC per km at the profile's
+reference speed) into the energy of every road edge: the aerodynamic share of the
+consumption grows with the square of the edge speed, stop-and-go road classes cost extra
+(partly recovered by regenerative braking), and an auxiliary load (climate control,
+electronics) draws SOC per hour of driving. The "constant" profile is the original model
+of a fixed rate per km. Energy arrays over all edges are computed with NumPy in one pass.
+"""
+import numpy as np
+
+
+# Extra consumption of road classes with frequent braking and acceleration, before regeneration
+STOP_AND_GO = {
+    'residential': 0.20,
+    'living_street': 0.25,
+    'unclassified': 0.15,
+    'service': 0.20,
+    'tertiary': 0.10,
+    'secondary': 0.05,
+    'primary': 0.05,
+}
+
+class VehicleProfile:
+    def __init__(self, name, reference_speed=80, aero_share=0.0, stop_and_go=None, regen_efficiency=0.0,
+                 auxiliary_load=0.0):
+        """
+        Energy model of one vehicle type
+
+        Args:
+            name (str): key of the profile in VEHICLE_PROFILES
+            reference_speed (float): speed in km/h at which the consumption rate of the request applies
+            aero_share (float): share of the consumption at reference_speed that grows with the square of speed
+            stop_and_go (dict): highway class -> extra consumption share from braking and accelerating
+            regen_efficiency (float): share of the stop-and-go extra recovered by regenerative braking
+            auxiliary_load (float): % SOC per hour drawn by climate control and electronics
+        """
+        self.name = name
+        self.reference_speed = reference_speed
+        self.aero_share = aero_share
+        self.stop_and_go = stop_and_go or {}
+        self.regen_efficiency = regen_efficiency
+        self.auxiliary_load = auxiliary_load
+
+    @property
+    def is_constant(self):
+        """True if the energy of an edge is its length times the consumption rate"""
+        return self.aero_share == 0 and not self.stop_and_go and self.auxiliary_load == 0
+
+    @property
+    def min_rate_factor(self):
+        """Lower bound on the energy per km as a multiple of the consumption rate, for pruning"""
+        return 1 - self.aero_share
+
+    def class_factor(self, highway):
+        """Consumption multiplier of a highway class after regenerative braking"""
+        if isinstance(highway, list):
+            highway = highway[0] if highway else ''
+        extra = self.stop_and_go.get(highway, 0)
+        return 1 + extra * (1 - self.regen_efficiency)
+
+    def _driving_km(self, length, travel_time, class_factor):
+        """Length in km weighted by the speed and class factors, for scalars or arrays"""
+        speed = np.divide(length * 3.6, travel_time, out=np.full_like(length, float(self.reference_speed)),
+                          where=travel_time > 0)
+        speed_factor = 1 - self.aero_share + self.aero_share * (speed / self.reference_speed) ** 2
+        return length / 1000 * class_factor * speed_factor
+
+    def edge_energy(self, length, travel_time, highway, energy_consumption):
+        """% SOC used on one edge"""
+        if self.is_constant:
+            return length / 1000 * energy_consumption
+        driving_km = self._driving_km(np.float64(length), np.float64(travel_time), self.class_factor(highway))
+        return float(driving_km) * energy_consumption + self.auxiliary_load * travel_time / 3600
+
+    def edge_terms(self, length, travel_time, highway, highway_classes):
+        """
+        Consumption-independent energy terms of every edge, in one NumPy pass. The % SOC
+        of an edge is energy_consumption * driving_km + auxiliary.
+
+        Args:
+            length, travel_time (np.ndarray): per-edge length in meters and travel time in seconds
+            highway (np.ndarray): per-edge index into highway_classes
+            highway_classes (list): highway values of the edges
+
+        Returns:
+            Tuple of (driving_km, auxiliary) float64 arrays, auxiliary is None without auxiliary load
+        """
+        length = np.asarray(length, dtype=np.float64)
+        if self.is_constant:
+            return length / 1000, None
+        travel_time = np.asarray(travel_time, dtype=np.float64)
+        class_factors = np.array([self.class_factor(highway_class) for highway_class in highway_classes] or [1.0])
+        driving_km = self._driving_km(length, travel_time, class_factors[highway])
+        auxiliary = self.auxiliary_load * travel_time / 3600 if self.auxiliary_load else None
+        return driving_km, auxiliary
+
+
+VEHICLE_PROFILES = {
+    'constant': VehicleProfile('constant'),
+    'compact': VehicleProfile('compact', reference_speed=80, aero_share=0.35, stop_and_go=STOP_AND_GO,
+                              regen_efficiency=0.6, auxiliary_load=1.0),
+    'sedan': VehicleProfile('sedan', reference_speed=90, aero_share=0.3, stop_and_go=STOP_AND_GO,
+                            regen_efficiency=0.65, auxiliary_load=0.8),
+    'suv': VehicleProfile('suv', reference_speed=80, aero_share=0.45, stop_and_go=STOP_AND_GO,
+                          regen_efficiency=0.5, auxiliary_load=1.2),
+    'pickup': VehicleProfile('pickup', reference_speed=80, aero_share=0.5, stop_and_go=STOP_AND_GO,
+                             regen_efficiency=0.45, auxiliary_load=1.5),
+}
+
+def get_vehicle_profile(profile):
+    """VehicleProfile for a profile name (or a VehicleProfile), ValueError for unknown names"""
+    if isinstance(profile, VehicleProfile):
+        return profile
+    if profile not in VEHICLE_PROFILES:
+        raise ValueError(f"unknown vehicle profile {profile!r}, expected one of {', '.join(VEHICLE_PROFILES)}")
+    return VEHICLE_PROFILES[profile]